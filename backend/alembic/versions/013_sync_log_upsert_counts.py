@@ -0,0 +1,25 @@
+"""
+Add upgraded/skipped counters to nfe_sync_logs
+
+Revision ID: 013
+Revises: 012
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '013'
+down_revision = '012'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('nfe_sync_logs', sa.Column('docs_upgraded', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('nfe_sync_logs', sa.Column('docs_skipped', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade() -> None:
+    op.drop_column('nfe_sync_logs', 'docs_skipped')
+    op.drop_column('nfe_sync_logs', 'docs_upgraded')
@@ -0,0 +1,25 @@
+"""
+Add next_sync_at to sefaz_dfe_state (adaptive sync scheduling)
+
+Revision ID: 014
+Revises: 013
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '014'
+down_revision = '013'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('sefaz_dfe_state', sa.Column('next_sync_at', sa.DateTime(), nullable=True))
+    op.create_index('idx_sefaz_dfe_state_next_sync', 'sefaz_dfe_state', ['next_sync_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('idx_sefaz_dfe_state_next_sync', table_name='sefaz_dfe_state')
+    op.drop_column('sefaz_dfe_state', 'next_sync_at')
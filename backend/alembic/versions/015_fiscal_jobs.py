@@ -0,0 +1,44 @@
+"""
+Add fiscal_jobs table (background sync/resolve/import jobs)
+
+Revision ID: 015
+Revises: 014
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '015'
+down_revision = '014'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'fiscal_jobs',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True, server_default=sa.text('gen_random_uuid()')),
+        sa.Column('kind', sa.String(length=30), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='queued'),
+        sa.Column('params', sa.JSON(), nullable=True),
+        sa.Column('progress', sa.JSON(), nullable=True),
+        sa.Column('result', sa.JSON(), nullable=True),
+        sa.Column('docs_found', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('docs_imported', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('error_message', sa.Text(), nullable=True),
+        sa.Column('created_by', sa.Integer(), sa.ForeignKey('users.id', ondelete='SET NULL'), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.text('now()')),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('heartbeat_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('idx_fiscal_jobs_status', 'fiscal_jobs', ['status'])
+    op.create_index('idx_fiscal_jobs_created_at', 'fiscal_jobs', ['created_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('idx_fiscal_jobs_created_at', table_name='fiscal_jobs')
+    op.drop_index('idx_fiscal_jobs_status', table_name='fiscal_jobs')
+    op.drop_table('fiscal_jobs')
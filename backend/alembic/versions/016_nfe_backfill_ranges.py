@@ -0,0 +1,40 @@
+"""
+Add nfe_backfill_ranges table (parallel NSU backfill)
+
+Revision ID: 016
+Revises: 015
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '016'
+down_revision = '015'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'nfe_backfill_ranges',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True, server_default=sa.text('gen_random_uuid()')),
+        sa.Column('company_id', sa.Integer(), sa.ForeignKey('companies.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('nsu_start', sa.BigInteger(), nullable=False),
+        sa.Column('nsu_end', sa.BigInteger(), nullable=False),
+        sa.Column('next_nsu', sa.BigInteger(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='pending'),
+        sa.Column('docs_found', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('docs_imported', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.text('now()')),
+        sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=sa.text('now()')),
+        sa.UniqueConstraint('company_id', 'nsu_start', name='uq_backfill_company_start'),
+    )
+    op.create_index('idx_backfill_company_status', 'nfe_backfill_ranges', ['company_id', 'status'])
+
+
+def downgrade() -> None:
+    op.drop_index('idx_backfill_company_status', table_name='nfe_backfill_ranges')
+    op.drop_table('nfe_backfill_ranges')
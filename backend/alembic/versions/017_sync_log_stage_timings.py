@@ -0,0 +1,23 @@
+"""
+Add stage_timings to nfe_sync_logs
+
+Revision ID: 017
+Revises: 016
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '017'
+down_revision = '016'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('nfe_sync_logs', sa.Column('stage_timings', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('nfe_sync_logs', 'stage_timings')
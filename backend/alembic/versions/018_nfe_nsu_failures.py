@@ -0,0 +1,42 @@
+"""
+Add nfe_nsu_failures table (per-NSU ingestion retry)
+
+Revision ID: 018
+Revises: 017
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '018'
+down_revision = '017'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'nfe_nsu_failures',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True, server_default=sa.text('gen_random_uuid()')),
+        sa.Column('company_id', sa.Integer(), sa.ForeignKey('companies.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('nsu', sa.BigInteger(), nullable=False),
+        sa.Column('chave', sa.String(length=44), nullable=True),
+        sa.Column('doc_schema', sa.String(length=50), nullable=True),
+        sa.Column('stage', sa.String(length=20), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='pending'),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False, server_default=sa.text('now()')),
+        sa.Column('resolved_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.text('now()')),
+        sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=sa.text('now()')),
+        sa.UniqueConstraint('company_id', 'nsu', name='uq_nsu_failure_company_nsu'),
+    )
+    op.create_index('idx_nsu_failure_due', 'nfe_nsu_failures', ['company_id', 'status', 'next_attempt_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('idx_nsu_failure_due', table_name='nfe_nsu_failures')
+    op.drop_table('nfe_nsu_failures')
@@ -0,0 +1,40 @@
+"""
+Add nfe_events table (DF-e events applied to nfe_documents.situacao)
+
+Revision ID: 019
+Revises: 018
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '019'
+down_revision = '018'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'nfe_events',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True, server_default=sa.text('gen_random_uuid()')),
+        sa.Column('company_id', sa.Integer(), sa.ForeignKey('companies.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('chave', sa.String(length=44), nullable=False),
+        sa.Column('tp_evento', sa.String(length=10), nullable=False),
+        sa.Column('n_seq_evento', sa.Integer(), nullable=False, server_default='1'),
+        sa.Column('dh_evento', sa.DateTime(), nullable=True),
+        sa.Column('descricao', sa.String(length=100), nullable=True),
+        sa.Column('protocolo', sa.String(length=100), nullable=True),
+        sa.Column('nsu', sa.BigInteger(), nullable=True),
+        sa.Column('doc_schema', sa.String(length=50), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.text('now()')),
+        sa.UniqueConstraint('company_id', 'chave', 'tp_evento', 'n_seq_evento', name='uq_nfe_event'),
+    )
+    op.create_index('idx_nfe_events_chave', 'nfe_events', ['company_id', 'chave'])
+
+
+def downgrade() -> None:
+    op.drop_index('idx_nfe_events_chave', table_name='nfe_events')
+    op.drop_table('nfe_events')
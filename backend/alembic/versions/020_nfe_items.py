@@ -0,0 +1,47 @@
+"""
+Add nfe_items table (det/prod of full NF-e, filled at ingest)
+
+Revision ID: 020
+Revises: 019
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '020'
+down_revision = '019'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'nfe_items',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True, server_default=sa.text('gen_random_uuid()')),
+        sa.Column('company_id', sa.Integer(), sa.ForeignKey('companies.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('chave', sa.String(length=44), nullable=False),
+        sa.Column('n_item', sa.Integer(), nullable=False),
+        sa.Column('codigo_produto', sa.String(length=60), nullable=True),
+        sa.Column('ean', sa.String(length=14), nullable=True),
+        sa.Column('descricao', sa.String(length=120), nullable=True),
+        sa.Column('ncm', sa.String(length=8), nullable=True),
+        sa.Column('cfop', sa.String(length=4), nullable=True),
+        sa.Column('unidade', sa.String(length=6), nullable=True),
+        sa.Column('quantidade', sa.Numeric(15, 4), nullable=True),
+        sa.Column('valor_unitario', sa.Numeric(21, 10), nullable=True),
+        sa.Column('valor_total', sa.Numeric(15, 2), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.text('now()')),
+        sa.UniqueConstraint('company_id', 'chave', 'n_item', name='uq_nfe_item'),
+    )
+    op.create_index('idx_nfe_items_ncm', 'nfe_items', ['company_id', 'ncm'])
+    op.create_index('idx_nfe_items_cfop', 'nfe_items', ['company_id', 'cfop'])
+    op.create_index('idx_nfe_items_codigo_produto', 'nfe_items', ['company_id', 'codigo_produto'])
+
+
+def downgrade() -> None:
+    op.drop_index('idx_nfe_items_codigo_produto', table_name='nfe_items')
+    op.drop_index('idx_nfe_items_cfop', table_name='nfe_items')
+    op.drop_index('idx_nfe_items_ncm', table_name='nfe_items')
+    op.drop_table('nfe_items')
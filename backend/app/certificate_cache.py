@@ -0,0 +1,65 @@
+"""
+Cache em memória do material dos certificados A1
+
+Guarda, por cert_thumbprint, a chave privada e o certificado já extraídos do
+.pfx. Evita baixar o .pfx do MinIO, descriptografar a senha e fazer o parse
+do PKCS#12 a cada sincronização, manifestação ou importação por chave.
+
+As entradas expiram após CERT_MATERIAL_CACHE_TTL_SECONDS e são descartadas
+explicitamente quando o certificado é substituído ou muda de status.
+"""
+from dataclasses import dataclass
+import asyncio
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from cryptography import x509
+
+from app.config import settings
+
+
+@dataclass(frozen=True)
+class CertificateMaterial:
+    """Chave e certificado prontos para uso pelos clientes SEFAZ"""
+    thumbprint: str
+    certificate: x509.Certificate
+    private_key: Any
+
+
+_entries: Dict[str, Tuple[CertificateMaterial, float]] = {}
+_locks: Dict[str, asyncio.Lock] = {}
+
+
+def get(thumbprint: Optional[str]) -> Optional[CertificateMaterial]:
+    if not thumbprint:
+        return None
+    entry = _entries.get(thumbprint)
+    if entry is None:
+        return None
+    material, expires_at = entry
+    if time.monotonic() >= expires_at:
+        _entries.pop(thumbprint, None)
+        return None
+    return material
+
+
+def put(material: CertificateMaterial) -> None:
+    _entries[material.thumbprint] = (
+        material,
+        time.monotonic() + settings.CERT_MATERIAL_CACHE_TTL_SECONDS,
+    )
+
+
+def lock_for(thumbprint: str) -> asyncio.Lock:
+    """Serializa a carga do mesmo certificado entre chamadas concorrentes"""
+    lock = _locks.get(thumbprint)
+    if lock is None:
+        lock = asyncio.Lock()
+        _locks[thumbprint] = lock
+    return lock
+
+
+def invalidate(thumbprint: Optional[str]) -> None:
+    if thumbprint:
+        _entries.pop(thumbprint, None)
+        _locks.pop(thumbprint, None)
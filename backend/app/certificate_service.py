@@ -4,6 +4,7 @@ Serviço de gerenciamento de certificados digitais A1
 from datetime import datetime, timezone
 import logging
 from typing import Optional, Tuple
+import asyncio
 import io
 import hashlib
 from cryptography import x509
@@ -16,6 +17,10 @@ from fastapi import UploadFile, HTTPException
 from app.models import CompanyCertificate, Company
 from app.crypto_service import CryptoService
 from app.storage import MinIOService as StorageService
+from app import sefaz_http
+from app import certificate_cache
+from app import xml_signer
+from app.certificate_cache import CertificateMaterial
 
 logger = logging.getLogger(__name__)
 
@@ -153,8 +158,10 @@ class CertificateService:
             )
             existing_cert = cert_result.scalar_one_or_none()
             
+            replaced_thumbprint = None
             if existing_cert:
                 # Atualiza certificado existente
+                replaced_thumbprint = existing_cert.cert_thumbprint
                 existing_cert.cnpj = cnpj
                 existing_cert.cert_storage_key = storage_key
                 existing_cert.cert_password_enc = password_enc
@@ -184,6 +191,10 @@ class CertificateService:
             await self.db.commit()
             await self.db.refresh(certificate)
             
+            # Material e conexões do certificado anterior não devem ser reaproveitados
+            if replaced_thumbprint:
+                await self.invalidate_cache(replaced_thumbprint)
+            
             logger.info(f"Certificado salvo para empresa {company_id}, válido até {valid_to}")
             return certificate
             
@@ -233,6 +244,52 @@ class CertificateService:
             logger.error(f"Erro ao carregar dados do certificado: {e}")
             raise
     
+    async def get_certificate_material(
+        self,
+        cert: CompanyCertificate
+    ) -> CertificateMaterial:
+        """
+        Chave e certificado já extraídos do .pfx, com cache por thumbprint
+        
+        Na primeira chamada baixa o .pfx, descriptografa a senha e faz o parse
+        do PKCS#12 (fora do event loop); as seguintes reaproveitam o resultado
+        até expirar o TTL ou o certificado ser substituído.
+        """
+        material = certificate_cache.get(cert.cert_thumbprint)
+        if material is not None:
+            return material
+        
+        async with certificate_cache.lock_for(cert.cert_thumbprint or cert.cert_storage_key):
+            material = certificate_cache.get(cert.cert_thumbprint)
+            if material is not None:
+                return material
+            
+            pfx_data = await asyncio.to_thread(self.storage.get_object, cert.cert_storage_key)
+            password = self.crypto.decrypt(cert.cert_password_enc)
+            material = await asyncio.to_thread(self._load_material, pfx_data, password)
+            
+            if cert.cert_thumbprint and material.thumbprint != cert.cert_thumbprint:
+                logger.warning(
+                    f"Thumbprint do .pfx difere do cadastro da empresa {cert.company_id}; "
+                    "material não será mantido em cache"
+                )
+            else:
+                certificate_cache.put(material)
+            return material
+    
+    @staticmethod
+    def _load_material(pfx_data: bytes, password: str) -> CertificateMaterial:
+        private_key, certificate, _ = pkcs12.load_key_and_certificates(
+            pfx_data,
+            password.encode('utf-8'),
+            backend=default_backend()
+        )
+        return CertificateMaterial(
+            thumbprint=hashlib.sha256(certificate.public_bytes(Encoding.DER)).hexdigest(),
+            certificate=certificate,
+            private_key=private_key,
+        )
+    
     async def update_certificate_status(
         self,
         company_id: int,
@@ -246,6 +303,15 @@ class CertificateService:
             cert.last_error = error
             cert.updated_at = datetime.utcnow()
             await self.db.commit()
+            if status != "active":
+                await self.invalidate_cache(cert.cert_thumbprint)
+    
+    @staticmethod
+    async def invalidate_cache(thumbprint: Optional[str]):
+        """Descarta recursos em memória do certificado (material, signer XML e pool de conexões mTLS)"""
+        certificate_cache.invalidate(thumbprint)
+        xml_signer.invalidate(thumbprint)
+        await sefaz_http.invalidate(thumbprint)
     
     async def check_and_update_expired_certificates(self):
         """Job para verificar e marcar certificados expirados"""
@@ -257,11 +323,15 @@ class CertificateService:
         certificates = result.scalars().all()
         
         now = datetime.now(timezone.utc)
+        expired = []
         for cert in certificates:
             if now > cert.valid_to:
                 cert.status = "expired"
                 cert.last_error = f"Certificado expirado em {cert.valid_to}"
                 cert.updated_at = datetime.utcnow()
+                expired.append(cert.cert_thumbprint)
                 logger.warning(f"Certificado da empresa {cert.company_id} expirado")
         
         await self.db.commit()
+        for thumbprint in expired:
+            await self.invalidate_cache(thumbprint)
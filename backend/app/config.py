@@ -32,8 +32,45 @@ class Settings(BaseSettings):
     
     # Módulo Fiscal (NF-e)
     CERT_MASTER_KEY: str  # Chave para criptografar senhas de certificados (base64, 32 bytes)
+    CERT_MATERIAL_CACHE_TTL_SECONDS: int = 3600  # Tempo que chave/certificado descriptografados ficam em memória
     NFE_AMBIENTE_PRODUCAO: bool = False  # True=Produção, False=Homologação
-    NFE_SYNC_INTERVAL_HOURS: int = 4  # Intervalo de sincronização automática
+    NFE_SYNC_INTERVAL_HOURS: int = 4  # Intervalo base da sincronização automática (ajustado por empresa)
+    NFE_SYNC_MIN_INTERVAL_MINUTES: int = 60  # Menor intervalo entre sincronizações de uma empresa
+    NFE_SYNC_MAX_INTERVAL_HOURS: int = 12  # Maior intervalo (empresas paradas ou com erro)
+    NFE_SYNC_BACKLOG_DELAY_MINUTES: int = 5  # Retorno rápido quando a execução parou com NSUs pendentes
+    NFE_SYNC_BUSY_DOCS_PER_DAY: int = 20  # Documentos/24h para considerar a empresa movimentada
+    NFE_SYNC_TICK_MINUTES: int = 5  # Frequência com que o scheduler procura empresas vencidas
+    NFE_SYNC_MAX_CONCURRENCY: int = 5  # Empresas sincronizando em paralelo (cada uma usa 2 conexões do pool: sessão + lease)
+    NFE_SYNC_MAX_DOCS_PER_RUN: int = 2500  # Orçamento de documentos por execução (modo drain)
+    NFE_SYNC_MAX_SECONDS_PER_RUN: int = 900  # Orçamento de tempo por execução (modo drain)
+    NFE_UPLOAD_WORKERS: int = 8  # Threads de upload de XML para o MinIO (por processo)
+    NFE_UPLOAD_MAX_IN_FLIGHT: int = 16  # Uploads pendentes por página antes de aplicar backpressure
+    NFE_RESOLVE_CONCURRENCY: int = 5  # Consultas por chave (procNFe) simultâneas por página
+    NFE_XML_PARSE_CACHE_SIZE: int = 512  # XMLs parseados mantidos em memória (por SHA-256) para reuso entre estágios
+    NFE_CONSULTA_CHAVE_PER_MINUTE: int = 20  # Ritmo máximo de consChNFe por certificado (evita cStat 656)
+    NFE_CONSULTA_CHAVE_BURST: int = 5  # Rajada permitida de consChNFe por certificado
+    NFE_CHAVE_NEGATIVE_TTL_SECONDS: int = 900  # Tempo que um consChNFe que só trouxe resNFe fica em cache
+    NFE_CHAVE_CACHE_MAX_ENTRIES: int = 20000  # Chaves em cache negativo por processo (descarta as mais antigas)
+    NFE_BACKFILL_CHUNK_SIZE: int = 1000  # NSUs por faixa do backfill histórico
+    NFE_BACKFILL_WORKERS: int = 3  # Faixas processadas em paralelo por empresa (uma conexão do pool cada, além de sessão + lease)
+    NFE_BACKFILL_REQUESTS_PER_MINUTE: int = 20  # Ritmo máximo de distDFe do backfill por certificado
+    NFE_BACKFILL_BURST: int = 3  # Rajada permitida de distDFe do backfill por certificado
+    NFE_NSU_RETRY_PER_RUN: int = 20  # NSUs com falha reprocessados (consNSU) por sincronização
+    NFE_NSU_RETRY_MAX_ATTEMPTS: int = 8  # Tentativas antes de marcar o NSU como abandonado
+    NFE_NSU_RETRY_BASE_MINUTES: int = 15  # Primeiro intervalo entre tentativas (dobra a cada falha, até 24h)
+    SEFAZ_DIST_DFE_URL: Optional[str] = None  # Substitui os endpoints de NFeDistribuicaoDFe (ex.: simulador local)
+    SEFAZ_EVENTO_URL: Optional[str] = None  # Substitui o endpoint de NFeRecepcaoEvento (ex.: simulador local)
+    SEFAZ_REQUEST_TIMEOUT_SECONDS: float = 30  # Timeout de cada tentativa de chamada SOAP
+    SEFAZ_RETRY_ATTEMPTS: int = 3  # Tentativas por chamada em falhas transitórias (rede, timeout, 5xx)
+    SEFAZ_RETRY_BASE_SECONDS: float = 1.0  # Base do backoff exponencial com jitter
+    SEFAZ_RETRY_MAX_SECONDS: float = 10.0  # Teto do backoff entre tentativas
+    SEFAZ_CIRCUIT_FAILURE_THRESHOLD: int = 5  # Falhas seguidas que abrem o circuito do endpoint
+    SEFAZ_CIRCUIT_ERROR_RATE: float = 0.5  # Taxa de erro (últimas chamadas) que abre o circuito
+    SEFAZ_CIRCUIT_COOLDOWN_SECONDS: int = 60  # Tempo com o circuito aberto antes da chamada de teste
+    SEFAZ_HEDGE_AFTER_SECONDS: float = 0  # Dispara requisição paralela após N s sem resposta (0 = desligado; duplica consumo)
+    SEFAZ_CASSETTE_MODE: Optional[str] = None  # record/replay: grava ou reproduz o tráfego SOAP (app/sefaz_cassette.py)
+    SEFAZ_CASSETTE_PATH: str = "cassettes/sefaz.jsonl.gz"  # Arquivo do cassete (CNPJ do certificado mascarado)
+    SEFAZ_CASSETTE_TIMING: float = 1.0  # Replay: multiplicador do tempo de resposta gravado (0 = sem espera)
     
     # Retenção de dados
     AUDIT_LOG_RETENTION_DAYS: int = 180
@@ -2,6 +2,11 @@ from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sess
 from sqlalchemy.orm import declarative_base
 from app.config import settings
 
+# Conexões por execução em paralelo: sincronização = 2 (sessão + lease,
+# app.sync_lease); backfill = 2 + NFE_BACKFILL_WORKERS (uma sessão por faixa).
+# Com os padrões, NFE_SYNC_MAX_CONCURRENCY=5 ocupa 10 conexões; somadas a um
+# backfill (5) e às requisições da API, o pool (5 + 10 overflow) fica no limite.
+# Ao aumentar a concorrência, aumente pool_size/max_overflow junto.
 engine = create_async_engine(
     settings.DATABASE_URL,
     echo=settings.ENVIRONMENT == "development",
@@ -0,0 +1,280 @@
+"""
+Jobs fiscais em segundo plano
+
+Sincronização, resolução de XML e importação por chave podem levar minutos
+(várias empresas, vários lotes na SEFAZ). Em vez de segurar a requisição HTTP,
+o endpoint grava um FiscalJob, dispara a execução como task do event loop e
+devolve o ID; o progresso por empresa fica no próprio registro e é consultado
+por GET /fiscal/jobs/{id}.
+
+A task roda no processo que recebeu a requisição. Enquanto executa, atualiza
+heartbeat_at periodicamente; um job ativo sem heartbeat recente é considerado
+interrompido (processo reiniciado) e marcado como erro.
+"""
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Set, Tuple
+from uuid import UUID
+
+from sqlalchemy import func, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import AsyncSessionLocal
+from app.models import FiscalJob
+from app.certificate_service import CertificateService
+from app.manifestacao_service import ManifestacaoService
+from app.nfe_backfill import NfeBackfillService
+from app.nfe_sync_engine import NfeSyncEngine
+from app.nfe_sync_service import NfeSyncService
+from app.crypto_service import CryptoService
+from app.storage import MinIOService as StorageService
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+JOB_KINDS = ("nfe_sync", "nfe_resolve", "nfe_import_by_key", "nfe_backfill")
+ACTIVE_STATUSES = ("queued", "running")
+
+HEARTBEAT_SECONDS = 30
+STALE_AFTER = timedelta(minutes=5)
+
+# Referências fortes às tasks em execução (o event loop guarda só referências fracas)
+_tasks: Set[asyncio.Task] = set()
+
+
+async def submit_job(
+    db: AsyncSession,
+    kind: str,
+    params: Dict[str, Any],
+    user_id: Optional[int] = None
+) -> FiscalJob:
+    """
+    Grava o job e dispara a execução em segundo plano
+
+    Returns:
+        FiscalJob recém-criado (status queued)
+    """
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Tipo de job inválido: {kind}")
+
+    job = FiscalJob(kind=kind, status="queued", params=params, progress={}, created_by=user_id)
+    db.add(job)
+    await db.commit()
+    await db.refresh(job)
+
+    task = asyncio.create_task(_run_job(job.id, kind, dict(params)))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+    logger.info(f"Job fiscal {job.id} ({kind}) enfileirado")
+    return job
+
+
+async def fail_stale_jobs(db: AsyncSession) -> int:
+    """Marca como erro os jobs ativos cujo processo parou de dar sinal de vida"""
+    now = datetime.utcnow()
+    result = await db.execute(
+        update(FiscalJob)
+        .where(
+            FiscalJob.status.in_(ACTIVE_STATUSES),
+            func.coalesce(FiscalJob.heartbeat_at, FiscalJob.created_at) < now - STALE_AFTER,
+        )
+        .values(
+            status="error",
+            error_message="Job interrompido (processo reiniciado)",
+            finished_at=now,
+        )
+    )
+    await db.commit()
+    return result.rowcount or 0
+
+
+async def shutdown_jobs() -> None:
+    """Cancela os jobs deste processo no desligamento da aplicação"""
+    tasks = list(_tasks)
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _update_job(job_id: UUID, **values: Any) -> None:
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(FiscalJob).where(FiscalJob.id == job_id).values(**values))
+        await db.commit()
+
+
+async def _heartbeat(job_id: UUID) -> None:
+    while True:
+        await asyncio.sleep(HEARTBEAT_SECONDS)
+        try:
+            await _update_job(job_id, heartbeat_at=datetime.utcnow())
+        except Exception as e:
+            logger.warning(f"Falha ao registrar heartbeat do job {job_id}: {e}")
+
+
+class JobProgress:
+    """
+    Progresso por empresa de um job
+
+    O estado é mantido em memória pela task dona do job e gravado inteiro a
+    cada atualização; o lock serializa as gravações quando várias empresas
+    terminam ao mesmo tempo.
+    """
+
+    def __init__(self, job_id: UUID):
+        self.job_id = job_id
+        self.companies: Dict[str, Dict[str, Any]] = {}
+        self._lock = asyncio.Lock()
+
+    async def start(self, company_ids: Iterable[int]) -> None:
+        for company_id in company_ids:
+            self.companies[str(company_id)] = {"status": "pending"}
+        await self._flush()
+
+    async def record(self, company_id: int, entry: Dict[str, Any]) -> None:
+        self.companies[str(company_id)] = entry
+        await self._flush()
+
+    @property
+    def docs_found(self) -> int:
+        return sum(entry.get("docs_found") or 0 for entry in self.companies.values())
+
+    @property
+    def docs_imported(self) -> int:
+        return sum(entry.get("docs_imported") or 0 for entry in self.companies.values())
+
+    async def _flush(self) -> None:
+        async with self._lock:
+            await _update_job(
+                self.job_id,
+                progress=dict(self.companies),
+                docs_found=self.docs_found,
+                docs_imported=self.docs_imported,
+                heartbeat_at=datetime.utcnow(),
+            )
+
+
+@asynccontextmanager
+async def _services() -> AsyncIterator[Tuple[AsyncSession, CertificateService, StorageService]]:
+    """Sessão, storage e serviço de certificados próprios do job"""
+    # O construtor do MinIO faz I/O síncrono (bucket_exists)
+    storage = await asyncio.to_thread(StorageService)
+    async with AsyncSessionLocal() as db:
+        crypto = CryptoService(settings.CERT_MASTER_KEY)
+        yield db, CertificateService(db, storage, crypto), storage
+
+
+def _overall_status(statuses: Iterable[str]) -> str:
+    statuses = list(statuses)
+    if statuses and all(status == "success" for status in statuses):
+        return "success"
+    if not statuses or all(status in ("error", "running") for status in statuses):
+        return "error"
+    return "partial"
+
+
+async def _run_sync(progress: JobProgress, params: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    company_ids = params.get("company_ids") or await NfeSyncEngine.active_company_ids()
+    await progress.start(company_ids)
+
+    async def on_result(result: Dict[str, Any]) -> None:
+        await progress.record(result["company_id"], result)
+
+    results = await NfeSyncEngine().sync_companies(company_ids, sync_type="manual", on_result=on_result)
+    summary = {
+        "companies": len(results),
+        "success": sum(1 for r in results if r["status"] == "success"),
+        "partial": sum(1 for r in results if r["status"] == "partial"),
+        "error": sum(1 for r in results if r["status"] == "error"),
+        "already_running": sum(1 for r in results if r["status"] == "running"),
+    }
+    return _overall_status(r["status"] for r in results), summary
+
+
+async def _run_resolve(progress: JobProgress, params: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    company_id = params["company_id"]
+    await progress.start([company_id])
+
+    async with _services() as (db, cert_service, storage):
+        result = await ManifestacaoService(db, cert_service, storage).resolve_company(company_id)
+
+    if result.get("errors"):
+        status = "error" if result["resolved"] == 0 else "partial"
+    else:
+        status = "success"
+    await progress.record(company_id, {
+        "status": status,
+        "docs_found": result["attempted"],
+        "docs_imported": result["resolved"],
+        "still_summary": result["still_summary"],
+        "error_message": result.get("errors"),
+    })
+    return status, result
+
+
+async def _run_import_by_key(progress: JobProgress, params: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    company_id = params["company_id"]
+    await progress.start([company_id])
+
+    async with _services() as (db, cert_service, storage):
+        result = await NfeSyncService(db, cert_service, storage).import_by_key(company_id, params["chave"])
+
+    await progress.record(company_id, {"company_id": company_id, **result})
+    return result["status"], result
+
+
+async def _run_backfill(progress: JobProgress, params: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    company_id = params["company_id"]
+    await progress.start([company_id])
+
+    async with _services() as (db, cert_service, storage):
+        result = await NfeBackfillService(db, cert_service, storage).run(
+            company_id,
+            nsu_start=params.get("nsu_start"),
+            nsu_end=params.get("nsu_end"),
+        )
+
+    await progress.record(company_id, result)
+    status = "error" if result["status"] == "running" else result["status"]
+    return status, result
+
+
+_RUNNERS = {
+    "nfe_sync": _run_sync,
+    "nfe_resolve": _run_resolve,
+    "nfe_import_by_key": _run_import_by_key,
+    "nfe_backfill": _run_backfill,
+}
+
+
+async def _run_job(job_id: UUID, kind: str, params: Dict[str, Any]) -> None:
+    now = datetime.utcnow()
+    await _update_job(job_id, status="running", started_at=now, heartbeat_at=now)
+    heartbeat = asyncio.create_task(_heartbeat(job_id))
+    try:
+        status, result = await _RUNNERS[kind](JobProgress(job_id), params)
+        await _update_job(
+            job_id,
+            status=status,
+            result=result,
+            error_message=(result.get("error_message") or result.get("errors")) if status == "error" else None,
+            finished_at=datetime.utcnow(),
+        )
+        logger.info(f"Job fiscal {job_id} ({kind}) finalizado: {status}")
+    except asyncio.CancelledError:
+        await _update_job(
+            job_id,
+            status="error",
+            error_message="Job cancelado (aplicação desligando)",
+            finished_at=datetime.utcnow(),
+        )
+        raise
+    except Exception as e:
+        logger.error(f"Erro no job fiscal {job_id} ({kind}): {e}")
+        await _update_job(job_id, status="error", error_message=str(e), finished_at=datetime.utcnow())
+    finally:
+        heartbeat.cancel()
@@ -1,9 +1,10 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-from sqlalchemy import delete, select
+from apscheduler.triggers.interval import IntervalTrigger
+from sqlalchemy import delete
 from datetime import datetime, timedelta
 from app.database import AsyncSessionLocal
-from app.models import RefreshToken, AuditLog, NfeSyncLog, CompanyCertificate
+from app.models import RefreshToken, AuditLog, NfeSyncLog
 from app.config import settings
 import structlog
 
@@ -57,70 +58,60 @@ async def cleanup_old_data():
             await db.rollback()
 
 
-async def sync_nfe_all_companies():
-    """Job periódico para sincronizar NF-e de todas as empresas"""
+async def sync_nfe_due_companies():
+    """
+    Job periódico para sincronizar NF-e das empresas com sincronização vencida
+    
+    Cada empresa tem seu próprio next_sync_at, calculado a partir do histórico
+    (ver app.nfe_sync_policy); o job apenas executa as que já venceram.
+    """
     logger.info("nfe_sync_job_started")
     
-    async with AsyncSessionLocal() as db:
-        try:
-            from app.certificate_service import CertificateService
-            from app.nfe_sync_service import NfeSyncService
-            from app.storage import StorageService
-            from app.crypto_service import CryptoService
-            
-            # Busca todas empresas com certificado ativo
-            result = await db.execute(
-                select(CompanyCertificate).where(
-                    CompanyCertificate.status == 'active'
-                )
-            )
-            certificates = result.scalars().all()
-            
-            if not certificates:
-                logger.info("nfe_sync_job_no_certificates")
-                return
-            
-            # Inicializa serviços
-            storage = StorageService()
-            crypto = CryptoService(settings.CERT_MASTER_KEY)
-            cert_service = CertificateService(db, storage, crypto)
-            sync_service = NfeSyncService(db, cert_service, storage)
-            
-            # Sincroniza cada empresa
-            success_count = 0
-            error_count = 0
-            total_docs = 0
-            
-            for cert in certificates:
-                try:
-                    result = await sync_service.sync_company(
-                        cert.company_id,
-                        sync_type="incremental"
-                    )
-                    
-                    if result['status'] == 'success':
-                        success_count += 1
-                        total_docs += result['docs_imported']
-                    else:
-                        error_count += 1
-                        
-                except Exception as e:
+    try:
+        from app.nfe_sync_engine import NfeSyncEngine
+        
+        # Busca empresas com certificado ativo e sincronização vencida
+        engine = NfeSyncEngine()
+        company_ids = await engine.due_company_ids()
+        
+        if not company_ids:
+            logger.info("nfe_sync_job_no_due_companies")
+            return
+        
+        # Sincroniza as empresas em paralelo (limite NFE_SYNC_MAX_CONCURRENCY)
+        results = await engine.sync_companies(company_ids, sync_type="incremental")
+        
+        success_count = 0
+        error_count = 0
+        running_count = 0
+        total_docs = 0
+        
+        for result in results:
+            if result['status'] == 'success':
+                success_count += 1
+                total_docs += result['docs_imported']
+            elif result['status'] == 'running':
+                # Outro processo já está sincronizando esta empresa
+                running_count += 1
+            else:
+                if result['status'] == 'error':
                     logger.error(
                         "nfe_sync_company_failed",
-                        company_id=cert.company_id,
-                        error=str(e)
+                        company_id=result['company_id'],
+                        error=result.get('error_message')
                     )
-                    error_count += 1
-            
-            logger.info(
-                "nfe_sync_job_completed",
-                companies_synced=success_count,
-                companies_failed=error_count,
-                total_docs_imported=total_docs
-            )
-            
-        except Exception as e:
-            logger.error("nfe_sync_job_failed", error=str(e))
+                error_count += 1
+        
+        logger.info(
+            "nfe_sync_job_completed",
+            companies_synced=success_count,
+            companies_failed=error_count,
+            companies_already_running=running_count,
+            total_docs_imported=total_docs
+        )
+        
+    except Exception as e:
+        logger.error("nfe_sync_job_failed", error=str(e))
 
 
 async def check_certificate_expiration():
@@ -130,7 +121,7 @@ async def check_certificate_expiration():
     async with AsyncSessionLocal() as db:
         try:
             from app.certificate_service import CertificateService
-            from app.storage import StorageService
+            from app.storage import MinIOService as StorageService
             from app.crypto_service import CryptoService
             
             storage = StorageService()
@@ -156,14 +147,15 @@ def start_scheduler():
         replace_existing=True
     )
     
-    # Job periódico - sincronização NF-e (configurável, padrão 4h)
-    interval_hours = settings.NFE_SYNC_INTERVAL_HOURS
+    # Job periódico - sincronização NF-e (agenda adaptativa por empresa)
     scheduler.add_job(
-        sync_nfe_all_companies,
-        trigger=CronTrigger(hour=f"*/{interval_hours}"),
+        sync_nfe_due_companies,
+        trigger=IntervalTrigger(minutes=settings.NFE_SYNC_TICK_MINUTES),
         id="nfe_sync_job",
         name="Sincronização automática NF-e",
-        replace_existing=True
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True
     )
     
     # Job diário às 2h - verificação de certificados expirados
@@ -8,6 +8,8 @@ import structlog
 from app.config import settings
 from app.routers import auth, employees, rubrics, competencies, payments, attachments, reports, maintenance, expenses, companies, signatures, fiscal
 from app.jobs import start_scheduler, stop_scheduler
+from app.fiscal_jobs import shutdown_jobs
+from app import sefaz_http
 
 
 # Configurar logs estruturados
@@ -32,8 +34,10 @@ async def lifespan(app: FastAPI):
     
     yield
     
-    # Parar scheduler
+    # Parar scheduler e jobs fiscais em andamento
     stop_scheduler()
+    await shutdown_jobs()
+    await sefaz_http.close_all()
     
     logger.info("application_shutdown")
 
@@ -3,7 +3,7 @@ Serviço para manifestação do destinatário e resolução de XML completo
 """
 from datetime import datetime
 import asyncio
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import logging
 
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -15,16 +15,49 @@ from app.sefaz_evento_client import SefazEventoClient
 from app.certificate_service import CertificateService
 from app.storage import MinIOService as StorageService
 from app.config import settings
-from app.nfe_sync_service import NfeParserService
+from app.nfe_ingest import NfeIngestService
+from app.nfe_chave_lookup import ChaveLookup
+from app import nfe_chave_lookup
+from app.sync_lease import company_lease, LeaseUnavailable
 
 logger = logging.getLogger(__name__)
 
+# cStat do retEvento com a manifestação registrada na SEFAZ; 573 (duplicidade
+# de evento) quer dizer que ela já tinha sido registrada antes
+CSTAT_EVENTO_REGISTRADO = ("135", "128", "573")
+
+
+def lote_outcomes(lote: List[str], response: Dict[str, Any]) -> Dict[str, Tuple[str, Optional[str], Optional[str]]]:
+    """
+    Resultado de cada chave de um lote de manifestar_lote
+
+    Returns:
+        {chave: (status, protocolo, last_error)}, status accepted, sent ou error
+    """
+    outcomes = {}
+    for chave in lote:
+        evento_info = response["eventos"].get(chave)
+        if evento_info is None:
+            outcomes[chave] = ("error", None, (
+                f"Lote rejeitado: {response['status']} - {response['motivo']}"
+                if response["status"] != 128 else "Sem retEvento para a chave"
+            ))
+        elif evento_info.get("cStat") in CSTAT_EVENTO_REGISTRADO:
+            outcomes[chave] = ("accepted", evento_info.get("nProt"), None)
+        else:
+            outcomes[chave] = (
+                "sent", evento_info.get("nProt"), f"{evento_info.get('cStat')} - {evento_info.get('xMotivo')}"
+            )
+    return outcomes
+
 
 class ManifestacaoService:
     def __init__(self, db: AsyncSession, cert_service: CertificateService, storage: StorageService):
         self.db = db
         self.cert_service = cert_service
         self.storage = storage
+        self.ingest = NfeIngestService(db, storage)
+        self.lookup = ChaveLookup(db, storage)
 
     async def _get_company_and_cert(self, company_id: int):
         result = await self.db.execute(select(Company).where(Company.id == company_id))
@@ -37,6 +70,25 @@ class ManifestacaoService:
             raise ValueError("Certificado não encontrado ou inativo")
         return company, cert
 
+    async def _build_clients(self, company: Company, cert) -> Tuple[SefazDFeClient, SefazEventoClient]:
+        material = await self.cert_service.get_certificate_material(cert)
+
+        # Pega UF da empresa ou usa padrão GO
+        uf = company.uf if hasattr(company, 'uf') and company.uf else "GO"
+        
+        sefaz_dist = SefazDFeClient(
+            cnpj=cert.cnpj,
+            material=material,
+            producao=settings.NFE_AMBIENTE_PRODUCAO,
+        )
+        evento_client = SefazEventoClient(
+            cnpj=cert.cnpj,
+            material=material,
+            producao=settings.NFE_AMBIENTE_PRODUCAO,
+            uf=uf,  # Passa UF em vez de uf_code
+        )
+        return sefaz_dist, evento_client
+
     async def _ensure_manifest_record(self, company_id: int, chave: str, tp_evento: str) -> NfeManifestation:
         result = await self.db.execute(
             select(NfeManifestation).where(
@@ -64,92 +116,49 @@ class ManifestacaoService:
         self.db.add(record)
         return record
 
-    async def _save_document(self, company_id: int, company_cnpj: str, doc: DFeDocument, xml_kind: str) -> bool:
-        parsed = NfeParserService.parse_nfe_xml(doc.xml_content, company_cnpj)
-        year = datetime.utcnow().year
-        month = datetime.utcnow().month
-        storage_key = f"nfe/xml/{company_id}/{company_cnpj}/{year}/{month:02d}/{doc.chave}.xml"
-
-        self.storage.put_object(storage_key, doc.xml_content.encode('utf-8'), "application/xml")
-        xml_sha256 = self.storage.calculate_sha256(doc.xml_content.encode('utf-8'))
-
-        existing_result = await self.db.execute(select(NfeDocument).where(NfeDocument.chave == doc.chave))
-        existing = existing_result.scalar_one_or_none()
-
-        if existing:
-            existing.xml_storage_key = storage_key
-            existing.xml_sha256 = xml_sha256
-            existing.xml_kind = xml_kind
-            existing.updated_at = datetime.utcnow()
-            existing.numero = parsed.get('numero')
-            existing.serie = parsed.get('serie')
-            existing.data_emissao = parsed.get('data_emissao')
-            existing.cnpj_emitente = parsed.get('cnpj_emitente')
-            existing.emitente_nome = parsed.get('emitente_nome')
-            existing.cnpj_destinatario = parsed.get('cnpj_destinatario')
-            existing.destinatario_nome = parsed.get('destinatario_nome')
-            existing.valor_total = parsed.get('valor_total')
-            existing.tipo = parsed.get('tipo') or existing.tipo
-            existing.situacao = parsed.get('situacao') or existing.situacao
-        else:
-            nfe_doc = NfeDocument(
-                company_id=company_id,
-                chave=doc.chave or parsed['chave'],
-                nsu=doc.nsu,
-                tipo=parsed['tipo'],
-                situacao=parsed['situacao'],
-                numero=parsed.get('numero'),
-                serie=parsed.get('serie'),
-                data_emissao=parsed.get('data_emissao'),
-                cnpj_emitente=parsed.get('cnpj_emitente'),
-                emitente_nome=parsed.get('emitente_nome'),
-                cnpj_destinatario=parsed.get('cnpj_destinatario'),
-                destinatario_nome=parsed.get('destinatario_nome'),
-                valor_total=parsed.get('valor_total'),
-                xml_storage_key=storage_key,
-                xml_sha256=xml_sha256,
-                xml_kind=xml_kind,
-                created_at=datetime.utcnow(),
-                updated_at=datetime.utcnow(),
-            )
-            self.db.add(nfe_doc)
-        await self.db.commit()
-        return True
+    async def _try_fetch_full(
+        self,
+        company_id: int,
+        company_cnpj: str,
+        sefaz_client: SefazDFeClient,
+        chave: str,
+        refresh: bool = False
+    ) -> Optional[DFeDocument]:
+        """
+        procNFe da chave, gravando o que vier (completo ou resumo)
 
-    async def _try_fetch_full(self, company_id: int, company_cnpj: str, sefaz_client: SefazDFeClient, chave: str) -> Optional[DFeDocument]:
-        response = await sefaz_client.consultar_por_chave(chave)
+        refresh=True nas reconsultas depois de um evento aceito: ignora o
+        "só resumo" em cache, que é justamente o que a manifestação muda.
+        """
+        response = await self.lookup.consultar(sefaz_client, company_id, chave, refresh=refresh)
+        if response.get('cached') == 'stored':
+            return response['documentos'][0]
+        if response.get('cached') == 'negative':
+            return None
         for doc in response.get('documentos', []):
             if 'procNFe' in (doc.schema or ''):
-                await self._save_document(company_id, company_cnpj, doc, xml_kind='full')
+                await self.ingest.persist_page(company_id, company_cnpj, [doc])
                 return doc
-        # se só resumo, salvar/atualizar summary
+        # se só resumo, salvar summary (se ainda não existir)
         for doc in response.get('documentos', []):
             if 'resNFe' in (doc.schema or ''):
-                await self._save_document(company_id, company_cnpj, doc, xml_kind='summary')
+                await self.ingest.persist_page(company_id, company_cnpj, [doc])
                 return None
         return None
 
     async def resolve_document(self, company_id: int, chave: str, tp_evento: str = "210210") -> Dict[str, Any]:
+        try:
+            async with company_lease(company_id, "nfe_manifest"):
+                return await self._resolve_document(company_id, chave, tp_evento)
+        except LeaseUnavailable:
+            logger.info("manifest_already_running", extra={"company_id": company_id, "chave": chave})
+            return {"status": "running", "chave": chave}
+
+    async def _resolve_document(self, company_id: int, chave: str, tp_evento: str = "210210") -> Dict[str, Any]:
         print(f"🚀 [DEBUG] resolve_document chamado: company_id={company_id}, chave={chave}")
         company, cert = await self._get_company_and_cert(company_id)
-        pfx_data, password = await self.cert_service.get_certificate_data(cert)
-
-        # Pega UF da empresa ou usa padrão GO
-        uf = company.uf if hasattr(company, 'uf') and company.uf else "GO"
-        
-        sefaz_dist = SefazDFeClient(
-            cnpj=cert.cnpj,
-            cert_pfx_data=pfx_data,
-            cert_password=password,
-            producao=settings.NFE_AMBIENTE_PRODUCAO,
-        )
-        evento_client = SefazEventoClient(
-            cnpj=cert.cnpj,
-            cert_pfx_data=pfx_data,
-            cert_password=password,
-            producao=settings.NFE_AMBIENTE_PRODUCAO,
-            uf=uf,  # Passa UF em vez de uf_code
-        )
+        sefaz_dist, evento_client = await self._build_clients(company, cert)
+        uf = evento_client.uf
 
         # Passo 1: tentar já obter completo
         print(f"🔍 [MANIFESTAÇÃO] Passo 1: Tentando obter XML completo para chave {chave}")
@@ -169,11 +178,13 @@ class ManifestacaoService:
             result = await evento_client.manifestar(chave, tp_evento=tp_evento)
             print(f"📥 [MANIFESTAÇÃO] Manifestação retornou: {result}")
             evento_info = result.get("evento", {})
-            manifest_record.status = "accepted" if evento_info.get("cStat") in ["135", "128"] else "sent"
+            manifest_record.status = "accepted" if evento_info.get("cStat") in CSTAT_EVENTO_REGISTRADO else "sent"
             manifest_record.protocolo = evento_info.get("nProt")
             manifest_record.dh_evento = datetime.utcnow()
             manifest_record.last_error = None
             manifest_record.updated_at = datetime.utcnow()
+            if manifest_record.status == "accepted":
+                nfe_chave_lookup.invalidate(chave)
         except Exception as e:
             print(f"❌ [MANIFESTAÇÃO] Erro na manifestação: {e}")
             logger.error(f"❌ Erro na manifestação: {e}", exc_info=True)
@@ -187,7 +198,7 @@ class ManifestacaoService:
         print(f"🔄 [MANIFESTAÇÃO] Passo 3: Reconsultando após manifestação")
         max_attempts = 3
         for attempt in range(max_attempts):
-            fetched = await self._try_fetch_full(company_id, cert.cnpj, sefaz_dist, chave)
+            fetched = await self._try_fetch_full(company_id, cert.cnpj, sefaz_dist, chave, refresh=True)
             if fetched:
                 return {"status": "full", "chave": chave}
             await asyncio.sleep(2)
@@ -199,6 +210,27 @@ class ManifestacaoService:
         return {"status": "summary", "chave": chave}
 
     async def resolve_company(self, company_id: int, limit: int = 50) -> Dict[str, Any]:
+        try:
+            async with company_lease(company_id, "nfe_manifest"):
+                return await self._resolve_company(company_id, limit)
+        except LeaseUnavailable:
+            logger.info("manifest_already_running", extra={"company_id": company_id})
+            return {
+                "company_id": company_id,
+                "attempted": 0,
+                "resolved": 0,
+                "still_summary": 0,
+                "errors": "Manifestação já em andamento para esta empresa",
+            }
+
+    async def _resolve_company(self, company_id: int, limit: int = 50, tp_evento: str = "210210") -> Dict[str, Any]:
+        """
+        Resolve os resumos da empresa manifestando em lotes
+
+        1. consChNFe de cada resumo (o procNFe pode já estar disponível)
+        2. Manifestação das chaves restantes em lotes de até 20 eventos
+        3. Reconsulta das chaves com evento aceito
+        """
         result = await self.db.execute(
             select(NfeDocument).where(
                 NfeDocument.company_id == company_id,
@@ -206,16 +238,85 @@ class ManifestacaoService:
             ).limit(limit)
         )
         docs = result.scalars().all()
+        if not docs:
+            return {"company_id": company_id, "attempted": 0, "resolved": 0, "still_summary": 0, "errors": None}
+
+        company, cert = await self._get_company_and_cert(company_id)
+        sefaz_dist, evento_client = await self._build_clients(company, cert)
+
         resolved = 0
         errors = []
+
+        # Passo 1: tentar já obter completo
+        pending = []
         for doc in docs:
             try:
-                outcome = await self.resolve_document(company_id, doc.chave)
-                if outcome.get("status") == "full":
+                if await self._try_fetch_full(company_id, cert.cnpj, sefaz_dist, doc.chave):
                     resolved += 1
+                else:
+                    pending.append(doc.chave)
             except Exception as e:
                 logger.error("resolve_document_failed", extra={"chave": doc.chave, "error": str(e)})
                 errors.append(f"{doc.chave}: {e}")
+
+        # Passo 2: manifestar em lotes
+        records = {}
+        for chave in pending:
+            records[chave] = await self._ensure_manifest_record(company_id, chave, tp_evento)
+        await self.db.commit()
+
+        accepted = []
+        batch_size = SefazEventoClient.MAX_EVENTOS_LOTE
+        for offset in range(0, len(pending), batch_size):
+            lote = pending[offset:offset + batch_size]
+            try:
+                response = await evento_client.manifestar_lote(lote, tp_evento=tp_evento)
+            except Exception as e:
+                logger.error(f"❌ Erro na manifestação do lote: {e}", exc_info=True)
+                for chave in lote:
+                    self._mark_manifest_error(records[chave], str(e))
+                errors.append(f"lote {offset // batch_size + 1}: {e}")
+                continue
+
+            for chave, (status, protocolo, last_error) in lote_outcomes(lote, response).items():
+                record = records[chave]
+                if status == "error":
+                    self._mark_manifest_error(record, last_error)
+                    continue
+                record.status = status
+                record.protocolo = protocolo
+                record.dh_evento = datetime.utcnow()
+                record.last_error = last_error
+                record.updated_at = datetime.utcnow()
+                if status == "accepted":
+                    accepted.append(chave)
+                    nfe_chave_lookup.invalidate(chave)
+        await self.db.commit()
+
+        # Passo 3: reconsultar as chaves manifestadas
+        waiting = list(accepted)
+        for attempt in range(3):
+            if not waiting:
+                break
+            await asyncio.sleep(2)
+            still_waiting = []
+            for chave in waiting:
+                try:
+                    if await self._try_fetch_full(company_id, cert.cnpj, sefaz_dist, chave, refresh=True):
+                        resolved += 1
+                        continue
+                except Exception as e:
+                    logger.error("resolve_document_failed", extra={"chave": chave, "error": str(e)})
+                still_waiting.append(chave)
+            waiting = still_waiting
+
+        for chave in waiting:
+            record = records[chave]
+            record.status = "pending"
+            record.last_error = "Ainda não retornou procNFe"
+            record.updated_at = datetime.utcnow()
+        await self.db.commit()
+
         return {
             "company_id": company_id,
             "attempted": len(docs),
@@ -223,3 +324,9 @@ class ManifestacaoService:
             "still_summary": len(docs) - resolved,
             "errors": "; ".join(errors) if errors else None,
         }
+
+    @staticmethod
+    def _mark_manifest_error(record: NfeManifestation, error: str) -> None:
+        record.status = "error"
+        record.last_error = error[:500]
+        record.updated_at = datetime.utcnow()
@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Optional
 from uuid import UUID
-from sqlalchemy import String, Integer, Boolean, DateTime, Numeric, Text, Index, UniqueConstraint, ForeignKey, JSON
+from sqlalchemy import String, Integer, BigInteger, Boolean, DateTime, Numeric, Text, Index, UniqueConstraint, ForeignKey, JSON
 from sqlalchemy import text as sa_text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.dialects.postgresql import UUID as PGUUID
@@ -336,12 +336,14 @@ class SefazDfeState(Base):
     last_status: Mapped[str] = mapped_column(String(20), nullable=False, server_default="ok")  # ok, error
     last_cstat: Mapped[Optional[str]] = mapped_column(String(10))
     last_error: Mapped[Optional[str]] = mapped_column(Text)
+    next_sync_at: Mapped[Optional[datetime]] = mapped_column(DateTime)  # agendamento adaptativo
     
     # Relationships
     company: Mapped["Company"] = relationship()
     
     __table_args__ = (
         Index("idx_sefaz_dfe_state_company", "company_id"),
+        Index("idx_sefaz_dfe_state_next_sync", "next_sync_at"),
         UniqueConstraint("company_id", name="uq_sefaz_state_company"),
     )
 
@@ -394,8 +396,11 @@ class NfeSyncLog(Base):
     finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
     status: Mapped[str] = mapped_column(String(20), nullable=False)  # success, error, partial
     docs_found: Mapped[int] = mapped_column(Integer, nullable=False, server_default=sa_text('0'))
-    docs_imported: Mapped[int] = mapped_column(Integer, nullable=False, server_default=sa_text('0'))
+    docs_imported: Mapped[int] = mapped_column(Integer, nullable=False, server_default=sa_text('0'))  # novos + promovidos
+    docs_upgraded: Mapped[int] = mapped_column(Integer, nullable=False, server_default=sa_text('0'))  # resumo -> completo
+    docs_skipped: Mapped[int] = mapped_column(Integer, nullable=False, server_default=sa_text('0'))  # já existentes
     error_message: Mapped[Optional[str]] = mapped_column(Text)
+    stage_timings: Mapped[Optional[dict]] = mapped_column(JSON)  # {stages: {soap: {seconds, calls}, ...}, counters: {...}}
     
     # Relationships
     company: Mapped["Company"] = relationship()
@@ -430,3 +435,123 @@ class NfeManifestation(Base):
         Index("idx_manifest_status", "status"),
     )
 
+
+
+class FiscalJob(Base):
+    """Operações fiscais executadas em segundo plano (sync, resolve, import por chave)"""
+    __tablename__ = "fiscal_jobs"
+
+    id: Mapped[UUID] = mapped_column(PGUUID(as_uuid=True), primary_key=True, server_default=sa_text('gen_random_uuid()'))
+    kind: Mapped[str] = mapped_column(String(30), nullable=False)  # nfe_sync, nfe_resolve, nfe_import_by_key
+    status: Mapped[str] = mapped_column(String(20), nullable=False, server_default="queued")  # queued, running, success, partial, error
+    params: Mapped[Optional[dict]] = mapped_column(JSON)
+    progress: Mapped[Optional[dict]] = mapped_column(JSON)  # {company_id: {status, docs_found, docs_imported, ...}}
+    result: Mapped[Optional[dict]] = mapped_column(JSON)
+    docs_found: Mapped[int] = mapped_column(Integer, nullable=False, server_default=sa_text('0'))
+    docs_imported: Mapped[int] = mapped_column(Integer, nullable=False, server_default=sa_text('0'))
+    error_message: Mapped[Optional[str]] = mapped_column(Text)
+    created_by: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("users.id", ondelete="SET NULL"))
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, server_default=sa_text('now()'))
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    heartbeat_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+
+    __table_args__ = (
+        Index("idx_fiscal_jobs_status", "status"),
+        Index("idx_fiscal_jobs_created_at", "created_at"),
+    )
+
+
+class NfeBackfillRange(Base):
+    """Faixas de NSU do backfill histórico (retomadas após reinício)"""
+    __tablename__ = "nfe_backfill_ranges"
+
+    id: Mapped[UUID] = mapped_column(PGUUID(as_uuid=True), primary_key=True, server_default=sa_text('gen_random_uuid()'))
+    company_id: Mapped[int] = mapped_column(Integer, ForeignKey("companies.id", ondelete="CASCADE"), nullable=False)
+    nsu_start: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    nsu_end: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    next_nsu: Mapped[int] = mapped_column(BigInteger, nullable=False)  # último NSU já processado na faixa
+    status: Mapped[str] = mapped_column(String(20), nullable=False, server_default="pending")  # pending, running, done, error
+    docs_found: Mapped[int] = mapped_column(Integer, nullable=False, server_default=sa_text('0'))
+    docs_imported: Mapped[int] = mapped_column(Integer, nullable=False, server_default=sa_text('0'))
+    last_error: Mapped[Optional[str]] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, server_default=sa_text('now()'))
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, server_default=sa_text('now()'))
+
+    __table_args__ = (
+        UniqueConstraint("company_id", "nsu_start", name="uq_backfill_company_start"),
+        Index("idx_backfill_company_status", "company_id", "status"),
+    )
+
+
+class NfeNsuFailure(Base):
+    """NSUs que não puderam ser gravados (decodificação, chave, storage), reprocessados via consNSU"""
+    __tablename__ = "nfe_nsu_failures"
+
+    id: Mapped[UUID] = mapped_column(PGUUID(as_uuid=True), primary_key=True, server_default=sa_text('gen_random_uuid()'))
+    company_id: Mapped[int] = mapped_column(Integer, ForeignKey("companies.id", ondelete="CASCADE"), nullable=False)
+    nsu: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    chave: Mapped[Optional[str]] = mapped_column(String(44))
+    doc_schema: Mapped[Optional[str]] = mapped_column(String(50))  # schema do docZip
+    stage: Mapped[str] = mapped_column(String(20), nullable=False)  # decode, chave, upload
+    status: Mapped[str] = mapped_column(String(20), nullable=False, server_default="pending")  # pending, resolved, abandoned
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, server_default=sa_text('0'))
+    last_error: Mapped[Optional[str]] = mapped_column(Text)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, server_default=sa_text('now()'))
+    resolved_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, server_default=sa_text('now()'))
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, server_default=sa_text('now()'))
+
+    __table_args__ = (
+        UniqueConstraint("company_id", "nsu", name="uq_nsu_failure_company_nsu"),
+        Index("idx_nsu_failure_due", "company_id", "status", "next_attempt_at"),
+    )
+
+
+class NfeEvent(Base):
+    """Evento de NF-e recebido pelo DF-e (cancelamento, CC-e, manifestação)"""
+    __tablename__ = "nfe_events"
+
+    id: Mapped[UUID] = mapped_column(PGUUID(as_uuid=True), primary_key=True, server_default=sa_text('gen_random_uuid()'))
+    company_id: Mapped[int] = mapped_column(Integer, ForeignKey("companies.id", ondelete="CASCADE"), nullable=False)
+    chave: Mapped[str] = mapped_column(String(44), nullable=False)  # chave da NF-e afetada
+    tp_evento: Mapped[str] = mapped_column(String(10), nullable=False)  # 110111 cancelamento, 110110 CC-e, ...
+    n_seq_evento: Mapped[int] = mapped_column(Integer, nullable=False, server_default=sa_text('1'))
+    dh_evento: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    descricao: Mapped[Optional[str]] = mapped_column(String(100))
+    protocolo: Mapped[Optional[str]] = mapped_column(String(100))
+    nsu: Mapped[Optional[int]] = mapped_column(BigInteger)
+    doc_schema: Mapped[Optional[str]] = mapped_column(String(50))  # resEvento, procEventoNFe
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, server_default=sa_text('now()'))
+
+    __table_args__ = (
+        UniqueConstraint("company_id", "chave", "tp_evento", "n_seq_evento", name="uq_nfe_event"),
+        Index("idx_nfe_events_chave", "company_id", "chave"),
+    )
+
+
+class NfeItem(Base):
+    """Item (det/prod) de uma NF-e completa"""
+    __tablename__ = "nfe_items"
+
+    id: Mapped[UUID] = mapped_column(PGUUID(as_uuid=True), primary_key=True, server_default=sa_text('gen_random_uuid()'))
+    company_id: Mapped[int] = mapped_column(Integer, ForeignKey("companies.id", ondelete="CASCADE"), nullable=False)
+    chave: Mapped[str] = mapped_column(String(44), nullable=False)  # chave da NF-e (nfe_documents.chave)
+    n_item: Mapped[int] = mapped_column(Integer, nullable=False)
+    codigo_produto: Mapped[Optional[str]] = mapped_column(String(60))  # cProd
+    ean: Mapped[Optional[str]] = mapped_column(String(14))  # cEAN (ou "SEM GTIN")
+    descricao: Mapped[Optional[str]] = mapped_column(String(120))
+    ncm: Mapped[Optional[str]] = mapped_column(String(8))
+    cfop: Mapped[Optional[str]] = mapped_column(String(4))
+    unidade: Mapped[Optional[str]] = mapped_column(String(6))  # uCom
+    quantidade: Mapped[Optional[float]] = mapped_column(Numeric(15, 4))  # qCom
+    valor_unitario: Mapped[Optional[float]] = mapped_column(Numeric(21, 10))  # vUnCom
+    valor_total: Mapped[Optional[float]] = mapped_column(Numeric(15, 2))  # vProd
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, server_default=sa_text('now()'))
+
+    __table_args__ = (
+        UniqueConstraint("company_id", "chave", "n_item", name="uq_nfe_item"),
+        Index("idx_nfe_items_ncm", "company_id", "ncm"),
+        Index("idx_nfe_items_cfop", "company_id", "cfop"),
+        Index("idx_nfe_items_codigo_produto", "company_id", "codigo_produto"),
+    )
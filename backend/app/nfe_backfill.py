@@ -0,0 +1,421 @@
+"""
+Backfill histórico de DF-e em faixas de NSU paralelas
+
+Na primeira sincronização de uma empresa com muito histórico, o cursor
+sequencial (ultNSU) anda 50 documentos por requisição. O backfill divide a
+faixa de NSUs pendente em blocos de NFE_BACKFILL_CHUNK_SIZE e percorre alguns
+blocos ao mesmo tempo, cada um com seu próprio cursor, sob o token bucket do
+certificado.
+
+Cada bloco é paginado com distNSU a partir do seu início: a SEFAZ devolve até
+50 documentos por chamada, enquanto consNSU devolve apenas um. Documentos além
+do fim do bloco são descartados (pertencem ao bloco seguinte). O progresso de
+cada bloco (next_nsu) é gravado no mesmo commit dos documentos da página, de
+modo que um reinício retoma de onde parou.
+
+O cursor incremental (sefaz_dfe_state.last_nsu) só avança sobre faixas
+concluídas contíguas a partir de last_nsu + 1 (contiguous_cursor): uma faixa
+pedida com nsu_start além do cursor não faz a sincronização pular os NSUs
+que ficaram no meio.
+
+Faixas explícitas (nsu_start/nsu_end) não podem se sobrepor às já gravadas
+nem ser pedidas com faixas pendentes (BackfillConflict, 409 na API); o
+planejamento padrão só cria faixas para os NSUs ainda não cobertos.
+"""
+from datetime import datetime
+import asyncio
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import AsyncSessionLocal
+from app.models import Company, NfeBackfillRange, SefazDfeState
+from app.sefaz_client import SefazDFeClient, DFeDocument
+from app.sefaz_rate_limiter import backfill_limiter
+from app.certificate_service import CertificateService
+from app.storage import MinIOService as StorageService
+from app.nfe_sync_service import NfeSyncService, nsu_value
+from app.nfe_nsu_failures import failures_from_response, record_failures
+from app.sync_lease import company_lease, LeaseUnavailable
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class BackfillAborted(Exception):
+    """A SEFAZ recusou as consultas (ex.: cStat 656); os demais blocos param"""
+
+
+class BackfillConflict(ValueError):
+    """Faixa pedida conflita com faixas pendentes ou já gravadas"""
+
+
+def split_nsu_range(nsu_start: int, nsu_end: int, chunk_size: int) -> List[tuple]:
+    """Divide [nsu_start, nsu_end] em blocos contíguos de até chunk_size NSUs"""
+    chunk_size = max(1, chunk_size)
+    return [
+        (start, min(start + chunk_size - 1, nsu_end))
+        for start in range(nsu_start, nsu_end + 1, chunk_size)
+    ]
+
+
+def uncovered_ranges(nsu_start: int, nsu_end: int, ranges: Iterable[Any]) -> List[tuple]:
+    """Trechos de [nsu_start, nsu_end] que nenhuma faixa gravada cobre"""
+    gaps = []
+    start = nsu_start
+    for backfill_range in sorted(ranges, key=lambda r: r.nsu_start):
+        if backfill_range.nsu_end < start:
+            continue
+        if backfill_range.nsu_start > nsu_end:
+            break
+        if backfill_range.nsu_start > start:
+            gaps.append((start, backfill_range.nsu_start - 1))
+        start = backfill_range.nsu_end + 1
+    if start <= nsu_end:
+        gaps.append((start, nsu_end))
+    return gaps
+
+
+def check_requested_bounds(
+    ranges: Iterable[Any],
+    last_nsu: int,
+    nsu_start: Optional[int],
+    nsu_end: Optional[int]
+) -> None:
+    """
+    Valida nsu_start/nsu_end pedidos explicitamente
+
+    Raises:
+        ValueError: nsu_start maior que nsu_end
+        BackfillConflict: há faixas pendentes ou a faixa pedida se sobrepõe a
+            uma faixa já gravada
+    """
+    if nsu_start is None and nsu_end is None:
+        return
+    if nsu_start is not None and nsu_end is not None and nsu_start > nsu_end:
+        raise ValueError(f"nsu_start ({nsu_start}) maior que nsu_end ({nsu_end})")
+
+    ranges = list(ranges)
+    pending = [r for r in ranges if r.status != 'done']
+    if pending:
+        raise BackfillConflict(
+            f"Backfill pendente nas faixas {pending[0].nsu_start}-{pending[-1].nsu_end}; "
+            "conclua-o antes de pedir outra faixa"
+        )
+
+    start = nsu_start if nsu_start is not None else last_nsu + 1
+    for backfill_range in ranges:
+        if backfill_range.nsu_end >= start and (nsu_end is None or backfill_range.nsu_start <= nsu_end):
+            raise BackfillConflict(
+                f"Faixa pedida se sobrepõe à faixa já processada "
+                f"{backfill_range.nsu_start}-{backfill_range.nsu_end}"
+            )
+
+
+async def validate_backfill_request(
+    db: AsyncSession,
+    company_id: int,
+    nsu_start: Optional[int],
+    nsu_end: Optional[int]
+) -> None:
+    """check_requested_bounds com as faixas e o cursor gravados (antes de enfileirar o job)"""
+    if nsu_start is None and nsu_end is None:
+        return
+    ranges_result = await db.execute(
+        select(NfeBackfillRange).where(NfeBackfillRange.company_id == company_id)
+    )
+    state_result = await db.execute(
+        select(SefazDfeState.last_nsu).where(SefazDfeState.company_id == company_id)
+    )
+    check_requested_bounds(
+        ranges_result.scalars().all(),
+        nsu_value(state_result.scalar_one_or_none()),
+        nsu_start,
+        nsu_end,
+    )
+
+
+def contiguous_cursor(last_nsu: int, ranges: Iterable[Any]) -> int:
+    """
+    Até onde o cursor incremental pode avançar
+
+    Percorre as faixas concluídas em ordem a partir de last_nsu + 1 e para no
+    primeiro buraco (NSUs nunca consultados) ou na primeira faixa não concluída.
+    """
+    cursor = last_nsu
+    for backfill_range in sorted(ranges, key=lambda r: r.nsu_start):
+        if backfill_range.nsu_end <= cursor:
+            continue
+        if backfill_range.nsu_start > cursor + 1 or backfill_range.status != 'done':
+            break
+        cursor = backfill_range.nsu_end
+    return cursor
+
+
+class NfeBackfillService:
+    """Planeja e executa o backfill de NSUs de uma empresa"""
+
+    def __init__(self, db: AsyncSession, cert_service: CertificateService, storage: StorageService):
+        self.db = db
+        self.cert_service = cert_service
+        self.storage = storage
+
+    async def run(
+        self,
+        company_id: int,
+        nsu_start: Optional[int] = None,
+        nsu_end: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Executa (ou retoma) o backfill da empresa
+
+        Usa o mesmo lease da sincronização incremental: enquanto o backfill
+        roda, o scheduler não percorre a mesma faixa pelo cursor sequencial.
+
+        Args:
+            company_id: ID da empresa
+            nsu_start: Primeiro NSU (padrão: logo após o cursor atual)
+            nsu_end: Último NSU (padrão: maxNSU informado pela SEFAZ)
+
+        Returns:
+            Dict com status, faixas e documentos encontrados/importados
+        """
+        try:
+            async with company_lease(company_id, "nfe_sync"):
+                return await self._run(company_id, nsu_start, nsu_end)
+        except LeaseUnavailable:
+            return {
+                'company_id': company_id,
+                'status': 'running',
+                'error_message': 'Sincronização já em andamento para esta empresa',
+            }
+
+    async def list_ranges(self, company_id: int) -> List[NfeBackfillRange]:
+        result = await self.db.execute(
+            select(NfeBackfillRange)
+            .where(NfeBackfillRange.company_id == company_id)
+            .order_by(NfeBackfillRange.nsu_start)
+        )
+        return list(result.scalars().all())
+
+    async def _run(self, company_id: int, nsu_start: Optional[int], nsu_end: Optional[int]) -> Dict[str, Any]:
+        company_result = await self.db.execute(select(Company).where(Company.id == company_id))
+        company = company_result.scalar_one_or_none()
+        if not company:
+            raise ValueError("Empresa não encontrada")
+
+        cert = await self.cert_service.get_certificate(company_id)
+        if not cert or cert.status != 'active':
+            raise ValueError("Certificado não encontrado ou inativo")
+
+        material = await self.cert_service.get_certificate_material(cert)
+        sefaz_client = SefazDFeClient(
+            cnpj=cert.cnpj,
+            material=material,
+            producao=settings.NFE_AMBIENTE_PRODUCAO,
+            uf_code=getattr(company, 'codigo_ibge_uf', None) or None
+        )
+
+        # Faixa explícita que conflita com as gravadas falha aqui, sem ser trocada
+        # pela retomada das pendentes
+        await validate_backfill_request(self.db, company_id, nsu_start, nsu_end)
+
+        existing = await self.list_ranges(company_id)
+        ranges = [r for r in existing if r.status != 'done']
+        if not ranges:
+            ranges = await self._plan(company_id, sefaz_client, existing, nsu_start, nsu_end)
+        if not ranges:
+            return {
+                'company_id': company_id,
+                'status': 'success',
+                'ranges': 0,
+                'docs_found': 0,
+                'docs_imported': 0,
+            }
+
+        logger.info(
+            "backfill_started",
+            extra={"company_id": company_id, "ranges": len(ranges), "nsu_start": ranges[0].nsu_start, "nsu_end": ranges[-1].nsu_end}
+        )
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for backfill_range in ranges:
+            queue.put_nowait(backfill_range.id)
+        abort = asyncio.Event()
+
+        async def worker() -> None:
+            while not abort.is_set():
+                try:
+                    range_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    await self._run_range(range_id, company_id, cert.cnpj, sefaz_client, abort)
+                except BackfillAborted:
+                    abort.set()
+
+        await asyncio.gather(*(worker() for _ in range(max(1, settings.NFE_BACKFILL_WORKERS))))
+
+        # Resultado consolidado a partir do banco (inclui execuções anteriores)
+        self.db.expire_all()
+        all_ranges = await self.list_ranges(company_id)
+        done = all(r.status == 'done' for r in all_ranges)
+        await self._advance_cursor(company_id, all_ranges)
+
+        errors = [r.last_error for r in all_ranges if r.status == 'error' and r.last_error]
+        return {
+            'company_id': company_id,
+            'status': 'success' if done else ('error' if abort.is_set() else 'partial'),
+            'ranges': len(all_ranges),
+            'ranges_done': sum(1 for r in all_ranges if r.status == 'done'),
+            'docs_found': sum(r.docs_found for r in all_ranges),
+            'docs_imported': sum(r.docs_imported for r in all_ranges),
+            'error_message': errors[0] if errors else None,
+        }
+
+    async def _plan(
+        self,
+        company_id: int,
+        sefaz_client: SefazDFeClient,
+        existing: List[NfeBackfillRange],
+        nsu_start: Optional[int],
+        nsu_end: Optional[int]
+    ) -> List[NfeBackfillRange]:
+        """Cria as faixas pendentes (a partir do cursor até o maxNSU), fora das já gravadas"""
+        state_result = await self.db.execute(
+            select(SefazDfeState).where(SefazDfeState.company_id == company_id)
+        )
+        state = state_result.scalar_one_or_none()
+        last_nsu = nsu_value(state.last_nsu) if state else 0
+
+        if nsu_start is None:
+            nsu_start = last_nsu + 1
+        if nsu_end is None:
+            await backfill_limiter(sefaz_client.cnpj).acquire()
+            probe = await sefaz_client.consultar_distribuicao(ultimo_nsu=str(last_nsu))
+            if probe.get('status') not in (137, 138):
+                raise ValueError(f"SEFAZ recusou a consulta: {probe.get('status')} - {probe.get('motivo')}")
+            nsu_end = nsu_value(probe.get('max_nsu'))
+
+        if nsu_end < nsu_start:
+            return []
+
+        ranges = [
+            NfeBackfillRange(
+                company_id=company_id,
+                nsu_start=start,
+                nsu_end=end,
+                next_nsu=start - 1,
+                status='pending',
+            )
+            for gap_start, gap_end in uncovered_ranges(nsu_start, nsu_end, existing)
+            for start, end in split_nsu_range(gap_start, gap_end, settings.NFE_BACKFILL_CHUNK_SIZE)
+        ]
+        if not ranges:
+            return []
+        self.db.add_all(ranges)
+        await self.db.commit()
+        return ranges
+
+    async def _run_range(
+        self,
+        range_id,
+        company_id: int,
+        company_cnpj: str,
+        sefaz_client: SefazDFeClient,
+        abort: asyncio.Event
+    ) -> None:
+        """Percorre uma faixa com sessão própria, gravando o cursor a cada página"""
+        limiter = backfill_limiter(company_cnpj)
+
+        async with AsyncSessionLocal() as db:
+            backfill_range = await db.get(NfeBackfillRange, range_id)
+            sync_service = NfeSyncService(db, self.cert_service, self.storage)
+            cache: Dict[str, DFeDocument] = {}
+
+            backfill_range.status = 'running'
+            backfill_range.updated_at = datetime.utcnow()
+            await db.commit()
+
+            try:
+                while backfill_range.next_nsu < backfill_range.nsu_end and not abort.is_set():
+                    await limiter.acquire()
+                    response = await sefaz_client.consultar_distribuicao(
+                        ultimo_nsu=str(backfill_range.next_nsu)
+                    )
+                    cstat = response.get('status')
+                    if cstat not in (137, 138):
+                        backfill_range.status = 'error'
+                        backfill_range.last_error = f"{cstat} - {response.get('motivo')}"
+                        backfill_range.updated_at = datetime.utcnow()
+                        await db.commit()
+                        raise BackfillAborted(backfill_range.last_error)
+
+                    docs = [
+                        doc for doc in response['documentos']
+                        if nsu_value(doc.nsu) <= backfill_range.nsu_end
+                    ]
+                    resolved_docs = await sync_service.resolve_full_documents(
+                        company_id=company_id,
+                        sefaz_client=sefaz_client,
+                        docs=docs,
+                        cache=cache
+                    )
+                    page_result = await sync_service.ingest.persist_page(
+                        company_id=company_id,
+                        company_cnpj=company_cnpj,
+                        docs=resolved_docs,
+                        commit=False
+                    )
+                    await record_failures(db, company_id, [
+                        failure
+                        for failure in failures_from_response(response) + page_result.failures
+                        if nsu_value(failure.nsu) <= backfill_range.nsu_end
+                    ])
+
+                    # Sem NSUs além do cursor (137) ou ultNSU no/além do fim: faixa completa
+                    ult_nsu = nsu_value(response.get('ult_nsu'))
+                    if cstat == 137 or ult_nsu <= backfill_range.next_nsu:
+                        backfill_range.next_nsu = backfill_range.nsu_end
+                    else:
+                        backfill_range.next_nsu = min(ult_nsu, backfill_range.nsu_end)
+                    backfill_range.docs_found += len(docs)
+                    backfill_range.docs_imported += page_result.imported
+                    backfill_range.updated_at = datetime.utcnow()
+                    await db.commit()
+
+                if backfill_range.next_nsu >= backfill_range.nsu_end:
+                    backfill_range.status = 'done'
+                    backfill_range.last_error = None
+                else:
+                    backfill_range.status = 'pending'
+                backfill_range.updated_at = datetime.utcnow()
+                await db.commit()
+
+            except BackfillAborted:
+                raise
+            except Exception as e:
+                logger.error(f"Erro no backfill da faixa {backfill_range.nsu_start}-{backfill_range.nsu_end}: {e}")
+                await db.rollback()
+                backfill_range.status = 'error'
+                backfill_range.last_error = str(e)
+                backfill_range.updated_at = datetime.utcnow()
+                await db.commit()
+
+    async def _advance_cursor(self, company_id: int, ranges: List[NfeBackfillRange]) -> None:
+        """Leva o cursor incremental ao fim das faixas concluídas contíguas a ele"""
+        state_result = await self.db.execute(
+            select(SefazDfeState).where(SefazDfeState.company_id == company_id)
+        )
+        state = state_result.scalar_one_or_none()
+        last_nsu = nsu_value(state.last_nsu) if state else 0
+        nsu_end = contiguous_cursor(last_nsu, ranges)
+        if nsu_end <= last_nsu:
+            return
+        if not state:
+            state = SefazDfeState(company_id=company_id, last_nsu="0", last_status="ok")
+            self.db.add(state)
+        state.last_nsu = str(nsu_end).zfill(15)
+        await self.db.commit()
@@ -0,0 +1,153 @@
+"""
+Consulta por chave (consChNFe) com cache entre requisições
+
+A mesma chave é consultada várias vezes em poucos minutos: refetch do procNFe
+na sincronização, tentativas da manifestação e importação por chave. Cada
+consulta é uma ida SOAP com mTLS que conta no limite da SEFAZ.
+
+- Positivo: se o procNFe da chave já está gravado (xml_kind = 'full'), o XML
+  sai do storage, sem consultar a SEFAZ.
+- Negativo: uma consulta que só trouxe resNFe fica em memória por
+  NFE_CHAVE_NEGATIVE_TTL_SECONDS, por certificado. Reconsultas logo após uma
+  manifestação aceita passam refresh=True (e a manifestação invalida a chave).
+"""
+from collections import OrderedDict
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import NfeDocument
+from app.sefaz_client import DFeDocument, SefazDFeClient, identify_document_type
+from app.storage import MinIOService as StorageService
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+# (cnpj, chave) -> (resposta só com resumo, expira em)
+_negative: "OrderedDict[Tuple[str, str], Tuple[Dict[str, Any], float]]" = OrderedDict()
+
+
+def has_full(response: Dict[str, Any]) -> bool:
+    return any('procNFe' in (doc.schema or '') for doc in response.get('documentos', []))
+
+
+def get_negative(cnpj: str, chave: str) -> Optional[Dict[str, Any]]:
+    entry = _negative.get((cnpj, chave))
+    if entry is None:
+        return None
+    response, expires_at = entry
+    if time.monotonic() >= expires_at:
+        _negative.pop((cnpj, chave), None)
+        return None
+    return response
+
+
+def put_negative(cnpj: str, chave: str, response: Dict[str, Any]) -> None:
+    key = (cnpj, chave)
+    _negative.pop(key, None)
+    _negative[key] = (response, time.monotonic() + settings.NFE_CHAVE_NEGATIVE_TTL_SECONDS)
+    while len(_negative) > settings.NFE_CHAVE_CACHE_MAX_ENTRIES:
+        _negative.popitem(last=False)
+
+
+def invalidate(chave: str, cnpj: Optional[str] = None) -> None:
+    if cnpj is not None:
+        _negative.pop((cnpj, chave), None)
+        return
+    for key in [key for key in _negative if key[1] == chave]:
+        _negative.pop(key, None)
+
+
+class ChaveLookup:
+    """consultar_por_chave servido do XML gravado ou do cache negativo quando possível"""
+
+    def __init__(self, db: AsyncSession, storage: StorageService):
+        self.db = db
+        self.storage = storage
+
+    async def consultar(
+        self,
+        sefaz_client: SefazDFeClient,
+        company_id: int,
+        chave: str,
+        refresh: bool = False,
+        check_stored: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Mesmo formato de SefazDFeClient.consultar_por_chave
+
+        Args:
+            refresh: Ignora o cache negativo (o XML gravado continua valendo)
+            check_stored: Procura o procNFe gravado antes (False quando o
+                chamador já filtrou as chaves com full_chaves)
+
+        Returns:
+            Dict com status e documentos; 'cached' indica a origem
+            ('stored' ou 'negative') quando a SEFAZ não foi consultada
+        """
+        stored = await self._stored_full(company_id, chave) if check_stored else None
+        if stored is not None:
+            return {
+                'status': 138,
+                'motivo': 'XML completo já armazenado',
+                'documentos': [stored],
+                'falhas': [],
+                'cached': 'stored',
+            }
+
+        if not refresh:
+            cached = get_negative(sefaz_client.cnpj, chave)
+            if cached is not None:
+                logger.debug(f"consChNFe {chave} servido do cache negativo")
+                return {**cached, 'cached': 'negative'}
+
+        response = await sefaz_client.consultar_por_chave(chave)
+        if response.get('status') == 138 and not has_full(response):
+            put_negative(sefaz_client.cnpj, chave, response)
+        elif has_full(response):
+            invalidate(chave, sefaz_client.cnpj)
+        return response
+
+    async def full_chaves(self, company_id: int, chaves: Iterable[str]) -> Set[str]:
+        """Chaves da lista cujo procNFe já está gravado (uma consulta para a página)"""
+        chaves = list(chaves)
+        if not chaves:
+            return set()
+        result = await self.db.execute(
+            select(NfeDocument.chave).where(
+                NfeDocument.company_id == company_id,
+                NfeDocument.chave.in_(chaves),
+                NfeDocument.xml_kind == 'full',
+            )
+        )
+        return set(result.scalars().all())
+
+    async def _stored_full(self, company_id: int, chave: str) -> Optional[DFeDocument]:
+        result = await self.db.execute(
+            select(NfeDocument.nsu, NfeDocument.xml_storage_key).where(
+                NfeDocument.company_id == company_id,
+                NfeDocument.chave == chave,
+                NfeDocument.xml_kind == 'full',
+            )
+        )
+        row = result.first()
+        if row is None:
+            return None
+        try:
+            xml_bytes = await asyncio.to_thread(self.storage.get_object, row.xml_storage_key)
+        except Exception as e:
+            logger.warning(f"XML completo de {chave} não lido do storage ({e}), consultando a SEFAZ")
+            return None
+        schema = 'procNFe_v4.00.xsd'
+        return DFeDocument(
+            nsu=row.nsu,
+            schema=schema,
+            chave=chave,
+            tipo_documento=identify_document_type(schema),
+            xml_content=xml_bytes.decode('utf-8'),
+        )
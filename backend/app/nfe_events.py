@@ -0,0 +1,164 @@
+"""
+Eventos de NF-e recebidos pela distribuição DF-e (resEvento / procEventoNFe)
+
+Cancelamentos, cartas de correção e manifestações chegam no mesmo fluxo de
+NSUs que as notas, com a chave da nota afetada em chNFe. Eles não viram linhas
+de NfeDocument: cada evento é gravado em nfe_events e, ao final da página, a
+situação das notas afetadas é atualizada com um UPDATE por situação de destino
+(apply_situacao), na mesma transação que grava os documentos e o cursor.
+
+O evento pode chegar antes da nota (em outra página, ou a nota só aparece
+depois via consChNFe). Por isso apply_situacao também recebe as chaves das
+notas gravadas na página e consulta nfe_events para elas.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import logging
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import exists, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import NfeDocument, NfeEvent
+from app import nfe_xml_parser
+from app.sefaz_client import DFeDocument
+
+logger = logging.getLogger(__name__)
+
+
+EVENT_SCHEMAS = ('resEvento', 'procEventoNFe')
+
+# Eventos que mudam a situação da nota. CC-e (110110) e as manifestações do
+# destinatário (2102xx) ficam só registrados.
+SITUACAO_POR_EVENTO = {
+    '110111': 'cancelada',  # Cancelamento
+    '110112': 'cancelada',  # Cancelamento por substituição
+}
+
+
+@dataclass
+class NfeEventInfo:
+    """Evento extraído de um docZip"""
+    chave: str
+    tp_evento: str
+    n_seq_evento: int
+    dh_evento: Optional[datetime]
+    descricao: Optional[str]
+    protocolo: Optional[str]
+    nsu: str
+    schema: str
+
+
+def is_event_schema(schema: Optional[str]) -> bool:
+    return any(name in (schema or '') for name in EVENT_SCHEMAS)
+
+
+def _parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    """dhEvento (com fuso) -> UTC sem fuso, como as demais colunas DateTime"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_event(doc: DFeDocument) -> NfeEventInfo:
+    """
+    Extrai chave, tipo e sequência do evento
+
+    Raises:
+        ValueError: XML inválido ou sem chNFe/tpEvento
+    """
+    parsed = nfe_xml_parser.parse(doc.xml_content)
+    event = parsed.events[0] if parsed.events else None
+    chave = (event.chave if event else None) or doc.chave
+    if event is None or not chave or not event.tp_evento:
+        raise ValueError("Evento sem chNFe ou tpEvento")
+    try:
+        n_seq_evento = int(event.n_seq_evento or 1)
+    except ValueError:
+        n_seq_evento = 1
+
+    return NfeEventInfo(
+        chave=chave,
+        tp_evento=event.tp_evento,
+        n_seq_evento=n_seq_evento,
+        dh_evento=_parse_datetime(event.dh_evento),
+        descricao=event.descricao[:100] if event.descricao else None,
+        protocolo=event.protocolo,
+        nsu=doc.nsu,
+        schema=doc.schema,
+    )
+
+
+async def record_events(db: AsyncSession, company_id: int, events: Sequence[NfeEventInfo]) -> None:
+    """Grava os eventos da página (idempotente por chave + tipo + sequência), sem commit"""
+    if not events:
+        return
+    rows = {
+        (event.chave, event.tp_evento, event.n_seq_evento): {
+            'company_id': company_id,
+            'chave': event.chave,
+            'tp_evento': event.tp_evento,
+            'n_seq_evento': event.n_seq_evento,
+            'dh_evento': event.dh_evento,
+            'descricao': event.descricao,
+            'protocolo': event.protocolo,
+            'nsu': int(event.nsu) if (event.nsu or '').isdigit() else None,
+            'doc_schema': (event.schema or '')[:50] or None,
+            'created_at': datetime.utcnow(),
+        }
+        for event in events
+    }
+    stmt = pg_insert(NfeEvent).values(list(rows.values()))
+    await db.execute(stmt.on_conflict_do_nothing(constraint='uq_nfe_event'))
+
+
+def _eventos_por_situacao() -> Dict[str, List[str]]:
+    grouped: Dict[str, List[str]] = {}
+    for tp_evento, situacao in SITUACAO_POR_EVENTO.items():
+        grouped.setdefault(situacao, []).append(tp_evento)
+    return grouped
+
+
+async def apply_situacao(db: AsyncSession, company_id: int, chaves: Iterable[str]) -> int:
+    """
+    Aplica a situação vinda dos eventos às notas das chaves informadas, sem commit
+
+    Um UPDATE por situação de destino (hoje só 'cancelada'), não importa
+    quantos eventos a página trouxe.
+
+    Returns:
+        Quantidade de notas alteradas
+    """
+    chaves = list(set(chaves))
+    if not chaves:
+        return 0
+    now = datetime.utcnow()
+    updated = 0
+    for situacao, tipos in _eventos_por_situacao().items():
+        stmt = (
+            update(NfeDocument)
+            .where(
+                NfeDocument.company_id == company_id,
+                NfeDocument.chave.in_(chaves),
+                NfeDocument.situacao != situacao,
+                exists().where(
+                    NfeEvent.company_id == NfeDocument.company_id,
+                    NfeEvent.chave == NfeDocument.chave,
+                    NfeEvent.tp_evento.in_(tipos),
+                ),
+            )
+            .values(situacao=situacao, updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        result = await db.execute(stmt)
+        updated += result.rowcount or 0
+    if updated:
+        logger.info(f"{updated} nota(s) da empresa {company_id} atualizadas por eventos")
+    return updated
@@ -0,0 +1,397 @@
+"""
+Persistência em lote de documentos DF-e
+
+Recebe uma página inteira de documentos já resolvidos e grava tudo com uma
+única consulta de existência (chave IN (...)) e um único
+INSERT ... ON CONFLICT (chave) DO UPDATE, que promove resumos (resNFe) para
+XML completo (procNFe). Eventos (resEvento/procEventoNFe) da página vão para
+nfe_events e atualizam a situação das notas (app.nfe_events); os itens das
+notas completas vão para nfe_items (app.nfe_items).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+import asyncio
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, case, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import NfeDocument
+from app import nfe_xml_parser
+from app.nfe_xml_parser import NfeXml
+from app.nfe_events import NfeEventInfo, apply_situacao, is_event_schema, parse_event, record_events
+from app.nfe_items import item_rows, record_items
+from app.sefaz_client import DFeDocument
+from app.storage import MinIOService as StorageService
+from app.sync_events import sync_events
+from app.sync_metrics import StageTimer, timed
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Pool compartilhado pelo processo: o cliente MinIO é síncrono e não pode
+# rodar no event loop
+_upload_executor = ThreadPoolExecutor(
+    max_workers=settings.NFE_UPLOAD_WORKERS,
+    thread_name_prefix="nfe-upload",
+)
+
+
+# Colunas sobrescritas quando um resumo é promovido a XML completo
+UPGRADE_COLUMNS = (
+    'numero', 'serie', 'data_emissao',
+    'cnpj_emitente', 'emitente_nome',
+    'cnpj_destinatario', 'destinatario_nome',
+    'valor_total', 'xml_storage_key', 'xml_sha256', 'xml_kind', 'updated_at',
+)
+
+# Situações que a promoção para XML completo não desfaz (o protNFe do procNFe
+# continua dizendo "autorizado" depois do cancelamento)
+FINAL_SITUACOES = ('cancelada', 'denegada')
+
+
+def nsu_value(nsu: Optional[str]) -> int:
+    """Converte NSU (string com zeros à esquerda) para inteiro"""
+    try:
+        return int(nsu or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+@dataclass
+class NsuFailure:
+    """Documento da página que não foi gravado (vai para nfe_nsu_failures)"""
+    nsu: str
+    stage: str  # decode, chave, upload
+    error: str
+    chave: Optional[str] = None
+    schema: Optional[str] = None
+
+
+@dataclass
+class IngestResult:
+    """Contadores de uma página persistida"""
+    inserted: int = 0
+    upgraded: int = 0
+    skipped: int = 0
+    failed: int = 0
+    events: int = 0
+    situacao_updated: int = 0
+    items: int = 0
+    failures: List[NsuFailure] = field(default_factory=list)
+
+    @property
+    def imported(self) -> int:
+        return self.inserted + self.upgraded
+
+    def add(self, other: "IngestResult") -> None:
+        self.inserted += other.inserted
+        self.upgraded += other.upgraded
+        self.skipped += other.skipped
+        self.failed += other.failed
+        self.events += other.events
+        self.situacao_updated += other.situacao_updated
+        self.items += other.items
+        self.failures.extend(other.failures)
+
+
+class XmlUploadStage:
+    """
+    Estágio de upload de XML fora do event loop
+
+    Cada submit() entrega o blob ao pool de threads e devolve um Future. Quando
+    há NFE_UPLOAD_MAX_IN_FLIGHT uploads pendentes, submit() aguarda um deles
+    terminar (backpressure), evitando acumular páginas inteiras em memória.
+    """
+
+    def __init__(self, storage: StorageService, max_in_flight: Optional[int] = None):
+        self.storage = storage
+        self._slots = asyncio.Semaphore(max_in_flight or settings.NFE_UPLOAD_MAX_IN_FLIGHT)
+
+    async def submit(
+        self,
+        object_key: str,
+        data: bytes,
+        content_type: str = "application/xml"
+    ) -> "asyncio.Future":
+        await self._slots.acquire()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            _upload_executor,
+            self._put_if_absent,
+            object_key,
+            data,
+            content_type,
+        )
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _put_if_absent(self, object_key: str, data: bytes, content_type: str) -> bool:
+        """Chaves são endereçadas por conteúdo: se o objeto já existe, não reenvia"""
+        if self.storage.object_exists(object_key):
+            return False
+        self.storage.put_object(object_key, data, content_type)
+        return True
+
+
+def xml_storage_key(xml_sha256: str) -> str:
+    """
+    Chave endereçada por conteúdo para o XML no storage
+
+    O mesmo XML sempre cai na mesma chave, não importa quando nem quantas vezes
+    é sincronizado.
+    """
+    return f"nfe/xml/sha256/{xml_sha256[:2]}/{xml_sha256}.xml"
+
+
+def parsed_chave(doc: DFeDocument) -> Optional[str]:
+    """Chave lida do XML, para documentos em que o cliente não a encontrou"""
+    try:
+        return nfe_xml_parser.parse(doc.xml_content).chave
+    except ValueError:
+        return None
+
+
+def document_fields(parsed: NfeXml, company_cnpj: str) -> Dict[str, Any]:
+    """Colunas de NfeDocument a partir do XML já parseado"""
+    return {
+        'chave': parsed.chave or '',
+        'numero': parsed.numero,
+        'serie': parsed.serie,
+        'data_emissao': parsed.data_emissao,
+        'cnpj_emitente': parsed.emitente.cnpj,
+        'emitente_nome': parsed.emitente.nome,
+        'cnpj_destinatario': parsed.destinatario.cnpj,
+        'destinatario_nome': parsed.destinatario.nome,
+        'valor_total': parsed.valor_total,
+        'tipo': parsed.tipo_for(company_cnpj),
+        'situacao': parsed.situacao,
+    }
+
+
+def xml_kind_for(doc: DFeDocument) -> str:
+    """full para procNFe, summary para o restante"""
+    return 'full' if 'procNFe' in (doc.schema or '') else 'summary'
+
+
+class NfeIngestService:
+    """Grava páginas de DF-e em NfeDocument com poucas idas ao banco"""
+
+    def __init__(self, db: AsyncSession, storage: StorageService):
+        self.db = db
+        self.storage = storage
+
+    async def persist_page(
+        self,
+        company_id: int,
+        company_cnpj: str,
+        docs: Sequence[DFeDocument],
+        commit: bool = True,
+        timer: Optional[StageTimer] = None
+    ) -> IngestResult:
+        """
+        Persiste uma página de documentos
+
+        Args:
+            company_id: ID da empresa
+            company_cnpj: CNPJ do certificado (define tipo emitida/recebida)
+            docs: Documentos da página (já resolvidos para procNFe quando possível)
+            commit: Faz commit ao final (False quando o chamador agrupa a
+                página com outras alterações na mesma transação)
+            timer: Acumula os estágios parse/upload/db
+
+        Returns:
+            IngestResult com inserted/upgraded/skipped/failed/events
+        """
+        result = IngestResult()
+
+        # Eventos não são notas: separados antes do agrupamento por chave
+        events: List[NfeEventInfo] = []
+        for doc in docs:
+            if not is_event_schema(doc.schema):
+                continue
+            try:
+                events.append(parse_event(doc))
+            except ValueError as e:
+                logger.warning(f"Evento NSU {doc.nsu} ignorado: {e}")
+                result.failed += 1
+                result.failures.append(NsuFailure(
+                    nsu=doc.nsu, stage='decode', error=str(e), chave=doc.chave or None, schema=doc.schema
+                ))
+
+        # Uma entrada por chave; se a página trouxer resumo e completo, fica o completo
+        by_chave: Dict[str, DFeDocument] = {}
+        for doc in docs:
+            if is_event_schema(doc.schema):
+                continue
+            chave = doc.chave or parsed_chave(doc)
+            if not chave:
+                logger.warning(f"Documento NSU {doc.nsu} sem chave, ignorando")
+                result.failed += 1
+                result.failures.append(NsuFailure(
+                    nsu=doc.nsu, stage='chave', error='Documento sem chave de acesso', schema=doc.schema
+                ))
+                continue
+            current = by_chave.get(chave)
+            if current is not None:
+                result.skipped += 1
+                if xml_kind_for(current) == 'full' or xml_kind_for(doc) != 'full':
+                    continue
+            by_chave[chave] = doc
+
+        if not by_chave and not events:
+            return result
+
+        # Consulta de existência única para a página
+        existing_rows: Dict[str, Any] = {}
+        if by_chave:
+            with timed(timer, "db"):
+                existing_result = await self.db.execute(
+                    select(NfeDocument.chave, NfeDocument.xml_kind, NfeDocument.xml_sha256).where(
+                        NfeDocument.chave.in_(list(by_chave.keys()))
+                    )
+                )
+            existing_rows = {row.chave: row for row in existing_result}
+
+        # Parse + envio ao estágio de upload: o parse do próximo documento
+        # acontece enquanto o upload do anterior roda no pool de threads
+        now = datetime.utcnow()
+        publish = sync_events.has_subscribers(company_id)
+        uploads = XmlUploadStage(self.storage)
+        pending: List[Tuple[Dict[str, Any], bool, "asyncio.Future", DFeDocument, Optional[NfeXml]]] = []
+        for chave, doc in by_chave.items():
+            xml_kind = xml_kind_for(doc)
+            xml_bytes = doc.xml_content.encode('utf-8')
+            xml_sha256 = hashlib.sha256(xml_bytes).hexdigest()
+            existing = existing_rows.get(chave)
+            existing_kind = existing.xml_kind if existing is not None else None
+            if existing is not None and (
+                existing.xml_sha256 == xml_sha256
+                or not (existing_kind == 'summary' and xml_kind == 'full')
+            ):
+                logger.debug(f"Documento {chave} já existe, pulando")
+                result.skipped += 1
+                continue
+
+            storage_key = xml_storage_key(xml_sha256)
+            with timed(timer, "upload"):
+                upload = await uploads.submit(storage_key, xml_bytes)
+
+            with timed(timer, "parse"):
+                try:
+                    # Em geral já parseado pelo cliente ao decodificar o docZip (cache por SHA-256)
+                    nfe = nfe_xml_parser.parse(xml_bytes, sha256=xml_sha256)
+                    parsed = document_fields(nfe, company_cnpj)
+                except ValueError as e:
+                    logger.error(f"Erro ao fazer parse do XML {chave}: {e}")
+                    nfe = None
+                    parsed = {}
+            row = {
+                'company_id': company_id,
+                'chave': chave,
+                'nsu': doc.nsu,
+                'tipo': parsed.get('tipo') or 'desconhecida',
+                'situacao': parsed.get('situacao') or 'desconhecida',
+                'numero': parsed.get('numero'),
+                'serie': parsed.get('serie'),
+                'data_emissao': parsed.get('data_emissao'),
+                'cnpj_emitente': parsed.get('cnpj_emitente'),
+                'emitente_nome': parsed.get('emitente_nome'),
+                'cnpj_destinatario': parsed.get('cnpj_destinatario'),
+                'destinatario_nome': parsed.get('destinatario_nome'),
+                'valor_total': parsed.get('valor_total'),
+                'xml_storage_key': storage_key,
+                'xml_sha256': xml_sha256,
+                'xml_kind': xml_kind,
+                'created_at': now,
+                'updated_at': now,
+            }
+            if publish:
+                sync_events.publish(
+                    company_id, "doc_parsed",
+                    chave=chave, nsu=doc.nsu, xml_kind=xml_kind, numero=row['numero'],
+                    emitente_nome=row['emitente_nome'], valor_total=row['valor_total']
+                )
+            pending.append((row, existing_kind is None, upload, doc, nfe if xml_kind == 'full' else None))
+
+        # Só grava no banco as linhas cujo objeto foi confirmado no storage
+        with timed(timer, "upload"):
+            outcomes = await asyncio.gather(*(entry[2] for entry in pending), return_exceptions=True)
+        rows: List[Dict[str, Any]] = []
+        items: List[Dict[str, Any]] = []
+        for (row, is_new, _, doc, nfe), outcome in zip(pending, outcomes):
+            if isinstance(outcome, Exception):
+                logger.error(f"Erro ao enviar XML {row['chave']} ao storage: {outcome}")
+                result.failed += 1
+                result.failures.append(NsuFailure(
+                    nsu=doc.nsu, stage='upload', error=str(outcome), chave=row['chave'], schema=doc.schema
+                ))
+                continue
+            rows.append(row)
+            if nfe is not None:
+                items.extend(item_rows(company_id, row['chave'], nfe, now))
+            if is_new:
+                result.inserted += 1
+            else:
+                result.upgraded += 1
+
+        if rows:
+            with timed(timer, "db"):
+                await self.db.execute(self._upsert_statement(rows))
+                await record_items(self.db, items)
+                result.items = len(items)
+            if publish:
+                for row in rows:
+                    sync_events.publish(
+                        company_id, "doc_stored",
+                        chave=row['chave'], nsu=row['nsu'], xml_kind=row['xml_kind'],
+                        xml_storage_key=row['xml_storage_key']
+                    )
+
+        # Eventos da página e eventos já gravados para as notas da página
+        # (evento que chegou antes da nota) em um UPDATE por situação
+        if events or rows:
+            with timed(timer, "db"):
+                await record_events(self.db, company_id, events)
+                result.events = len(events)
+                result.situacao_updated = await apply_situacao(
+                    self.db, company_id,
+                    [event.chave for event in events] + [row['chave'] for row in rows]
+                )
+
+        if commit:
+            with timed(timer, "db"):
+                await self.db.commit()
+
+        logger.info(
+            f"Página persistida para empresa {company_id}: "
+            f"{result.inserted} novos, {result.upgraded} atualizados, "
+            f"{result.skipped} ignorados, {result.failed} com falha, "
+            f"{result.events} eventos ({result.situacao_updated} situações alteradas), "
+            f"{result.items} itens"
+        )
+        return result
+
+    @staticmethod
+    def _upsert_statement(rows: List[Dict[str, Any]]):
+        """INSERT ... ON CONFLICT (chave) DO UPDATE só para resumo -> completo"""
+        stmt = pg_insert(NfeDocument).values(rows)
+        excluded = stmt.excluded
+        set_ = {col: getattr(excluded, col) for col in UPGRADE_COLUMNS}
+        set_['tipo'] = func.coalesce(excluded.tipo, NfeDocument.tipo)
+        set_['situacao'] = case(
+            (NfeDocument.situacao.in_(FINAL_SITUACOES), NfeDocument.situacao),
+            else_=func.coalesce(excluded.situacao, NfeDocument.situacao),
+        )
+        return stmt.on_conflict_do_update(
+            constraint='uq_nfe_chave',
+            set_=set_,
+            where=and_(
+                NfeDocument.xml_kind == 'summary',
+                excluded.xml_kind == 'full',
+            ),
+        )
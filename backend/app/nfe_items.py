@@ -0,0 +1,67 @@
+"""
+Itens (det/prod) das NF-e completas em nfe_items
+
+Os itens só existiam dentro dos XMLs no storage. Ao gravar um procNFe, o
+NfeIngestService grava também uma linha por det, na mesma transação, a partir
+do parse já feito para a nota (app.nfe_xml_parser). Análises de compra por NCM,
+CFOP ou produto rodam em SQL, sem baixar e parsear os XMLs.
+
+A nota é imutável depois de autorizada: (empresa, chave, nItem) identifica o
+item e regravações são ignoradas.
+"""
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, List, Optional, Sequence
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import NfeItem
+from app.nfe_xml_parser import NfeXml
+
+# asyncpg aceita até 32767 parâmetros por comando (13 colunas por linha)
+ROWS_PER_INSERT = 2000
+
+
+def _decimal(value: Optional[str]) -> Optional[Decimal]:
+    if not value:
+        return None
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        return None
+
+
+def _text(value: Optional[str], length: int) -> Optional[str]:
+    return value[:length] if value else None
+
+
+def item_rows(company_id: int, chave: str, parsed: NfeXml, now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Linhas de nfe_items para os det de uma nota"""
+    now = now or datetime.utcnow()
+    rows = []
+    for position, item in enumerate(parsed.items, start=1):
+        n_item = int(item.n_item) if (item.n_item or '').isdigit() else position
+        rows.append({
+            'company_id': company_id,
+            'chave': chave,
+            'n_item': n_item,
+            'codigo_produto': _text(item.codigo, 60),
+            'ean': _text(item.ean, 14),
+            'descricao': _text(item.descricao, 120),
+            'ncm': _text(item.ncm, 8),
+            'cfop': _text(item.cfop, 4),
+            'unidade': _text(item.unidade, 6),
+            'quantidade': _decimal(item.quantidade),
+            'valor_unitario': _decimal(item.valor_unitario),
+            'valor_total': _decimal(item.valor_total),
+            'created_at': now,
+        })
+    return rows
+
+
+async def record_items(db: AsyncSession, rows: Sequence[Dict[str, Any]]) -> None:
+    """Grava os itens da página em INSERTs de até ROWS_PER_INSERT linhas, sem commit"""
+    for offset in range(0, len(rows), ROWS_PER_INSERT):
+        stmt = pg_insert(NfeItem).values(list(rows[offset:offset + ROWS_PER_INSERT]))
+        await db.execute(stmt.on_conflict_do_nothing(constraint='uq_nfe_item'))
@@ -0,0 +1,95 @@
+"""
+Falhas de ingestão por NSU
+
+Um documento que vem na página mas não é gravado (docZip inválido, sem chave,
+falha no storage) não segura o cursor da empresa: o NSU é registrado em
+nfe_nsu_failures na mesma transação que grava a página e avança
+SefazDfeState.last_nsu. Depois é reprocessado sozinho, com consNSU, em
+intervalos crescentes (NfeSyncService.retry_failed_nsus).
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Sequence
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import NfeNsuFailure
+from app.nfe_ingest import NsuFailure, nsu_value
+from app.config import settings
+
+
+def failures_from_response(response: Dict[str, Any]) -> List[NsuFailure]:
+    """docZips que o cliente não conseguiu decodificar"""
+    return [
+        NsuFailure(nsu=failure.nsu, stage='decode', error=failure.error, schema=failure.schema)
+        for failure in response.get('falhas', [])
+    ]
+
+
+async def record_failures(db: AsyncSession, company_id: int, failures: Sequence[NsuFailure]) -> None:
+    """
+    Registra (ou reabre) as falhas da página, sem commit
+
+    Chamado antes do commit que avança o cursor: ou os dois são gravados,
+    ou nenhum.
+    """
+    if not failures:
+        return
+    now = datetime.utcnow()
+    rows = {
+        nsu_value(failure.nsu): {
+            'company_id': company_id,
+            'nsu': nsu_value(failure.nsu),
+            'chave': failure.chave,
+            'doc_schema': (failure.schema or '')[:50] or None,
+            'stage': failure.stage,
+            'status': 'pending',
+            'last_error': failure.error[:1000],
+            'next_attempt_at': now,
+            'created_at': now,
+            'updated_at': now,
+        }
+        for failure in failures
+    }
+    stmt = pg_insert(NfeNsuFailure).values(list(rows.values()))
+    excluded = stmt.excluded
+    await db.execute(stmt.on_conflict_do_update(
+        constraint='uq_nsu_failure_company_nsu',
+        set_={
+            'chave': func.coalesce(excluded.chave, NfeNsuFailure.chave),
+            'doc_schema': func.coalesce(excluded.doc_schema, NfeNsuFailure.doc_schema),
+            'stage': excluded.stage,
+            'status': 'pending',
+            'last_error': excluded.last_error,
+            'updated_at': excluded.updated_at,
+        },
+    ))
+
+
+async def due_failures(db: AsyncSession, company_id: int, limit: int) -> List[NfeNsuFailure]:
+    """Falhas pendentes cujo próximo reprocessamento já venceu, das mais antigas às mais novas"""
+    result = await db.execute(
+        select(NfeNsuFailure)
+        .where(
+            NfeNsuFailure.company_id == company_id,
+            NfeNsuFailure.status == 'pending',
+            NfeNsuFailure.next_attempt_at <= datetime.utcnow(),
+        )
+        .order_by(NfeNsuFailure.nsu)
+        .limit(limit)
+    )
+    return list(result.scalars().all())
+
+
+def schedule_retry(failure: NfeNsuFailure, error: str) -> None:
+    """Conta a tentativa e agenda a próxima (backoff exponencial) ou desiste"""
+    now = datetime.utcnow()
+    failure.attempts = (failure.attempts or 0) + 1
+    failure.last_error = error[:1000]
+    failure.updated_at = now
+    if failure.attempts >= settings.NFE_NSU_RETRY_MAX_ATTEMPTS:
+        failure.status = 'abandoned'
+        return
+    delay = settings.NFE_NSU_RETRY_BASE_MINUTES * (2 ** (failure.attempts - 1))
+    failure.next_attempt_at = now + timedelta(minutes=min(delay, 24 * 60))
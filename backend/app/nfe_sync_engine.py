@@ -0,0 +1,106 @@
+"""
+Motor de sincronização NF-e multi-empresa
+
+Executa NfeSyncService.sync_company para várias empresas em paralelo, sob um
+limite global de concorrência. Cada worker abre sua própria sessão de banco,
+seu próprio cliente de storage e seus próprios clientes SEFAZ, de modo que uma
+empresa lenta não segura as demais.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import select
+
+from app.database import AsyncSessionLocal
+from app.models import CompanyCertificate
+from app.certificate_service import CertificateService
+from app.nfe_sync_service import NfeSyncService
+from app.nfe_sync_policy import due_company_ids
+from app.storage import MinIOService as StorageService
+from app.crypto_service import CryptoService
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class NfeSyncEngine:
+    """Pool de workers para sincronização concorrente de empresas"""
+
+    def __init__(self, max_concurrency: Optional[int] = None):
+        """
+        Args:
+            max_concurrency: Máximo de empresas sincronizando ao mesmo tempo
+                (padrão: settings.NFE_SYNC_MAX_CONCURRENCY)
+        """
+        self.max_concurrency = max(1, max_concurrency or settings.NFE_SYNC_MAX_CONCURRENCY)
+
+    @staticmethod
+    async def active_company_ids() -> List[int]:
+        """Lista as empresas com certificado ativo"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(CompanyCertificate.company_id).where(
+                    CompanyCertificate.status == 'active'
+                )
+            )
+            return list(result.scalars().all())
+
+    @staticmethod
+    async def due_company_ids() -> List[int]:
+        """Lista as empresas cuja próxima sincronização (next_sync_at) já venceu"""
+        async with AsyncSessionLocal() as db:
+            return await due_company_ids(db)
+
+    async def sync_companies(
+        self,
+        company_ids: Iterable[int],
+        sync_type: str = "incremental",
+        on_result: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Sincroniza as empresas informadas em paralelo
+
+        Args:
+            company_ids: IDs das empresas
+            sync_type: incremental, manual
+            on_result: Callback chamado com o resultado de cada empresa assim
+                que ela termina (usado para publicar progresso)
+
+        Returns:
+            Lista de resultados de sync_company, na mesma ordem de company_ids
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def worker(company_id: int) -> Dict[str, Any]:
+            async with semaphore:
+                result = await self._sync_one(company_id, sync_type)
+            if on_result is not None:
+                try:
+                    await on_result(result)
+                except Exception as e:
+                    logger.warning(f"Falha ao publicar progresso da empresa {company_id}: {e}")
+            return result
+
+        return list(await asyncio.gather(*(worker(cid) for cid in company_ids)))
+
+    async def _sync_one(self, company_id: int, sync_type: str) -> Dict[str, Any]:
+        """Sincroniza uma empresa com sessão, storage e clientes próprios"""
+        try:
+            # O construtor do MinIO faz I/O síncrono (bucket_exists)
+            storage = await asyncio.to_thread(StorageService)
+            async with AsyncSessionLocal() as db:
+                crypto = CryptoService(settings.CERT_MASTER_KEY)
+                cert_service = CertificateService(db, storage, crypto)
+                sync_service = NfeSyncService(db, cert_service, storage)
+                return await sync_service.sync_company(company_id, sync_type=sync_type)
+        except Exception as e:
+            logger.error(f"Erro ao sincronizar empresa {company_id}: {e}")
+            return {
+                'company_id': company_id,
+                'status': 'error',
+                'docs_found': 0,
+                'docs_imported': 0,
+                'last_nsu': '0',
+                'error_message': str(e)
+            }
@@ -0,0 +1,162 @@
+"""
+Política adaptativa de agendamento da sincronização NF-e
+
+Calcula o próximo horário de sincronização de cada empresa a partir do
+histórico recente: volume de documentos chegando, último cStat da SEFAZ e
+sequência de erros em NfeSyncLog. Empresas movimentadas são consultadas com
+mais frequência; empresas paradas ou perto do limite de consumo são adiadas.
+"""
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import CompanyCertificate, NfeSyncLog, SefazDfeState
+from app.config import settings
+
+
+# Quantos logs recentes olhar para medir a sequência de erros
+ERROR_STREAK_WINDOW = 10
+
+
+def sync_log_status(last_cstat: Optional[int], caught_up: bool) -> str:
+    """
+    Status gravado no NfeSyncLog ao fim de uma execução
+
+    cStat fora de 137/138 (656 e demais recusas da SEFAZ) é 'error', mesmo que
+    páginas anteriores tenham sido gravadas: é o que alimenta o backoff de
+    count_error_streak.
+    """
+    if last_cstat not in (137, 138):
+        return 'error'
+    return 'success' if caught_up else 'partial'
+
+
+def count_error_streak(statuses: Iterable[str]) -> int:
+    """
+    Execuções com status 'error' seguidas, da mais recente para trás
+
+    Só 'error' conta (exceções e recusas da SEFAZ, ver sync_log_status). Uma execução
+    'partial' com mensagem, como o pulo por cStat=137 recente, interrompe a
+    sequência em vez de parecer falha.
+    """
+    streak = 0
+    for status in statuses:
+        if status != 'error':
+            break
+        streak += 1
+    return streak
+
+
+def compute_sync_delay(
+    last_cstat: Optional[str],
+    docs_last_24h: int,
+    error_streak: int,
+    backlog: bool = False
+) -> timedelta:
+    """
+    Intervalo até a próxima sincronização
+
+    Args:
+        last_cstat: Último cStat retornado pela SEFAZ
+        docs_last_24h: Documentos importados nas últimas 24h
+        error_streak: Execuções consecutivas com erro (mais recentes)
+        backlog: A última execução parou por orçamento com NSUs pendentes
+
+    Returns:
+        timedelta entre NFE_SYNC_MIN_INTERVAL_MINUTES e NFE_SYNC_MAX_INTERVAL_HOURS
+        (exceto backlog, que volta logo para continuar drenando)
+    """
+    base = timedelta(hours=settings.NFE_SYNC_INTERVAL_HOURS)
+    minimum = timedelta(minutes=settings.NFE_SYNC_MIN_INTERVAL_MINUTES)
+    maximum = timedelta(hours=settings.NFE_SYNC_MAX_INTERVAL_HOURS)
+
+    # Consumo indevido: SEFAZ bloqueia por ~1h; adia com backoff exponencial
+    if last_cstat == '656':
+        delay = max(base, timedelta(hours=1)) * (2 ** max(error_streak - 1, 0))
+        return min(delay, maximum)
+
+    if error_streak > 0:
+        delay = minimum * (2 ** (error_streak - 1))
+        return max(minimum, min(delay, maximum))
+
+    # Ainda há NSUs pendentes: continua drenando sem esperar o ciclo normal
+    if backlog and last_cstat == '138':
+        return timedelta(minutes=settings.NFE_SYNC_BACKLOG_DELAY_MINUTES)
+
+    if docs_last_24h >= settings.NFE_SYNC_BUSY_DOCS_PER_DAY:
+        delay = minimum
+    elif docs_last_24h > 0:
+        delay = base / 2
+    else:
+        # Sem movimento: recua para o teto
+        delay = base * 2
+
+    return max(minimum, min(delay, maximum))
+
+
+async def plan_next_sync(
+    db: AsyncSession,
+    company_id: int,
+    backlog: bool = False,
+    now: Optional[datetime] = None
+) -> Optional[datetime]:
+    """
+    Calcula e grava SefazDfeState.next_sync_at da empresa (sem commit)
+
+    Returns:
+        Próximo horário de sincronização ou None se a empresa não tem estado
+    """
+    now = now or datetime.utcnow()
+
+    state_result = await db.execute(
+        select(SefazDfeState).where(SefazDfeState.company_id == company_id)
+    )
+    state = state_result.scalar_one_or_none()
+    if not state:
+        return None
+
+    docs_result = await db.execute(
+        select(func.coalesce(func.sum(NfeSyncLog.docs_imported), 0)).where(
+            NfeSyncLog.company_id == company_id,
+            NfeSyncLog.started_at >= now - timedelta(hours=24),
+        )
+    )
+    docs_last_24h = int(docs_result.scalar() or 0)
+
+    logs_result = await db.execute(
+        select(NfeSyncLog.status)
+        .where(NfeSyncLog.company_id == company_id, NfeSyncLog.status != 'running')
+        .order_by(NfeSyncLog.started_at.desc())
+        .limit(ERROR_STREAK_WINDOW)
+    )
+    error_streak = count_error_streak(logs_result.scalars())
+
+    delay = compute_sync_delay(
+        last_cstat=state.last_cstat,
+        docs_last_24h=docs_last_24h,
+        error_streak=error_streak,
+        backlog=backlog,
+    )
+    state.next_sync_at = now + delay
+    return state.next_sync_at
+
+
+async def due_company_ids(db: AsyncSession, now: Optional[datetime] = None) -> List[int]:
+    """Empresas com certificado ativo cuja próxima sincronização já venceu"""
+    now = now or datetime.utcnow()
+    result = await db.execute(
+        select(CompanyCertificate.company_id)
+        .outerjoin(SefazDfeState, SefazDfeState.company_id == CompanyCertificate.company_id)
+        .where(
+            CompanyCertificate.status == 'active',
+            or_(
+                SefazDfeState.id.is_(None),
+                SefazDfeState.next_sync_at.is_(None),
+                SefazDfeState.next_sync_at <= now,
+            ),
+        )
+        .order_by(SefazDfeState.next_sync_at.asc().nulls_first())
+    )
+    return list(result.scalars().all())
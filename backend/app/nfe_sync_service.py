@@ -2,9 +2,9 @@
 Serviço de sincronização e parsing de NF-e
 """
 from datetime import datetime, timezone
+import asyncio
 import logging
-import hashlib
-import xml.etree.ElementTree as ET
+import time
 from typing import Optional, Dict, Any, List
 import io
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -13,11 +13,19 @@ from decimal import Decimal
 
 from app.models import (
     Company, CompanyCertificate, SefazDfeState,
-    NfeDocument, NfeSyncLog
+    NfeSyncLog, NfeNsuFailure
 )
 from app.sefaz_client import SefazDFeClient, DFeDocument
 from app.certificate_service import CertificateService
 from app.storage import MinIOService as StorageService
+from app.nfe_ingest import NfeIngestService, IngestResult, document_fields, nsu_value
+from app.nfe_chave_lookup import ChaveLookup
+from app import nfe_xml_parser
+from app.nfe_nsu_failures import failures_from_response, record_failures, due_failures, schedule_retry
+from app.sync_lease import company_lease, LeaseUnavailable
+from app.nfe_sync_policy import plan_next_sync, sync_log_status
+from app.sync_events import sync_events
+from app.sync_metrics import StageTimer
 from app.config import settings
 
 logger = logging.getLogger(__name__)
@@ -26,8 +34,6 @@ logger = logging.getLogger(__name__)
 class NfeParserService:
     """Serviço para fazer parse de XMLs de NF-e"""
     
-    NS_NFE = "{http://www.portalfiscal.inf.br/nfe}"
-    
     @staticmethod
     def parse_nfe_xml(xml_content: str, company_cnpj: str) -> Dict[str, Any]:
         """
@@ -41,85 +47,7 @@ class NfeParserService:
             Dict com campos extraídos
         """
         try:
-            root = ET.fromstring(xml_content)
-            ns = NfeParserService.NS_NFE
-            
-            # Extrai chave
-            inf_nfe = root.find(f'.//{ns}infNFe')
-            chave = ""
-            if inf_nfe is not None:
-                id_attr = inf_nfe.get('Id', '')
-                if id_attr.startswith('NFe'):
-                    chave = id_attr[3:]
-            
-            # Extrai dados da NF-e
-            ide = root.find(f'.//{ns}ide')
-            emit = root.find(f'.//{ns}emit')
-            dest = root.find(f'.//{ns}dest')
-            total = root.find(f'.//{ns}total/{ns}ICMSTot')
-            
-            # Número e série
-            numero = ide.find(f'{ns}nNF').text if ide is not None and ide.find(f'{ns}nNF') is not None else None
-            serie = ide.find(f'{ns}serie').text if ide is not None and ide.find(f'{ns}serie') is not None else None
-            
-            # Data de emissão
-            data_emissao = None
-            if ide is not None:
-                dh_emi = ide.find(f'{ns}dhEmi')
-                if dh_emi is not None:
-                    try:
-                        data_emissao = datetime.fromisoformat(dh_emi.text.replace('Z', '+00:00'))
-                    except:
-                        pass
-            
-            # Emitente
-            cnpj_emitente = emit.find(f'{ns}CNPJ').text if emit is not None and emit.find(f'{ns}CNPJ') is not None else None
-            emitente_nome = emit.find(f'{ns}xNome').text if emit is not None and emit.find(f'{ns}xNome') is not None else None
-            
-            # Destinatário
-            cnpj_destinatario = None
-            destinatario_nome = None
-            if dest is not None:
-                cnpj_dest = dest.find(f'{ns}CNPJ')
-                if cnpj_dest is not None:
-                    cnpj_destinatario = cnpj_dest.text
-                nome_dest = dest.find(f'{ns}xNome')
-                if nome_dest is not None:
-                    destinatario_nome = nome_dest.text
-            
-            # Valor total
-            valor_total = None
-            if total is not None:
-                v_nf = total.find(f'{ns}vNF')
-                if v_nf is not None:
-                    try:
-                        valor_total = float(v_nf.text)
-                    except:
-                        pass
-            
-            # Determina tipo (recebida, emitida, desconhecida)
-            tipo = "desconhecida"
-            if cnpj_emitente and cnpj_destinatario:
-                company_cnpj_clean = company_cnpj.replace(".", "").replace("/", "").replace("-", "")
-                if cnpj_emitente == company_cnpj_clean:
-                    tipo = "emitida"
-                elif cnpj_destinatario == company_cnpj_clean:
-                    tipo = "recebida"
-            
-            return {
-                'chave': chave,
-                'numero': numero,
-                'serie': serie,
-                'data_emissao': data_emissao,
-                'cnpj_emitente': cnpj_emitente,
-                'emitente_nome': emitente_nome,
-                'cnpj_destinatario': cnpj_destinatario,
-                'destinatario_nome': destinatario_nome,
-                'valor_total': valor_total,
-                'tipo': tipo,
-                'situacao': 'autorizada'  # Se está no DF-e, está autorizada
-            }
-            
+            return document_fields(nfe_xml_parser.parse(xml_content), company_cnpj)
         except Exception as e:
             logger.error(f"Erro ao fazer parse do XML: {e}")
             return {
@@ -141,23 +69,76 @@ class NfeSyncService:
         self.db = db
         self.cert_service = cert_service
         self.storage = storage
+        self.ingest = NfeIngestService(db, storage)
+        self.lookup = ChaveLookup(db, storage)
     
     async def sync_company(
         self,
         company_id: int,
-        sync_type: str = "incremental"
+        sync_type: str = "incremental",
+        drain: bool = True
     ) -> Dict[str, Any]:
         """
         Sincroniza NF-e de uma empresa
         
+        Só um processo sincroniza a mesma empresa por vez (lease via advisory
+        lock); chamadas concorrentes retornam imediatamente com status 'running'.
+        
         Args:
             company_id: ID da empresa
             sync_type: incremental, manual
+            drain: Continua paginando até ultNSU == maxNSU (dentro do orçamento
+                NFE_SYNC_MAX_DOCS_PER_RUN / NFE_SYNC_MAX_SECONDS_PER_RUN)
             
         Returns:
             Dict com resultado da sincronização
         """
+        try:
+            async with company_lease(company_id, "nfe_sync"):
+                result = await self._sync_company(company_id, sync_type, drain)
+                await self._schedule_next_sync(company_id, result)
+                return result
+        except LeaseUnavailable:
+            logger.info("sync_already_running", extra={"company_id": company_id})
+            state_result = await self.db.execute(
+                select(SefazDfeState.last_nsu).where(SefazDfeState.company_id == company_id)
+            )
+            return {
+                'company_id': company_id,
+                'status': 'running',
+                'docs_found': 0,
+                'docs_imported': 0,
+                'last_nsu': state_result.scalar_one_or_none() or '0',
+                'error_message': 'Sincronização já em andamento para esta empresa'
+            }
+
+    async def _schedule_next_sync(self, company_id: int, result: Dict[str, Any]) -> None:
+        """Agenda a próxima sincronização da empresa conforme o histórico recente"""
+        try:
+            next_sync_at = await plan_next_sync(
+                self.db,
+                company_id,
+                backlog=result.get('status') == 'partial' and not result.get('error_message')
+            )
+            await self.db.commit()
+            if next_sync_at:
+                logger.info(
+                    "next_sync_planned",
+                    extra={"company_id": company_id, "next_sync_at": next_sync_at.isoformat()}
+                )
+        except Exception as e:
+            logger.warning(f"Falha ao agendar próxima sincronização da empresa {company_id}: {e}")
+            await self.db.rollback()
+
+    async def _sync_company(
+        self,
+        company_id: int,
+        sync_type: str,
+        drain: bool
+    ) -> Dict[str, Any]:
+        """Executa a sincronização (chamado com o lease da empresa adquirido)"""
         log = None
+        timer = StageTimer()
         try:
             # Verifica se a empresa existe
             company_result = await self.db.execute(
@@ -170,7 +151,8 @@ class NfeSyncService:
                     'status': 'error',
                     'error_message': 'Empresa não encontrada',
                     'docs_found': 0,
-                    'docs_imported': 0
+                    'docs_imported': 0,
+                    'last_nsu': '0'
                 }
             
             # Busca o certificado
@@ -181,7 +163,8 @@ class NfeSyncService:
                     'status': 'error',
                     'error_message': 'Certificado não encontrado ou inativo',
                     'docs_found': 0,
-                    'docs_imported': 0
+                    'docs_imported': 0,
+                    'last_nsu': '0'
                 }
             
             # Cria log de sincronização
@@ -195,7 +178,7 @@ class NfeSyncService:
             await self.db.commit()
             
             # Carrega dados do certificado
-            pfx_data, password = await self.cert_service.get_certificate_data(cert)
+            material = await self.cert_service.get_certificate_material(cert)
             
             # Obtém código IBGE da UF da empresa (se disponível)
             uf_code = None
@@ -206,10 +189,10 @@ class NfeSyncService:
             # Inicializa cliente SEFAZ
             sefaz_client = SefazDFeClient(
                 cnpj=cert.cnpj,
-                cert_pfx_data=pfx_data,
-                cert_password=password,
+                material=material,
                 producao=settings.NFE_AMBIENTE_PRODUCAO,
-                uf_code=uf_code
+                uf_code=uf_code,
+                timer=timer
             )
             
             # Busca ou cria estado de sincronização
@@ -235,6 +218,10 @@ class NfeSyncService:
                         "skip_sync_cstat_137_recent",
                         extra={"company_id": company_id, "minutes_ago": round(delta.total_seconds() / 60, 1)}
                     )
+                    log.finished_at = datetime.utcnow()
+                    log.status = 'partial'
+                    log.error_message = 'Último cStat=137 há menos de 1h'
+                    await self.db.commit()
                     return {
                         'company_id': company_id,
                         'status': 'partial',
@@ -244,76 +231,160 @@ class NfeSyncService:
                         'error_message': 'Último cStat=137 há menos de 1h'
                     }
             
-            # Consulta SEFAZ
-            ultimo_nsu = state.last_nsu
-            response = await sefaz_client.consultar_distribuicao(ultimo_nsu=ultimo_nsu)
-
-            logger.info(
-                "SEFAZ resposta",
-                extra={
-                    "company_id": company_id,
-                    "status": response.get("status"),
-                    "motivo": response.get("motivo"),
-                    "max_nsu": response.get("max_nsu"),
-                    "ult_nsu": response.get("ult_nsu"),
-                    "docs": len(response.get("documentos", [])),
-                },
-            )
-            
-            # Processa documentos
-            docs_found = len(response['documentos'])
-            docs_imported = 0
+            # Consulta SEFAZ em modo drain: pagina a partir do ultNSU até alcançar
+            # o maxNSU, respeitando o orçamento de documentos/tempo por execução
+            deadline = time.monotonic() + settings.NFE_SYNC_MAX_SECONDS_PER_RUN
+            max_docs = settings.NFE_SYNC_MAX_DOCS_PER_RUN
+            docs_found = 0
+            totals = IngestResult()
+            pages = 0
+            caught_up = False
+            last_cstat = None
+            last_motivo = None
             full_doc_cache: Dict[str, DFeDocument] = {}
+            sync_events.publish(company_id, "sync_started", sync_type=sync_type, last_nsu=state.last_nsu)
             
-            for doc in response['documentos']:
-                try:
-                    resolved_doc = await self._resolve_full_document(
+            while True:
+                response = await sefaz_client.consultar_distribuicao(ultimo_nsu=state.last_nsu)
+                pages += 1
+                last_cstat = response.get('status')
+                last_motivo = response.get('motivo')
+
+                logger.info(
+                    "SEFAZ resposta",
+                    extra={
+                        "company_id": company_id,
+                        "page": pages,
+                        "status": last_cstat,
+                        "motivo": last_motivo,
+                        "max_nsu": response.get("max_nsu"),
+                        "ult_nsu": response.get("ult_nsu"),
+                        "docs": len(response.get("documentos", [])),
+                    },
+                )
+
+                sync_events.publish(
+                    company_id, "cstat_received",
+                    page=pages, cstat=last_cstat, motivo=last_motivo
+                )
+                state.last_cstat = str(last_cstat) if last_cstat is not None else state.last_cstat
+                if last_cstat not in (137, 138):
+                    # 656 (consumo indevido) e demais rejeições: para sem avançar o NSU
+                    state.last_status = "error"
+                    state.last_error = last_motivo
+                    with timer.stage("db"):
+                        await self.db.commit()
+                    break
+                
+                # Resolve procNFe e persiste a página inteira de uma vez
+                docs_found += len(response['documentos'])
+                timer.count("pages")
+                timer.count("docs", len(response['documentos']))
+                sync_events.publish(
+                    company_id, "page_fetched",
+                    page=pages, docs=len(response['documentos']),
+                    ult_nsu=response.get('ult_nsu'), max_nsu=response.get('max_nsu')
+                )
+                with timer.stage("refetch"):
+                    resolved_docs = await self.resolve_full_documents(
+                        company_id=company_id,
                         sefaz_client=sefaz_client,
-                        original_doc=doc,
+                        docs=response['documentos'],
                         cache=full_doc_cache
                     )
-                    imported = await self._process_document(
+                try:
+                    page_result = await self.ingest.persist_page(
                         company_id=company_id,
                         company_cnpj=cert.cnpj,
-                        doc=resolved_doc
+                        docs=resolved_docs,
+                        commit=False,
+                        timer=timer
+                    )
+                    totals.add(page_result)
+                    # NSUs não gravados vão para a fila de reprocessamento no mesmo commit do cursor
+                    await record_failures(
+                        self.db, company_id,
+                        failures_from_response(response) + page_result.failures
                     )
-                    if imported:
-                        docs_imported += 1
                 except Exception as e:
-                    logger.error(f"Erro ao processar documento NSU {doc.nsu}: {e}")
-            
-            # Atualiza estado
-            state.last_cstat = str(response.get('status')) if response.get('status') is not None else state.last_cstat
-            if response['status'] in [137, 138]:  # Sucesso ou sem novos docs
-                state.last_nsu = response['max_nsu'] if response['status'] == 138 else state.last_nsu
+                    logger.error(f"Erro ao persistir página (ultNSU {state.last_nsu}): {e}")
+                    await self.db.rollback()
+                    raise
+                
+                # Persiste o cursor após cada página, no mesmo commit dos documentos
+                previous_nsu = state.last_nsu
+                ult_nsu = response.get('ult_nsu') or state.last_nsu
+                max_nsu = response.get('max_nsu') or ult_nsu
+                if nsu_value(ult_nsu) > nsu_value(state.last_nsu):
+                    state.last_nsu = ult_nsu
                 state.last_sync_at = datetime.utcnow()
                 state.last_status = "ok"
                 state.last_error = None
-            else:
-                state.last_status = "error"
-                state.last_error = response['motivo']
+                with timer.stage("db"):
+                    await self.db.commit()
+                sync_events.publish(
+                    company_id, "page_committed",
+                    page=pages, last_nsu=state.last_nsu,
+                    inserted=page_result.inserted, upgraded=page_result.upgraded,
+                    skipped=page_result.skipped, failed=page_result.failed
+                )
+
+                if last_cstat == 137 or nsu_value(state.last_nsu) >= nsu_value(max_nsu):
+                    caught_up = True
+                    break
+                if not drain:
+                    break
+                if nsu_value(state.last_nsu) <= nsu_value(previous_nsu):
+                    # 138 sem avanço do ultNSU: pedir de novo o mesmo NSU só gera consumo indevido
+                    logger.warning(
+                        "sync_cursor_stalled",
+                        extra={"company_id": company_id, "pages": pages, "last_nsu": state.last_nsu, "max_nsu": max_nsu}
+                    )
+                    break
+                if docs_found >= max_docs or time.monotonic() >= deadline:
+                    logger.info(
+                        "sync_budget_exhausted",
+                        extra={"company_id": company_id, "pages": pages, "docs_found": docs_found, "last_nsu": state.last_nsu, "max_nsu": max_nsu}
+                    )
+                    break
             
-            await self.db.commit()
+            # Reprocessa NSUs que falharam nesta ou em execuções anteriores
+            if last_cstat in (137, 138):
+                retried = await self.retry_failed_nsus(company_id, cert.cnpj, sefaz_client)
+                timer.count("nsu_retried", retried)
+            
+            docs_imported = totals.imported
+            status = sync_log_status(last_cstat, caught_up)
+            error_message = last_motivo if last_cstat not in (137, 138) else None
             
             # Atualiza log
             log.finished_at = datetime.utcnow()
-            log.status = 'success' if response['status'] == 138 else 'partial'
+            log.status = status
             log.docs_found = docs_found
             log.docs_imported = docs_imported
+            log.docs_upgraded = totals.upgraded
+            log.docs_skipped = totals.skipped
+            log.error_message = error_message
+            log.stage_timings = timer.as_dict()
             await self.db.commit()
+            sync_events.publish(
+                company_id, "sync_finished",
+                status=status, docs_found=docs_found, docs_imported=docs_imported,
+                last_nsu=state.last_nsu, error_message=error_message
+            )
             
             logger.info(
-                f"Sync empresa {company_id}: {docs_imported}/{docs_found} docs importados",
-                extra={"cStat": response.get('status'), "motivo": response.get('motivo')}
+                f"Sync empresa {company_id}: {docs_imported}/{docs_found} docs importados em {pages} página(s)",
+                extra={"cStat": last_cstat, "motivo": last_motivo}
             )
             
             return {
                 'company_id': company_id,
-                'status': 'success' if response['status'] == 138 else 'partial',
+                'status': status,
                 'docs_found': docs_found,
                 'docs_imported': docs_imported,
-                'last_nsu': response['max_nsu'],
-                'error_message': None
+                'last_nsu': state.last_nsu,
+                'error_message': error_message
             }
             
         except Exception as e:
@@ -331,11 +402,14 @@ class NfeSyncService:
             except Exception:
                 pass
             
+            sync_events.publish(company_id, "sync_finished", status='error', error_message=str(e))
+            
             # Atualiza log como erro
             if log:
                 log.finished_at = datetime.utcnow()
                 log.status = 'error'
                 log.error_message = str(e)
+                log.stage_timings = timer.as_dict()
                 await self.db.commit()
             
             return {
@@ -347,89 +421,119 @@ class NfeSyncService:
                 'last_nsu': last_nsu
             }
     
-    async def _process_document(
+    async def retry_failed_nsus(
         self,
         company_id: int,
         company_cnpj: str,
-        doc: DFeDocument
-    ) -> bool:
-        """Processa e salva um documento"""
-        try:
-            existing_result = await self.db.execute(
-                select(NfeDocument).where(NfeDocument.chave == doc.chave)
-            )
-            existing = existing_result.scalar_one_or_none()
-
-            parsed = NfeParserService.parse_nfe_xml(doc.xml_content, company_cnpj)
-            xml_kind = 'full' if 'procNFe' in (doc.schema or '') else 'summary'
-
-            year = datetime.now().year
-            month = datetime.now().month
-            storage_key = f"nfe/xml/{company_id}/{company_cnpj}/{year}/{month:02d}/{doc.chave}.xml"
+        sefaz_client: SefazDFeClient,
+        limit: Optional[int] = None
+    ) -> int:
+        """
+        Reprocessa individualmente (consNSU) os NSUs com falha de ingestão vencidos
 
-            self.storage.put_object(
-                storage_key,
-                doc.xml_content.encode('utf-8'),
-                "application/xml"
+        Returns:
+            Quantidade de NSUs resolvidos
+        """
+        failures = await due_failures(self.db, company_id, limit or settings.NFE_NSU_RETRY_PER_RUN)
+        resolved = 0
+        for failure in failures:
+            failure_id = failure.id
+            try:
+                response = await sefaz_client.consultar_nsu(str(failure.nsu).zfill(15))
+                cstat = response.get('status')
+                if cstat == 656:
+                    # Consumo indevido: não conta como tentativa, retoma na próxima execução
+                    failure.last_error = f"{cstat} - {response.get('motivo')}"
+                    failure.updated_at = datetime.utcnow()
+                    await self.db.commit()
+                    break
+                if cstat != 138 or not response['documentos']:
+                    schedule_retry(failure, f"{cstat} - {response.get('motivo')}")
+                    await self.db.commit()
+                    continue
+                
+                resolved_docs = await self.resolve_full_documents(
+                    company_id=company_id,
+                    sefaz_client=sefaz_client,
+                    docs=response['documentos'],
+                    cache={}
+                )
+                page_result = await self.ingest.persist_page(
+                    company_id=company_id,
+                    company_cnpj=company_cnpj,
+                    docs=resolved_docs,
+                    commit=False
+                )
+                errors = failures_from_response(response) + page_result.failures
+                if errors:
+                    schedule_retry(failure, f"{errors[0].stage}: {errors[0].error}")
+                else:
+                    failure.status = 'resolved'
+                    failure.resolved_at = datetime.utcnow()
+                    failure.updated_at = datetime.utcnow()
+                    resolved += 1
+                await self.db.commit()
+            except Exception as e:
+                logger.error(f"Erro ao reprocessar NSU {failure.nsu} da empresa {company_id}: {e}")
+                await self.db.rollback()
+                failure = await self.db.get(NfeNsuFailure, failure_id)
+                if failure is not None:
+                    schedule_retry(failure, str(e))
+                    await self.db.commit()
+        
+        if failures:
+            logger.info(
+                "nsu_failures_retried",
+                extra={"company_id": company_id, "attempted": len(failures), "resolved": resolved}
             )
+        return resolved
 
-            xml_sha256 = hashlib.sha256(doc.xml_content.encode('utf-8')).hexdigest()
+    async def resolve_full_documents(
+        self,
+        company_id: int,
+        sefaz_client: SefazDFeClient,
+        docs: List[DFeDocument],
+        cache: Dict[str, DFeDocument],
+        allow_refetch: bool = True
+    ) -> List[DFeDocument]:
+        """
+        Resolve procNFe para todos os resNFe da página em paralelo.
 
-            if existing:
-                if existing.xml_kind == 'summary' and xml_kind == 'full':
-                    logger.info(f"Atualizando XML completo para {doc.chave}")
-                    existing.xml_storage_key = storage_key
-                    existing.xml_sha256 = xml_sha256
-                    existing.xml_kind = xml_kind
-                    existing.updated_at = datetime.utcnow()
-                    existing.numero = parsed.get('numero')
-                    existing.serie = parsed.get('serie')
-                    existing.data_emissao = parsed.get('data_emissao')
-                    existing.cnpj_emitente = parsed.get('cnpj_emitente')
-                    existing.emitente_nome = parsed.get('emitente_nome')
-                    existing.cnpj_destinatario = parsed.get('cnpj_destinatario')
-                    existing.destinatario_nome = parsed.get('destinatario_nome')
-                    existing.valor_total = parsed.get('valor_total')
-                    existing.tipo = parsed.get('tipo') or existing.tipo
-                    existing.situacao = parsed.get('situacao') or existing.situacao
-                    await self.db.commit()
-                    return True
-                logger.debug(f"Documento {doc.chave} já existe, pulando")
-                return False
+        Chaves repetidas geram uma única consulta; chaves cujo procNFe já veio
+        na própria página ou já está gravado não são consultadas, nem as que
+        retornaram só resumo há pouco (cache negativo de ChaveLookup). O ritmo
+        das consultas é controlado pelo token bucket do certificado em
+        consultar_por_chave.
+        """
+        for doc in docs:
+            if doc.chave and 'procNFe' in (doc.schema or ''):
+                cache[doc.chave] = doc
 
-            nfe_doc = NfeDocument(
-                company_id=company_id,
-                chave=doc.chave or parsed['chave'],
-                nsu=doc.nsu,
-                tipo=parsed['tipo'],
-                situacao=parsed['situacao'],
-                numero=parsed.get('numero'),
-                serie=parsed.get('serie'),
-                data_emissao=parsed.get('data_emissao'),
-                cnpj_emitente=parsed.get('cnpj_emitente'),
-                emitente_nome=parsed.get('emitente_nome'),
-                cnpj_destinatario=parsed.get('cnpj_destinatario'),
-                destinatario_nome=parsed.get('destinatario_nome'),
-                valor_total=parsed.get('valor_total'),
-                xml_storage_key=storage_key,
-                xml_sha256=xml_sha256,
-                xml_kind=xml_kind,
-                created_at=datetime.utcnow(),
-                updated_at=datetime.utcnow()
-            )
+        to_fetch: Dict[str, DFeDocument] = {}
+        if allow_refetch:
+            for doc in docs:
+                if doc.chave and doc.chave not in cache and 'resNFe' in (doc.schema or ''):
+                    to_fetch.setdefault(doc.chave, doc)
+            # procNFe já gravado: persist_page mantém o completo, basta o resumo
+            for chave in await self.lookup.full_chaves(company_id, to_fetch.keys()):
+                cache[chave] = to_fetch.pop(chave)
 
-            self.db.add(nfe_doc)
-            await self.db.commit()
+        semaphore = asyncio.Semaphore(settings.NFE_RESOLVE_CONCURRENCY)
 
-            logger.info(f"Documento {doc.chave} importado com sucesso")
-            return True
+        async def fetch(doc: DFeDocument) -> None:
+            async with semaphore:
+                await self._resolve_full_document(company_id, sefaz_client, doc, cache, allow_refetch)
 
-        except Exception as e:
-            logger.error(f"Erro ao processar documento: {e}")
-            return False
+        await asyncio.gather(*(fetch(doc) for doc in to_fetch.values()))
+
+        return [
+            await self._resolve_full_document(company_id, sefaz_client, doc, cache, allow_refetch)
+            for doc in docs
+        ]
 
     async def _resolve_full_document(
         self,
+        company_id: int,
         sefaz_client: SefazDFeClient,
         original_doc: DFeDocument,
         cache: Dict[str, DFeDocument],
@@ -441,16 +545,21 @@ class NfeSyncService:
         if not chave:
             return original_doc
 
+        if 'resNFe' not in (original_doc.schema or ''):
+            if 'procNFe' in (original_doc.schema or ''):
+                cache[chave] = original_doc
+            return original_doc
+
         if chave in cache:
             return cache[chave]
 
-        if 'resNFe' not in (original_doc.schema or '') or not allow_refetch:
+        if not allow_refetch:
             cache[chave] = original_doc
             return original_doc
 
         try:
             logger.info(f"🔁 Buscando XML completo para chave {chave}")
-            response = await sefaz_client.consultar_por_chave(chave)
+            response = await self.lookup.consultar(sefaz_client, company_id, chave, check_stored=False)
             full_doc = next(
                 (
                     d for d in response.get('documentos', [])
@@ -492,7 +601,7 @@ class NfeSyncService:
                 }
             
             # Carrega dados do certificado
-            pfx_data, password = await self.cert_service.get_certificate_data(cert)
+            material = await self.cert_service.get_certificate_material(cert)
             
             # Obtém código IBGE da UF da empresa (se disponível)
             uf_code = None
@@ -502,32 +611,29 @@ class NfeSyncService:
             # Inicializa cliente SEFAZ
             sefaz_client = SefazDFeClient(
                 cnpj=cert.cnpj,
-                cert_pfx_data=pfx_data,
-                cert_password=password,
+                material=material,
                 producao=settings.NFE_AMBIENTE_PRODUCAO,
                 uf_code=uf_code
             )
             
-            # Consulta por chave
-            response = await sefaz_client.consultar_por_chave(chave)
+            # Consulta por chave (XML já gravado e "só resumo" recente não vão à SEFAZ)
+            response = await self.lookup.consultar(sefaz_client, company_id, chave)
             
             # Processa documentos
-            docs_imported = 0
             cache: Dict[str, DFeDocument] = {}
-            for doc in response['documentos']:
-                resolved_doc = await self._resolve_full_document(
-                    sefaz_client=sefaz_client,
-                    original_doc=doc,
-                    cache=cache,
-                    allow_refetch=False
-                )
-                imported = await self._process_document(
-                    company_id=company_id,
-                    company_cnpj=cert.cnpj,
-                    doc=resolved_doc
-                )
-                if imported:
-                    docs_imported += 1
+            resolved_docs = await self.resolve_full_documents(
+                company_id=company_id,
+                sefaz_client=sefaz_client,
+                docs=response['documentos'],
+                cache=cache,
+                allow_refetch=False
+            )
+            page_result = await self.ingest.persist_page(
+                company_id=company_id,
+                company_cnpj=cert.cnpj,
+                docs=resolved_docs
+            )
+            docs_imported = page_result.imported
             
             return {
                 'status': 'success',
@@ -0,0 +1,337 @@
+"""
+Parser de XML de NF-e em uma única passada
+
+procNFe/NFe, resNFe, procEventoNFe e resEvento são lidos com o lxml e
+percorridos uma vez, só nos grupos usados (ide, emit, dest, det/prod, ICMSTot,
+transp, infProt, infEvento): os impostos de cada item não são visitados, e não
+há as buscas './/tag' que percorriam a árvore inteira a cada campo.
+
+O resultado (NfeXml) usa __slots__ e é memorizado pelo SHA-256 do XML: o mesmo
+documento decodificado pelo cliente DF-e, gravado pelo NfeIngestService e
+aberto pela listagem ou pelo DANFE é parseado uma vez por processo. O objeto é
+compartilhado entre chamadores e não deve ser alterado.
+"""
+from collections import OrderedDict
+from datetime import datetime
+import hashlib
+import threading
+from typing import Dict, List, Optional, Union
+
+from lxml import etree
+
+from app.config import settings
+
+
+# cSitNFe do resNFe
+SITUACAO_CSIT = {'1': 'autorizada', '2': 'denegada', '3': 'cancelada'}
+# cStat do protNFe no procNFe
+SITUACAO_CSTAT = {
+    '100': 'autorizada', '150': 'autorizada',
+    '101': 'cancelada', '151': 'cancelada', '155': 'cancelada',
+    '110': 'denegada', '205': 'denegada', '301': 'denegada', '302': 'denegada', '303': 'denegada',
+}
+
+# Elemento raiz -> tipo do documento
+_KINDS = {
+    'nfeProc': 'full', 'NFe': 'full',
+    'resNFe': 'summary',
+    'procEventoNFe': 'event', 'resEvento': 'event', 'evento': 'event',
+}
+
+
+class NfeParty:
+    """Emitente ou destinatário"""
+    __slots__ = (
+        'cnpj', 'cpf', 'nome', 'fantasia', 'ie',
+        'logradouro', 'numero', 'complemento', 'bairro', 'municipio', 'uf', 'cep',
+    )
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+    @property
+    def documento(self) -> Optional[str]:
+        return self.cnpj or self.cpf
+
+    @property
+    def endereco(self) -> str:
+        if not self.logradouro:
+            return ''
+        endereco = f"{self.logradouro}, {self.numero or ''}"
+        if self.complemento:
+            endereco += f", {self.complemento}"
+        endereco += f" - {self.bairro or ''}, {self.municipio or ''}/{self.uf or ''} - CEP: {self.cep or ''}"
+        return endereco
+
+
+class NfeItem:
+    """det/prod de um item da nota (valores como no XML)"""
+    __slots__ = (
+        'n_item', 'codigo', 'ean', 'descricao', 'ncm', 'cfop',
+        'unidade', 'quantidade', 'valor_unitario', 'valor_total',
+    )
+
+    def __init__(self, n_item: Optional[str] = None):
+        for name in self.__slots__:
+            setattr(self, name, None)
+        self.n_item = n_item
+
+
+class NfeEvent:
+    """infEvento de um evento (resEvento ou procEventoNFe)"""
+    __slots__ = ('chave', 'tp_evento', 'n_seq_evento', 'dh_evento', 'descricao', 'protocolo', 'c_stat')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+
+class NfeXml:
+    """Campos de uma NF-e (completa ou resumo) ou de um evento"""
+    __slots__ = (
+        'kind', 'chave', 'modelo', 'numero', 'serie', 'natureza', 'tp_nf', 'dh_emi', 'dh_sai_ent',
+        'emitente', 'destinatario',
+        'v_bc', 'v_icms', 'v_prod', 'v_frete', 'v_seg', 'v_desc', 'v_nf',
+        'has_transp', 'mod_frete', 'c_sit_nfe', 'c_stat', 'protocolo',
+        'items', 'events',
+    )
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+        self.kind = 'unknown'
+        self.has_transp = False
+        self.emitente = NfeParty()
+        self.destinatario = NfeParty()
+        self.items: List[NfeItem] = []
+        self.events: List[NfeEvent] = []
+
+    @property
+    def data_emissao(self) -> Optional[datetime]:
+        if not self.dh_emi:
+            return None
+        try:
+            return datetime.fromisoformat(self.dh_emi.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+
+    @property
+    def valor_total(self) -> Optional[float]:
+        try:
+            return float(self.v_nf) if self.v_nf else None
+        except ValueError:
+            return None
+
+    @property
+    def situacao(self) -> str:
+        """
+        Situação informada pelo próprio documento
+
+        resNFe traz cSitNFe; procNFe traz o cStat do protNFe. Cancelamentos
+        posteriores chegam como evento (app.nfe_events).
+        """
+        if self.c_sit_nfe:
+            return SITUACAO_CSIT.get(self.c_sit_nfe, 'desconhecida')
+        if self.c_stat:
+            return SITUACAO_CSTAT.get(self.c_stat, 'autorizada')
+        # Se está no DF-e, está autorizada
+        return 'autorizada'
+
+    def tipo_for(self, company_cnpj: str) -> str:
+        """
+        emitida, recebida ou desconhecida em relação ao CNPJ do certificado
+
+        Só classifica quando emitente e destinatário têm CNPJ; resumos (sem
+        destinatário) ficam 'desconhecida' até a nota completa chegar.
+        """
+        if not (self.emitente.cnpj and self.destinatario.cnpj):
+            return 'desconhecida'
+        cnpj = company_cnpj.replace(".", "").replace("/", "").replace("-", "")
+        if self.emitente.cnpj == cnpj:
+            return 'emitida'
+        if self.destinatario.cnpj == cnpj:
+            return 'recebida'
+        return 'desconhecida'
+
+
+# Pai -> {campo do XML: atributo}
+_IDE = {
+    'mod': 'modelo', 'nNF': 'numero', 'serie': 'serie', 'natOp': 'natureza',
+    'tpNF': 'tp_nf', 'dhEmi': 'dh_emi', 'dhSaiEnt': 'dh_sai_ent',
+}
+_TOTAL = {
+    'vBC': 'v_bc', 'vICMS': 'v_icms', 'vProd': 'v_prod', 'vFrete': 'v_frete',
+    'vSeg': 'v_seg', 'vDesc': 'v_desc', 'vNF': 'v_nf',
+}
+_PARTY = {'CNPJ': 'cnpj', 'CPF': 'cpf', 'xNome': 'nome', 'xFant': 'fantasia', 'IE': 'ie'}
+_ADDRESS = {
+    'xLgr': 'logradouro', 'nro': 'numero', 'xCpl': 'complemento', 'xBairro': 'bairro',
+    'xMun': 'municipio', 'UF': 'uf', 'CEP': 'cep',
+}
+_PROD = {
+    'cProd': 'codigo', 'cEAN': 'ean', 'xProd': 'descricao', 'NCM': 'ncm', 'CFOP': 'cfop',
+    'uCom': 'unidade', 'qCom': 'quantidade', 'vUnCom': 'valor_unitario', 'vProd': 'valor_total',
+}
+_RES_NFE = {
+    'chNFe': 'chave', 'dhEmi': 'dh_emi', 'tpNF': 'tp_nf', 'vNF': 'v_nf',
+    'cSitNFe': 'c_sit_nfe', 'nProt': 'protocolo',
+}
+_EVENT = {
+    'chNFe': 'chave', 'tpEvento': 'tp_evento', 'nSeqEvento': 'n_seq_evento',
+    'dhEvento': 'dh_evento', 'xEvento': 'descricao', 'nProt': 'protocolo', 'cStat': 'c_stat',
+}
+_DET_EVENTO = {'descEvento': 'descricao'}
+_RET_EVENTO = {'nProt': 'protocolo', 'cStat': 'c_stat', 'xEvento': 'descricao'}
+_INF_PROT = {'nProt': 'protocolo', 'cStat': 'c_stat'}
+_TRANSP = {'modFrete': 'mod_frete'}
+
+
+_parsers = threading.local()
+
+
+def _xml_parser() -> etree.XMLParser:
+    # XMLParser não pode ser usado por duas threads ao mesmo tempo
+    parser = getattr(_parsers, 'parser', None)
+    if parser is None:
+        parser = etree.XMLParser(resolve_entities=False, no_network=True, huge_tree=False)
+        _parsers.parser = parser
+    return parser
+
+
+def _local_name(tag) -> Optional[str]:
+    # Comentários e instruções de processamento têm tag não-string
+    if not isinstance(tag, str):
+        return None
+    return tag[tag.rfind('}') + 1:]
+
+
+def _fill(target, element, fields: Dict[str, str]) -> None:
+    """Copia os filhos diretos de element listados em fields para target"""
+    for child in element:
+        attr = fields.get(_local_name(child.tag))
+        if attr and child.text:
+            text = child.text.strip()
+            if text:
+                setattr(target, attr, text)
+
+
+def _fill_party(party: NfeParty, element) -> None:
+    _fill(party, element, _PARTY)
+    for child in element:
+        if _local_name(child.tag) in ('enderEmit', 'enderDest'):
+            _fill(party, child, _ADDRESS)
+
+
+def _parse_inf_nfe(result: NfeXml, inf_nfe) -> None:
+    id_attr = inf_nfe.get('Id', '')
+    if id_attr.startswith('NFe'):
+        result.chave = id_attr[3:]
+    # Só os grupos usados são visitados; imposto, cobr, pag etc. são ignorados
+    for child in inf_nfe:
+        name = _local_name(child.tag)
+        if name == 'ide':
+            _fill(result, child, _IDE)
+        elif name == 'emit':
+            _fill_party(result.emitente, child)
+        elif name == 'dest':
+            _fill_party(result.destinatario, child)
+        elif name == 'det':
+            item = NfeItem(child.get('nItem'))
+            for group in child:
+                if _local_name(group.tag) == 'prod':
+                    _fill(item, group, _PROD)
+                    break
+            result.items.append(item)
+        elif name == 'total':
+            for group in child:
+                if _local_name(group.tag) == 'ICMSTot':
+                    _fill(result, group, _TOTAL)
+        elif name == 'transp':
+            result.has_transp = True
+            _fill(result, child, _TRANSP)
+
+
+def _parse_event(result: NfeXml, root) -> None:
+    # evento/infEvento abre o evento; retEvento/infEvento traz protocolo e cStat
+    event = NfeEvent()
+    result.events.append(event)
+    if _local_name(root.tag) == 'resEvento':
+        _fill(event, root, _EVENT)
+    for inf_evento in root.iter('{*}infEvento'):
+        parent = _local_name(inf_evento.getparent().tag)
+        if parent == 'retEvento':
+            _fill(event, inf_evento, _RET_EVENTO)
+            continue
+        _fill(event, inf_evento, _EVENT)
+        for child in inf_evento:
+            if _local_name(child.tag) == 'detEvento':
+                # nProt do detEvento (cancelamento) é o protocolo da nota, não do evento
+                _fill(event, child, _DET_EVENTO)
+    result.chave = event.chave
+
+
+def _parse(data: bytes) -> NfeXml:
+    result = NfeXml()
+    root = etree.fromstring(data, _xml_parser())
+    name = _local_name(root.tag)
+    result.kind = _KINDS.get(name, 'unknown')
+
+    if result.kind == 'summary':
+        _fill(result, root, _RES_NFE)
+        _fill(result.emitente, root, _PARTY)
+    elif result.kind == 'event':
+        _parse_event(result, root)
+    elif result.kind == 'full':
+        for inf_nfe in root.iter('{*}infNFe'):
+            _parse_inf_nfe(result, inf_nfe)
+            break
+        for inf_prot in root.iter('{*}infProt'):
+            _fill(result, inf_prot, _INF_PROT)
+            if not result.chave:
+                result.chave = inf_prot.findtext('{*}chNFe')
+            break
+    return result
+
+
+_cache: "OrderedDict[str, NfeXml]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def xml_sha256(xml: Union[str, bytes]) -> str:
+    data = xml.encode('utf-8') if isinstance(xml, str) else xml
+    return hashlib.sha256(data).hexdigest()
+
+
+def parse(xml: Union[str, bytes], sha256: Optional[str] = None) -> NfeXml:
+    """
+    Parse memorizado pelo SHA-256 do XML
+
+    Args:
+        xml: XML do documento (str ou bytes UTF-8)
+        sha256: Hash já calculado pelo chamador (evita recalcular)
+
+    Raises:
+        ValueError: XML malformado
+    """
+    data = xml.encode('utf-8') if isinstance(xml, str) else xml
+    key = sha256 or hashlib.sha256(data).hexdigest()
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+            return cached
+    try:
+        result = _parse(data)
+    except etree.XMLSyntaxError as e:
+        raise ValueError(f"XML inválido: {e}")
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > settings.NFE_XML_PARSE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
+
+def clear_cache() -> None:
+    with _cache_lock:
+        _cache.clear()
@@ -1,21 +1,26 @@
 """
 Rotas da API para o módulo fiscal (certificados e NF-e)
 """
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, status as http_status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, and_, or_
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta
+from uuid import UUID
 
 from app.database import get_db
 from app.auth import get_current_user
-from app.models import User, Company, CompanyCertificate, NfeDocument, SefazDfeState, NfeSyncLog
+from app.models import User, Company, CompanyCertificate, NfeDocument, SefazDfeState, NfeSyncLog, FiscalJob, NfeBackfillRange, NfeNsuFailure
 from app.schemas_fiscal import (
     CertificateResponse, CertificateUpdate,
     NfeDocumentResponse, NfeDocumentFilter,
-    SyncRequest, SyncResponse, ImportByKeyRequest,
+    SyncRequest, ImportByKeyRequest,
     SefazDfeStateResponse, NfeSyncLogResponse, NfeSyncLogFilter,
-    ResolveResponse
+    ResolveResponse, FiscalJobResponse,
+    BackfillRequest, NfeBackfillRangeResponse, NfeNsuFailureResponse,
+    SyncStageStatsResponse, StageStats,
+    SefazEndpointHealthResponse
 )
 from app.certificate_service import CertificateService
 from app.nfe_sync_service import NfeSyncService
@@ -23,9 +28,15 @@ from app.storage import MinIOService as StorageService
 from app.crypto_service import CryptoService
 from app.config import settings
 from app.manifestacao_service import ManifestacaoService
-
+from app.fiscal_jobs import submit_job, fail_stale_jobs
+from app.nfe_backfill import BackfillConflict, validate_backfill_request
+from app.sync_events import sync_events, format_sse
+from app.sync_metrics import percentile
+from app import sefaz_endpoints
+from app import nfe_xml_parser
+
+import asyncio
 import logging
-import xml.etree.ElementTree as ET
 
 logger = logging.getLogger(__name__)
 
@@ -34,32 +45,15 @@ router = APIRouter(prefix="/fiscal", tags=["fiscal"])
 
 def _parse_resnfe(xml_content: str) -> dict:
     """Extrai campos básicos de um XML resumido (resNFe)."""
-    ns = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
-    root = ET.fromstring(xml_content)
-
-    def _find_text(path: str) -> str:
-        el = root.find(path, ns)
-        return el.text if el is not None and el.text else ''
-
-    tp_nf = _find_text('.//nfe:tpNF')
-    situacao_code = _find_text('.//nfe:cSitNFe')
-
-    situacao_map = {
-        '1': 'autorizada',
-        '2': 'denegada',
-        '3': 'cancelada',
-    }
-
-    tipo = 'emitida' if tp_nf == '1' else 'recebida'
-
+    parsed = nfe_xml_parser.parse(xml_content)
     return {
-        'chave': _find_text('.//nfe:chNFe'),
-        'emitente_nome': _find_text('.//nfe:xNome'),
-        'cnpj_emitente': _find_text('.//nfe:CNPJ'),
-        'data_emissao': _find_text('.//nfe:dhEmi'),
-        'valor_total': _find_text('.//nfe:vNF'),
-        'tipo': tipo,
-        'situacao': situacao_map.get(situacao_code, 'desconhecida'),
+        'chave': parsed.chave or '',
+        'emitente_nome': parsed.emitente.nome or '',
+        'cnpj_emitente': parsed.emitente.cnpj or '',
+        'data_emissao': parsed.dh_emi or '',
+        'valor_total': parsed.v_nf or '',
+        'tipo': 'emitida' if parsed.tp_nf == '1' else 'recebida',
+        'situacao': nfe_xml_parser.SITUACAO_CSIT.get(parsed.c_sit_nfe, 'desconhecida'),
     }
 
 
@@ -177,7 +171,7 @@ async def get_certificate_info(
     cert_service = CertificateService(db, storage, crypto)
     
     # Carrega dados do certificado
-    pfx_data, password = await cert_service.get_certificate_data(certificate)
+    material = await cert_service.get_certificate_material(certificate)
     
     # Obtém código IBGE da UF da empresa (se disponível)
     uf_code_from_company = None
@@ -187,8 +181,7 @@ async def get_certificate_info(
     # Cria cliente SEFAZ apenas para extrair informações
     sefaz_client = SefazDFeClient(
         cnpj=certificate.cnpj,
-        cert_pfx_data=pfx_data,
-        cert_password=password,
+        material=material,
         producao=settings.NFE_AMBIENTE_PRODUCAO,
         uf_code=uf_code_from_company
     )
@@ -254,68 +247,121 @@ async def update_certificate(
     await db.commit()
     await db.refresh(certificate)
     
+    if certificate.status != 'active':
+        await CertificateService.invalidate_cache(certificate.cert_thumbprint)
+    
     return certificate
 
 
 # ==================== SINCRONIZAÇÃO ====================
 
-@router.post("/nfe/sync", response_model=List[SyncResponse])
+@router.post("/nfe/sync", response_model=FiscalJobResponse, status_code=http_status.HTTP_202_ACCEPTED)
 async def sync_all_companies(
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """Sincroniza NF-e de todas as empresas com certificado ativo"""
-    # Busca todas as empresas com certificado ativo
+    """
+    Enfileira a sincronização NF-e de todas as empresas com certificado ativo
+
+    Mesmo que POST /jobs/sync: retorna 202 com o job; o resultado por empresa
+    é consultado em GET /jobs/{id}.
+    """
+    return await submit_job(db, "nfe_sync", {}, user_id=current_user.id)
+
+
+@router.post("/nfe/sync/{company_id}", response_model=FiscalJobResponse, status_code=http_status.HTTP_202_ACCEPTED)
+async def sync_company(
+    company_id: int,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Enfileira a sincronização NF-e de uma empresa
+
+    Uma execução pode levar até NFE_SYNC_MAX_SECONDS_PER_RUN segundos (drenagem
+    dos lotes); em vez de segurar a requisição, retorna 202 com o job.
+    """
+    return await submit_job(db, "nfe_sync", {"company_ids": [company_id]}, user_id=current_user.id)
+
+
+@router.post("/nfe/backfill/{company_id}", response_model=FiscalJobResponse, status_code=http_status.HTTP_202_ACCEPTED)
+async def submit_backfill_job(
+    company_id: int,
+    data: Optional[BackfillRequest] = None,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Enfileira o backfill histórico em faixas de NSU paralelas (retoma faixas pendentes)"""
+    params = {"company_id": company_id}
+    if data:
+        params.update(data.model_dump(exclude_none=True))
+    try:
+        await validate_backfill_request(db, company_id, params.get("nsu_start"), params.get("nsu_end"))
+    except BackfillConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await submit_job(db, "nfe_backfill", params, user_id=current_user.id)
+
+
+@router.get("/nfe/backfill/{company_id}", response_model=List[NfeBackfillRangeResponse])
+async def list_backfill_ranges(
+    company_id: int,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Lista as faixas de NSU do backfill da empresa e o progresso de cada uma"""
     result = await db.execute(
-        select(CompanyCertificate).where(
-            CompanyCertificate.status == 'active'
-        )
+        select(NfeBackfillRange)
+        .where(NfeBackfillRange.company_id == company_id)
+        .order_by(NfeBackfillRange.nsu_start)
     )
-    certificates = result.scalars().all()
-    
-    # Inicializa serviços
-    storage = StorageService()
-    crypto = CryptoService(settings.CERT_MASTER_KEY)
-    cert_service = CertificateService(db, storage, crypto)
-    sync_service = NfeSyncService(db, cert_service, storage)
-    
-    # Sincroniza cada empresa
-    results = []
-    for cert in certificates:
-        try:
-            sync_result = await sync_service.sync_company(cert.company_id, sync_type="manual")
-            results.append(SyncResponse(**sync_result))
-        except Exception as e:
-            logger.error(f"Erro ao sincronizar empresa {cert.company_id}: {e}")
-            results.append(SyncResponse(
-                company_id=cert.company_id,
-                status='error',
-                docs_found=0,
-                docs_imported=0,
-                last_nsu='0',
-                error_message=str(e)
-            ))
-    
-    return results
+    return result.scalars().all()
 
 
-@router.post("/nfe/sync/{company_id}", response_model=SyncResponse)
-async def sync_company(
+@router.get("/nfe/failures/{company_id}", response_model=List[NfeNsuFailureResponse])
+async def list_nsu_failures(
     company_id: int,
+    status: Optional[str] = Query(None, description="pending, resolved, abandoned"),
+    limit: int = Query(100, ge=1, le=1000),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """Sincroniza NF-e de uma empresa específica"""
-    # Inicializa serviços
-    storage = StorageService()
-    crypto = CryptoService(settings.CERT_MASTER_KEY)
-    cert_service = CertificateService(db, storage, crypto)
-    sync_service = NfeSyncService(db, cert_service, storage)
-    
-    # Sincroniza
-    sync_result = await sync_service.sync_company(company_id, sync_type="manual")
-    
-    return SyncResponse(**sync_result)
+    """Lista os NSUs que falharam na ingestão e o estado do reprocessamento"""
+    query = select(NfeNsuFailure).where(NfeNsuFailure.company_id == company_id)
+    if status:
+        query = query.where(NfeNsuFailure.status == status)
+    result = await db.execute(query.order_by(NfeNsuFailure.nsu.desc()).limit(limit))
+    return result.scalars().all()
+
+
+@router.get("/nfe/sync/events")
+async def stream_sync_events(
+    company_id: Optional[int] = Query(None, description="Filtra por empresa (vazio = todas)"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Stream SSE com o progresso das sincronizações (páginas, cStat, documentos)"""
+    # A conexão fica aberta por muito tempo: devolve a conexão do banco ao pool
+    await db.close()
+
+    async def event_stream():
+        with sync_events.subscribe(company_id) as queue:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    payload = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Mantém a conexão viva através de proxies
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(payload)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @router.post("/nfe/resolve/{company_id}", response_model=ResolveResponse)
@@ -331,6 +377,8 @@ async def resolve_company_xml(
     manifest_service = ManifestacaoService(db, cert_service, storage)
 
     result = await manifest_service.resolve_company(company_id)
+    if result["attempted"] == 0 and result.get("errors"):
+        raise HTTPException(status_code=409, detail=result["errors"])
     return ResolveResponse(**result)
 
 
@@ -348,6 +396,8 @@ async def resolve_single_xml(
     manifest_service = ManifestacaoService(db, cert_service, storage)
 
     result = await manifest_service.resolve_document(company_id, chave)
+    if result.get("status") == "running":
+        raise HTTPException(status_code=409, detail="Manifestação já em andamento para esta empresa")
     attempted = 1
     resolved = 1 if result.get("status") == "full" else 0
     still_summary = attempted - resolved
@@ -566,6 +616,87 @@ async def import_by_key(
     return result
 
 
+# ==================== JOBS ====================
+
+@router.post("/jobs/sync", response_model=FiscalJobResponse, status_code=http_status.HTTP_202_ACCEPTED)
+async def submit_sync_job(
+    data: Optional[SyncRequest] = None,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Enfileira a sincronização NF-e (uma empresa ou todas com certificado ativo)"""
+    params = {}
+    if data and data.company_id:
+        params["company_ids"] = [data.company_id]
+    return await submit_job(db, "nfe_sync", params, user_id=current_user.id)
+
+
+@router.post("/jobs/resolve/{company_id}", response_model=FiscalJobResponse, status_code=http_status.HTTP_202_ACCEPTED)
+async def submit_resolve_job(
+    company_id: int,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Enfileira a manifestação e download de XML completo das NF-e resumidas"""
+    return await submit_job(db, "nfe_resolve", {"company_id": company_id}, user_id=current_user.id)
+
+
+@router.post("/jobs/import-by-key", response_model=FiscalJobResponse, status_code=http_status.HTTP_202_ACCEPTED)
+async def submit_import_by_key_job(
+    data: ImportByKeyRequest,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Enfileira a importação de uma NF-e pela chave de acesso"""
+    return await submit_job(
+        db, "nfe_import_by_key",
+        {"company_id": data.company_id, "chave": data.chave},
+        user_id=current_user.id
+    )
+
+
+@router.get("/jobs", response_model=List[FiscalJobResponse])
+async def list_jobs(
+    kind: Optional[str] = Query(None),
+    status: Optional[str] = Query(None),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Lista jobs fiscais recentes"""
+    await fail_stale_jobs(db)
+
+    query = select(FiscalJob)
+    conditions = []
+    if kind:
+        conditions.append(FiscalJob.kind == kind)
+    if status:
+        conditions.append(FiscalJob.status == status)
+    if conditions:
+        query = query.where(and_(*conditions))
+
+    query = query.order_by(FiscalJob.created_at.desc()).offset(skip).limit(limit)
+    result = await db.execute(query)
+    return result.scalars().all()
+
+
+@router.get("/jobs/{job_id}", response_model=FiscalJobResponse)
+async def get_job(
+    job_id: UUID,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Consulta status e progresso por empresa de um job fiscal"""
+    await fail_stale_jobs(db)
+
+    result = await db.execute(select(FiscalJob).where(FiscalJob.id == job_id))
+    job = result.scalar_one_or_none()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job
+
+
 # ==================== LOGS ====================
 
 @router.get("/nfe/logs", response_model=List[NfeSyncLogResponse])
@@ -599,3 +730,54 @@ async def list_sync_logs(
     logs = result.scalars().all()
     
     return logs
+
+
+@router.get("/nfe/logs/stage-stats", response_model=List[SyncStageStatsResponse])
+async def sync_stage_stats(
+    company_id: Optional[int] = Query(None),
+    days: int = Query(7, ge=1, le=180),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Percentis p50/p95 do tempo gasto em cada estágio da sincronização, por empresa"""
+    query = select(NfeSyncLog.company_id, NfeSyncLog.stage_timings).where(
+        NfeSyncLog.stage_timings.isnot(None),
+        NfeSyncLog.started_at >= datetime.utcnow() - timedelta(days=days)
+    )
+    if company_id:
+        query = query.where(NfeSyncLog.company_id == company_id)
+    
+    result = await db.execute(query)
+    
+    # {company_id: {stage: [segundos por execução]}}
+    samples: dict = {}
+    runs: dict = {}
+    for log_company_id, timings in result:
+        runs[log_company_id] = runs.get(log_company_id, 0) + 1
+        company_samples = samples.setdefault(log_company_id, {})
+        for stage, values in (timings.get("stages") or {}).items():
+            company_samples.setdefault(stage, []).append(values.get("seconds") or 0.0)
+    
+    return [
+        SyncStageStatsResponse(
+            company_id=log_company_id,
+            runs=runs[log_company_id],
+            stages={
+                stage: StageStats(
+                    p50=percentile(values, 50),
+                    p95=percentile(values, 95),
+                    runs=len(values)
+                )
+                for stage, values in company_samples.items()
+            }
+        )
+        for log_company_id, company_samples in sorted(samples.items())
+    ]
+
+
+@router.get("/sefaz/endpoints", response_model=List[SefazEndpointHealthResponse])
+async def sefaz_endpoint_health(
+    current_user: User = Depends(get_current_user)
+):
+    """Latência, taxa de erro e estado do circuito de cada endpoint SEFAZ (deste processo)"""
+    return sefaz_endpoints.snapshot()
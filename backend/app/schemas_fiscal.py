@@ -3,7 +3,7 @@ Schemas Pydantic para o módulo fiscal (certificados e NF-e)
 """
 from pydantic import BaseModel, Field, validator
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, Optional
 from uuid import UUID
 
 
@@ -104,6 +104,7 @@ class SefazDfeStateResponse(BaseModel):
     last_sync_at: Optional[datetime]
     last_status: str
     last_error: Optional[str]
+    next_sync_at: Optional[datetime] = None
     
     class Config:
         from_attributes = True
@@ -124,6 +125,48 @@ class SyncResponse(BaseModel):
     error_message: Optional[str] = None
 
 
+class BackfillRequest(BaseModel):
+    """Schema para backfill histórico por faixas de NSU"""
+    nsu_start: Optional[int] = Field(None, ge=1, description="Primeiro NSU (padrão: após o cursor atual)")
+    nsu_end: Optional[int] = Field(None, ge=1, description="Último NSU (padrão: maxNSU da SEFAZ)")
+
+
+class NfeBackfillRangeResponse(BaseModel):
+    """Schema de resposta de faixa do backfill"""
+    id: UUID
+    company_id: int
+    nsu_start: int
+    nsu_end: int
+    next_nsu: int
+    status: str
+    docs_found: int
+    docs_imported: int
+    last_error: Optional[str]
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class NfeNsuFailureResponse(BaseModel):
+    """Schema de resposta de NSU com falha de ingestão"""
+    id: UUID
+    company_id: int
+    nsu: int
+    chave: Optional[str]
+    doc_schema: Optional[str]
+    stage: str
+    status: str
+    attempts: int
+    last_error: Optional[str]
+    next_attempt_at: datetime
+    resolved_at: Optional[datetime]
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
 # ==================== SYNC LOGS ====================
 
 class NfeSyncLogResponse(BaseModel):
@@ -136,12 +179,41 @@ class NfeSyncLogResponse(BaseModel):
     status: str
     docs_found: int
     docs_imported: int
+    docs_upgraded: int = 0
+    docs_skipped: int = 0
     error_message: Optional[str]
+    stage_timings: Optional[Dict[str, Any]] = None
     
     class Config:
         from_attributes = True
 
 
+class StageStats(BaseModel):
+    """Percentis de tempo (segundos por execução) de um estágio"""
+    p50: float
+    p95: float
+    runs: int
+
+
+class SyncStageStatsResponse(BaseModel):
+    """Schema de resposta dos percentis por estágio de uma empresa"""
+    company_id: int
+    runs: int
+    stages: Dict[str, StageStats]
+
+
+class SefazEndpointHealthResponse(BaseModel):
+    """Schema de resposta da saúde de um endpoint SEFAZ (por processo)"""
+    url: str
+    state: str  # closed, open, half_open
+    latency_ms: Optional[int] = None
+    error_rate: float
+    consecutive_failures: int
+    requests: int
+    failures: int
+    last_error: Optional[str] = None
+
+
 class NfeSyncLogFilter(BaseModel):
     """Schema para filtros de logs de sincronização"""
     company_id: Optional[int] = None
@@ -176,3 +248,24 @@ class ResolveResponse(BaseModel):
     resolved: int
     still_summary: int
     errors: Optional[str] = None
+
+
+# ==================== JOBS ====================
+
+class FiscalJobResponse(BaseModel):
+    """Schema de resposta de job fiscal em segundo plano"""
+    id: UUID
+    kind: str
+    status: str
+    params: Optional[Dict[str, Any]]
+    progress: Optional[Dict[str, Any]]
+    result: Optional[Dict[str, Any]]
+    docs_found: int
+    docs_imported: int
+    error_message: Optional[str]
+    created_at: datetime
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
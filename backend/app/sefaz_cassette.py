@@ -0,0 +1,216 @@
+"""
+Gravação e reprodução (cassete) do tráfego SOAP com a SEFAZ
+
+record: cada requisição/resposta dos clientes DF-e e de eventos é anexada a um
+arquivo .jsonl.gz (uma interação por linha), com o status HTTP e o tempo de
+resposta original. Falhas de rede/timeout também são gravadas. O CNPJ do
+certificado (tag CNPJ da requisição) é trocado por CNPJ_PLACEHOLDER na
+requisição, na resposta e dentro de cada docZip.
+
+replay: nenhuma conexão é aberta. Cada requisição é associada a uma interação
+gravada pelo tipo de consulta e valor (ultNSU, NSU, chNFe) ou, nos eventos,
+pelo tpEvento e chaves do lote; requisições repetidas consomem as gravações
+na ordem, e a última se repete. A resposta volta com o tempo original
+(multiplicado por SEFAZ_CASSETTE_TIMING) e com o CNPJ da requisição atual no
+lugar do placeholder.
+
+Ativado por SEFAZ_CASSETTE_MODE e SEFAZ_CASSETTE_PATH (sefaz_http.get_client).
+"""
+from collections import deque
+from datetime import datetime
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Deque, Dict, Optional
+
+import httpx
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+# CNPJ fictício com dígitos verificadores válidos; zeros colidiriam com NSUs (15 dígitos)
+CNPJ_PLACEHOLDER = b"11222333000181"
+
+_CNPJ_RE = re.compile(rb"<CNPJ>(\d{14})</CNPJ>")
+_DOCZIP_RE = re.compile(rb"(<(?:\w+:)?docZip\b[^>]*>)([^<]+)(</(?:\w+:)?docZip>)")
+_CONSULTA_RE = re.compile(rb"<(distNSU|consNSU|consChNFe)><(?:ultNSU|NSU|chNFe)>([^<]*)<")
+_TP_EVENTO_RE = re.compile(rb"<tpEvento>(\d+)</tpEvento>")
+_CHAVE_RE = re.compile(rb"<chNFe>(\d{44})</chNFe>")
+
+
+class CassetteMiss(RuntimeError):
+    """Requisição sem interação correspondente no cassete (replay)"""
+
+
+def requester_cnpj(body: bytes) -> Optional[bytes]:
+    match = _CNPJ_RE.search(body)
+    return match.group(1) if match else None
+
+
+def replace_cnpj(body: bytes, old: bytes, new: bytes) -> bytes:
+    """Troca o CNPJ no XML e dentro dos docZip (base64 + gzip)"""
+    def replace_doc(match: "re.Match[bytes]") -> bytes:
+        try:
+            xml_data = gzip.decompress(base64.b64decode(match.group(2)))
+        except Exception:
+            return match.group(0)
+        if old not in xml_data:
+            return match.group(0)
+        encoded = base64.b64encode(gzip.compress(xml_data.replace(old, new), mtime=0))
+        return match.group(1) + encoded + match.group(3)
+
+    return _DOCZIP_RE.sub(replace_doc, body).replace(old, new)
+
+
+def request_key(path: str, body: bytes) -> str:
+    """Identifica a requisição sem os campos que mudam a cada envio (dhEvento, assinatura)"""
+    consulta = _CONSULTA_RE.search(body)
+    if consulta:
+        return f"{path} {consulta.group(1).decode()} {consulta.group(2).decode()}"
+    tipos = _TP_EVENTO_RE.findall(body)
+    if tipos:
+        chaves = b",".join(sorted(_CHAVE_RE.findall(body))).decode()
+        return f"{path} evento {tipos[0].decode()} {chaves}"
+    return f"{path} {hashlib.sha256(body).hexdigest()}"
+
+
+class Cassette:
+    """Arquivo .jsonl.gz de interações"""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._queues: Optional[Dict[str, Deque[Dict[str, Any]]]] = None
+
+    def append(self, interaction: Dict[str, Any]) -> None:
+        # Cada append vira um membro gzip; gzip.open lê o arquivo inteiro em sequência
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(json.dumps(interaction, ensure_ascii=False) + "\n")
+
+    def next(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if self._queues is None:
+                self._queues = self._load()
+            queue = self._queues.get(key)
+            if not queue:
+                return None
+            return queue.popleft() if len(queue) > 1 else queue[0]
+
+    def _load(self) -> Dict[str, Deque[Dict[str, Any]]]:
+        queues: Dict[str, Deque[Dict[str, Any]]] = {}
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    interaction = json.loads(line)
+                    queues.setdefault(interaction["key"], deque()).append(interaction)
+        logger.info(f"Cassete SEFAZ {self.path}: {sum(len(q) for q in queues.values())} interações")
+        return queues
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """Repassa ao transporte real e grava a interação (CNPJ mascarado)"""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, cassette: Cassette):
+        self.inner = inner
+        self.cassette = cassette
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        cnpj = requester_cnpj(body)
+
+        def redact(data: bytes) -> bytes:
+            return replace_cnpj(data, cnpj, CNPJ_PLACEHOLDER) if cnpj else data
+
+        redacted_body = redact(body)
+        interaction: Dict[str, Any] = {
+            "key": request_key(request.url.path, redacted_body),
+            "method": request.method,
+            "path": request.url.path,
+            "request_body": redacted_body.decode("utf-8"),
+            "recorded_at": datetime.utcnow().isoformat(),
+        }
+        started = time.perf_counter()
+        try:
+            response = await self.inner.handle_async_request(request)
+            content = await response.aread()
+        except httpx.TransportError as e:
+            interaction.update(elapsed=time.perf_counter() - started, error=type(e).__name__, error_message=str(e))
+            await asyncio.to_thread(self.cassette.append, interaction)
+            raise
+        interaction.update(
+            elapsed=time.perf_counter() - started,
+            status_code=response.status_code,
+            content_type=response.headers.get("content-type"),
+            response_body=redact(content).decode("utf-8", errors="replace"),
+        )
+        await asyncio.to_thread(self.cassette.append, interaction)
+
+        # aread() já descomprimiu o corpo: devolve sem content-encoding/length
+        headers = {"content-type": interaction["content_type"]} if interaction["content_type"] else {}
+        return httpx.Response(response.status_code, headers=headers, content=content, request=request)
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """Serve as interações gravadas, com o tempo de resposta original"""
+
+    def __init__(self, cassette: Cassette, timing: float = 1.0):
+        self.cassette = cassette
+        self.timing = timing
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        cnpj = requester_cnpj(body)
+        redacted_body = replace_cnpj(body, cnpj, CNPJ_PLACEHOLDER) if cnpj else body
+        key = request_key(request.url.path, redacted_body)
+        interaction = self.cassette.next(key)
+        if interaction is None:
+            raise CassetteMiss(f"Sem interação gravada para {key}")
+
+        if self.timing > 0:
+            await asyncio.sleep(interaction["elapsed"] * self.timing)
+
+        if interaction.get("error"):
+            error_class = getattr(httpx, interaction["error"], httpx.TransportError)
+            if not (isinstance(error_class, type) and issubclass(error_class, httpx.TransportError)):
+                error_class = httpx.TransportError
+            raise error_class(interaction.get("error_message") or interaction["error"], request=request)
+
+        content = interaction["response_body"].encode("utf-8")
+        if cnpj:
+            content = replace_cnpj(content, CNPJ_PLACEHOLDER, cnpj)
+        headers = {"content-type": interaction["content_type"]} if interaction.get("content_type") else {}
+        return httpx.Response(interaction["status_code"], headers=headers, content=content, request=request)
+
+
+_cassettes: Dict[str, Cassette] = {}
+
+
+def mode() -> Optional[str]:
+    """record, replay ou None"""
+    value = (settings.SEFAZ_CASSETTE_MODE or "").strip().lower() or None
+    if value not in (None, "record", "replay"):
+        raise ValueError(f"SEFAZ_CASSETTE_MODE inválido: {settings.SEFAZ_CASSETTE_MODE}")
+    return value
+
+
+def get_cassette() -> Cassette:
+    path = settings.SEFAZ_CASSETTE_PATH
+    cassette = _cassettes.get(path)
+    if cassette is None:
+        cassette = Cassette(path)
+        _cassettes[path] = cassette
+    return cassette
@@ -5,21 +5,27 @@ usando SOAP manual (sem dependência de WSDL) com certificado A1
 """
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional, List, Dict, Any, Tuple
+from typing import Optional, List, Dict, Any, Iterator, Tuple, Union
+import asyncio
 import base64
 import gzip
+import io
 import logging
 import xml.etree.ElementTree as ET
-from cryptography.hazmat.primitives.serialization import pkcs12, Encoding, PrivateFormat, NoEncryption
+from cryptography.hazmat.primitives.serialization import pkcs12
 from cryptography.hazmat.backends import default_backend
 from cryptography import x509
-import httpx
-import certifi
-import ssl
-import tempfile
-import os
 from pathlib import Path
 
+from app.sefaz_rate_limiter import consulta_chave_limiter
+from app.sefaz_http import get_client
+from app import sefaz_endpoints
+from app import nfe_xml_parser
+from app.sefaz_endpoints import SefazHttpError
+from app.certificate_cache import CertificateMaterial
+from app.sync_metrics import StageTimer, timed
+from app.config import settings
+
 logger = logging.getLogger(__name__)
 
 
@@ -33,6 +39,14 @@ class DFeDocument:
     xml_content: str  # XML base64 decodificado
 
 
+@dataclass
+class DFeDecodeFailure:
+    """docZip que veio na resposta mas não pôde ser decodificado"""
+    nsu: str
+    schema: str
+    error: str
+
+
 class SefazDFeClient:
     """Cliente para comunicação com SEFAZ via NFeDistribuicaoDFe"""
     
@@ -67,10 +81,12 @@ class SefazDFeClient:
     def __init__(
         self,
         cnpj: str,
-        cert_pfx_data: bytes,
-        cert_password: str,
+        cert_pfx_data: Optional[bytes] = None,
+        cert_password: Optional[str] = None,
         producao: bool = True,
-        uf_code: str = None
+        uf_code: str = None,
+        timer: Optional[StageTimer] = None,
+        material: Optional[CertificateMaterial] = None
     ):
         """
         Inicializa o cliente SEFAZ
@@ -81,14 +97,22 @@ class SefazDFeClient:
             cert_password: Senha do certificado
             producao: True para produção, False para homologação
             uf_code: Código IBGE da UF (ex: "52" para GO). Se None, detecta do certificado ou usa 91
+            timer: Acumula os estágios soap/decode de consultar_distribuicao
+            material: Chave e certificado já carregados (dispensa o .pfx)
         """
+        self.timer = timer
         self.cnpj = cnpj.replace(".", "").replace("/", "").replace("-", "")  # Apenas números
         self.producao = producao
         self.uf_code = uf_code or "91"  # 91 = Ambiente Nacional (padrão inicial)
         self.endpoints = self.ENDPOINTS_PRODUCAO if producao else self.ENDPOINTS_HOMOLOGACAO
+        if settings.SEFAZ_DIST_DFE_URL:
+            self.endpoints = [settings.SEFAZ_DIST_DFE_URL]
         
         # Carrega o certificado (pode atualizar self.uf_code)
-        self._load_certificate(cert_pfx_data, cert_password)
+        if material is not None:
+            self._use_certificate(material.private_key, material.certificate)
+        else:
+            self._load_certificate(cert_pfx_data, cert_password)
         
         logger.info(
             f"✅ Cliente SEFAZ inicializado - CNPJ: {self.cnpj}, "
@@ -98,12 +122,22 @@ class SefazDFeClient:
     def _load_certificate(self, cert_pfx_data: bytes, password: str):
         """Carrega o certificado e chave privada do PFX"""
         try:
-            self.private_key, self.certificate, additional_certs = pkcs12.load_key_and_certificates(
+            private_key, certificate, additional_certs = pkcs12.load_key_and_certificates(
                 cert_pfx_data,
                 password.encode('utf-8'),
                 backend=default_backend()
             )
-            
+        except Exception as e:
+            logger.error(f"❌ Erro ao carregar certificado: {e}")
+            raise ValueError(f"Certificado inválido: {e}")
+        
+        self._use_certificate(private_key, certificate)
+    
+    def _use_certificate(self, private_key, certificate: x509.Certificate):
+        """Adota chave e certificado e detecta a UF pelo subject"""
+        self.private_key = private_key
+        self.certificate = certificate
+        try:
             # Extrai informações do certificado para log
             subject = self.certificate.subject
             
@@ -126,31 +160,6 @@ class SefazDFeClient:
             logger.error(f"❌ Erro ao carregar certificado: {e}")
             raise ValueError(f"Certificado inválido: {e}")
     
-    def _get_ssl_context(self) -> Tuple[str, str]:
-        """
-        Cria arquivos temporários PEM do certificado e chave
-        
-        Returns:
-            Tupla (cert_file_path, key_file_path)
-        """
-        # Cria arquivo temporário para o certificado
-        cert_pem = self.certificate.public_bytes(Encoding.PEM)
-        cert_fd, cert_path = tempfile.mkstemp(suffix='.pem', prefix='sefaz_cert_')
-        os.write(cert_fd, cert_pem)
-        os.close(cert_fd)
-        
-        # Cria arquivo temporário para a chave privada
-        key_pem = self.private_key.private_bytes(
-            encoding=Encoding.PEM,
-            format=PrivateFormat.TraditionalOpenSSL,
-            encryption_algorithm=NoEncryption()
-        )
-        key_fd, key_path = tempfile.mkstemp(suffix='.pem', prefix='sefaz_key_')
-        os.write(key_fd, key_pem)
-        os.close(key_fd)
-        
-        return cert_path, key_path
-
     def _build_soap_envelope(self, dist_dfe_xml: str) -> str:
         """
         Constrói o envelope SOAP 1.1 (sem CDATA - enviando XML direto)
@@ -229,63 +238,53 @@ class SefazDFeClient:
         Returns:
             Resposta XML da SEFAZ
         """
-        cert_path = None
-        key_path = None
+        # Headers SOAP 1.1 (SOAPAction separado)
+        headers = {
+            "Content-Type": "text/xml; charset=utf-8",
+            "SOAPAction": f'"{self.SOAP_ACTION}"',
+            "User-Agent": "Mozilla/5.0 (compatible; SEFAZ-Client/1.0)",
+        }
         
-        try:
-            # Cria arquivos temporários PEM
-            cert_path, key_path = self._get_ssl_context()
-            
-            # Headers SOAP 1.1 (SOAPAction separado)
-            headers = {
-                "Content-Type": "text/xml; charset=utf-8",
-                "SOAPAction": f'"{self.SOAP_ACTION}"',
-                "User-Agent": "Mozilla/5.0 (compatible; SEFAZ-Client/1.0)",
-            }
-            
-            logger.info(f"📤 Enviando requisição SOAP para: {endpoint_url}")
-            print(f"🌐 ENDPOINT: {endpoint_url}")
-            print(f"🔧 Ambiente: {'PRODUÇÃO' if self.producao else 'HOMOLOGAÇÃO'}")
-            logger.debug(f"Headers: {headers}")
-            logger.debug(f"SOAP Envelope: {soap_envelope[:800]}...")
-            
-            # Envia requisição com certificado mTLS
-            async with httpx.AsyncClient(
-                cert=(cert_path, key_path),
-                verify=certifi.where(),  # Usa certificados confiáveis do certifi
-                timeout=timeout,
-                follow_redirects=True,
-            ) as client:
-                response = await client.post(
-                    endpoint_url,
-                    content=soap_envelope.encode('utf-8'),
-                    headers=headers,
-                )
-                
-                logger.info(f"📥 Status HTTP: {response.status_code}")
-                print(f"\n📥 RESPOSTA SEFAZ (HTTP {response.status_code}):")
-                print(f"{response.text[:1500]}\n")
-                logger.debug(f"Response headers: {dict(response.headers)}")
-                
-                # Só trata como erro HTTP se não for 200
-                if response.status_code != 200:
-                    logger.error(
-                        f"❌ Erro HTTP {response.status_code} da SEFAZ\n"
-                        f"URL: {endpoint_url}\n"
-                        f"Corpo: {response.text[:1000]}"
-                    )
-                    raise Exception(f"HTTP {response.status_code}: {response.text[:500]}")
-                
-                # HTTP 200 - retorna resposta para parse do cStat
-                logger.info(f"✅ HTTP 200 recebido, parseando resposta SOAP...")
-                return response.text
-                
-        finally:
-            # Remove arquivos temporários
-            if cert_path and os.path.exists(cert_path):
-                os.unlink(cert_path)
-            if key_path and os.path.exists(key_path):
-                os.unlink(key_path)
+        logger.info(f"📤 Enviando requisição SOAP para: {endpoint_url}")
+        print(f"🌐 ENDPOINT: {endpoint_url}")
+        print(f"🔧 Ambiente: {'PRODUÇÃO' if self.producao else 'HOMOLOGAÇÃO'}")
+        logger.debug(f"Headers: {headers}")
+        logger.debug(f"SOAP Envelope: {soap_envelope[:800]}...")
+        
+        # Envia pelo pool mTLS do certificado (conexões keep-alive reaproveitadas)
+        client = get_client(self.certificate, self.private_key, verify=True)
+        response = await client.post(
+            endpoint_url,
+            content=soap_envelope.encode('utf-8'),
+            headers=headers,
+            timeout=timeout,
+        )
+        
+        logger.info(f"📥 Status HTTP: {response.status_code}")
+        print(f"\n📥 RESPOSTA SEFAZ (HTTP {response.status_code}):")
+        print(f"{response.text[:1500]}\n")
+        logger.debug(f"Response headers: {dict(response.headers)}")
+        
+        # Só trata como erro HTTP se não for 200
+        if response.status_code != 200:
+            logger.error(
+                f"❌ Erro HTTP {response.status_code} da SEFAZ\n"
+                f"URL: {endpoint_url}\n"
+                f"Corpo: {response.text[:1000]}"
+            )
+            raise SefazHttpError(response.status_code, response.text)
+        
+        # HTTP 200 - retorna resposta para parse do cStat
+        logger.info(f"✅ HTTP 200 recebido, parseando resposta SOAP...")
+        return response.text
+    
+    def _send_with_timeout(self, soap_envelope: str):
+        """send(url) para sefaz_endpoints.call, com o timeout por tentativa configurado"""
+        async def send(endpoint_url: str) -> str:
+            return await self._send_soap_request(
+                soap_envelope, endpoint_url, timeout=settings.SEFAZ_REQUEST_TIMEOUT_SECONDS
+            )
+        return send
     
     async def consultar_distribuicao(
         self,
@@ -329,24 +328,14 @@ class SefazDFeClient:
         logger.info(f"📝 distDFeInt XML:\n{dist_dfe_xml}")
         logger.info(f"📝 SOAP Envelope (500 chars):\n{soap_envelope[:500]}...")
         
-        # Tenta endpoints com fallback
-        last_error = None
-        for i, endpoint in enumerate(self.endpoints, 1):
-            try:
-                logger.info(f"Tentativa {i}/{len(self.endpoints)}: {endpoint}")
-                response_xml = await self._send_soap_request(soap_envelope, endpoint)
-                return self._parse_response(response_xml)
-                
-            except Exception as e:
-                last_error = e
-                logger.warning(f"⚠️ Falha no endpoint {endpoint}: {e}")
-                if i < len(self.endpoints):
-                    logger.info(f"Tentando próximo endpoint...")
-                continue
-        
-        # Se chegou aqui, todos os endpoints falharam
-        logger.error(f"❌ Todos os endpoints falharam. Último erro: {last_error}")
-        raise last_error
+        try:
+            with timed(self.timer, "soap"):
+                response_xml = await sefaz_endpoints.call(self.endpoints, self._send_with_timeout(soap_envelope))
+        except Exception as e:
+            logger.error(f"❌ Falha na consulta de distribuição: {e}")
+            raise
+        with timed(self.timer, "decode"):
+            return await self._decode_response(response_xml)
     
     async def consultar_por_chave(self, chave: str) -> Dict[str, Any]:
         """
@@ -365,20 +354,43 @@ class SefazDFeClient:
         
         soap_envelope = self._build_soap_envelope(dist_dfe_xml)
         
+        # Respeita o ritmo de consultas por chave do certificado
+        await consulta_chave_limiter(self.cnpj).acquire()
+        
         logger.info(f"🔍 Consultando NF-e por chave: {chave}")
         
-        # Tenta endpoints com fallback
-        last_error = None
-        for endpoint in self.endpoints:
-            try:
-                response_xml = await self._send_soap_request(soap_envelope, endpoint)
-                return self._parse_response(response_xml)
-            except Exception as e:
-                last_error = e
-                logger.warning(f"⚠️ Falha no endpoint {endpoint}: {e}")
-                continue
-        
-        raise last_error
+        response_xml = await sefaz_endpoints.call(self.endpoints, self._send_with_timeout(soap_envelope))
+        return await self._decode_response(response_xml)
+    
+    async def consultar_nsu(self, nsu: str) -> Dict[str, Any]:
+        """
+        Consulta um único documento pelo NSU (consNSU)
+        
+        Usado para reprocessar NSUs que falharam na ingestão, sem repetir a
+        página inteira do distNSU.
+        
+        Args:
+            nsu: NSU do documento
+            
+        Returns:
+            Dict com status e documentos (no máximo um)
+        """
+        dist_dfe_xml = self._build_dist_dfe_xml(
+            tipo_consulta="NSU",
+            valor=nsu
+        )
+        soap_envelope = self._build_soap_envelope(dist_dfe_xml)
+        
+        # Consulta unitária: mesmo ritmo das consultas por chave
+        await consulta_chave_limiter(self.cnpj).acquire()
+        
+        logger.info(f"🔍 Consultando DF-e por NSU: {nsu}")
+        response_xml = await sefaz_endpoints.call(self.endpoints, self._send_with_timeout(soap_envelope))
+        return await self._decode_response(response_xml)
+    
+    async def _decode_response(self, response_xml: str) -> Dict[str, Any]:
+        """_parse_response numa thread: base64/gzip de 50 docZip não bloqueiam o event loop"""
+        return await asyncio.to_thread(self._parse_response, response_xml)
     
     def _parse_response(self, response_xml: str) -> Dict[str, Any]:
         """
@@ -390,188 +402,156 @@ class SefazDFeClient:
                 'motivo': str,
                 'max_nsu': str,
                 'ult_nsu': str,
-                'documentos': List[DFeDocument]
+                'documentos': List[DFeDocument],
+                'falhas': List[DFeDecodeFailure]
             }
         """
         try:
             logger.debug(f"Parsing response (500 chars): {response_xml[:500]}")
             
-            # Namespaces usados na resposta SEFAZ
-            NS = {
-                "soap": "http://schemas.xmlsoap.org/soap/envelope/",
-                "soap12": "http://www.w3.org/2003/05/soap-envelope",
-                "wsdl": "http://www.portalfiscal.inf.br/nfe/wsdl/NFeDistribuicaoDFe",
-                "nfe": "http://www.portalfiscal.inf.br/nfe",
-            }
-            
-            # Parse do XML
-            root = ET.fromstring(response_xml)
-            
-            # Busca retDistDFeInt com namespace nfe
-            ret = root.find(".//nfe:retDistDFeInt", NS)
-            
-            # Fallback: buscar sem namespace (iteração)
-            if ret is None:
-                for elem in root.iter():
-                    if elem.tag.endswith('retDistDFeInt'):
-                        ret = elem
-                        break
-            
-            if ret is None:
-                logger.error(f"❌ Não encontrou retDistDFeInt no XML:\n{response_xml[:1000]}")
-                return {
-                    'status': 0,
-                    'motivo': 'Resposta inválida: retDistDFeInt não encontrado',
-                    'max_nsu': '0',
-                    'ult_nsu': '0',
-                    'documentos': []
-                }
-            
-            # Extrai campos usando findtext com namespace nfe
-            # Primeiro tenta com namespace, depois sem
-            def get_text(elem, tag, default=""):
-                # Tenta com namespace nfe
-                val = elem.findtext(f"nfe:{tag}", namespaces=NS)
-                if val is not None:
-                    return val
-                # Tenta sem namespace (busca direta)
-                child = elem.find(f".//{{{NS['nfe']}}}{tag}")
-                if child is not None and child.text:
-                    return child.text
-                # Busca por iteração
-                for e in elem.iter():
-                    if e.tag.endswith(tag) and e.text:
-                        return e.text
-                return default
-            
-            status_text = get_text(ret, "cStat", "0")
-            status = int(status_text) if status_text.isdigit() else 0
-            motivo = get_text(ret, "xMotivo", "Sem motivo")
-            max_nsu = get_text(ret, "maxNSU", "0")
-            ult_nsu = get_text(ret, "ultNSU", "0")
-            
-            # Log do resultado
-            logger.info(f"📨 SEFAZ Response - cStat: {status}, xMotivo: {motivo}")
-            logger.info(f"📊 NSUs - ultNSU: {ult_nsu}, maxNSU: {max_nsu}")
-            
-            if status == 137:
-                logger.info(f"✅ cStat 137: Nenhum documento novo localizado")
-            elif status == 138:
-                logger.info(f"✅ cStat 138: Documento(s) localizado(s)")
-            elif status == 243:
-                print(f"\n{'='*80}")
-                print(f"❌ ERRO cStat 243 - XML mal formado")
-                print(f"Verificar o XML enviado acima")
-                print(f"{'='*80}\n")
-                logger.error(f"❌ cStat 243: XML mal formado - verificar estrutura do request")
-            elif status not in [137, 138]:
-                logger.warning(f"⚠️ cStat {status}: {motivo}")
-            
-            # Extrai documentos (busca em loteDistDFeInt ou diretamente)
-            documentos = []
-            
-            # Tenta encontrar docZip em diferentes caminhos
-            doc_zips = []
-            for elem in ret.iter():
-                if elem.tag.endswith('docZip'):
-                    doc_zips.append(elem)
-            
-            for doc_zip in doc_zips:
-                nsu = doc_zip.get('NSU', '')
-                schema = doc_zip.get('schema', '')
-                
-                # Decodifica o conteúdo base64 e descompacta GZIP
-                xml_b64 = doc_zip.text
-                if xml_b64:
-                    try:
-                        # Remove whitespace e decodifica Base64
-                        xml_b64_clean = xml_b64.strip()
-                        compressed_data = base64.b64decode(xml_b64_clean)
-                        
-                        # Descompacta GZIP
-                        xml_content = gzip.decompress(compressed_data).decode('utf-8')
-                        
-                        # Extrai a chave do XML
-                        chave = self._extract_chave_from_xml(xml_content)
-                        
-                        tipo_documento = self._identify_document_type(schema, xml_content)
-                        
-                        documentos.append(DFeDocument(
-                            nsu=nsu,
-                            schema=schema,
-                            chave=chave,
-                            tipo_documento=tipo_documento,
-                            xml_content=xml_content
-                        ))
-                        
-                        print(f"\n✅ Documento descompactado!")
-                        print(f"   NSU: {nsu}")
-                        print(f"   Schema: {schema}")  
-                        print(f"   Tipo: {tipo_documento}")
-                        print(f"   Chave: {chave}")
-                        print(f"   XML (primeiros 300 chars): {xml_content[:300]}\n")
-                        
-                    except Exception as e:
-                        print(f"\n❌ ERRO ao decodificar NSU {nsu}: {e}\n")
-                        logger.error(f"❌ Erro ao decodificar documento NSU {nsu}: {e}")
-                        import traceback
-                        traceback.print_exc()
-                        continue
-            
-            logger.info(
-                f"✅ Resposta SEFAZ - Status: {status} ({motivo}), "
-                f"Docs: {len(documentos)}, maxNSU: {max_nsu}, ultNSU: {ult_nsu}"
-            )
-            
-            return {
-                'status': status,
-                'motivo': motivo,
-                'max_nsu': max_nsu,
-                'ult_nsu': ult_nsu,
-                'documentos': documentos
-            }
-            
+            fields: Dict[str, str] = {}
+            documentos: List[DFeDocument] = []
+            falhas: List[DFeDecodeFailure] = []
+            for item in iter_dist_response(response_xml):
+                if isinstance(item, DFeDecodeFailure):
+                    falhas.append(item)
+                elif isinstance(item, DFeDocument):
+                    documentos.append(item)
+                    logger.debug(
+                        f"Documento descompactado - NSU: {item.nsu}, Schema: {item.schema}, "
+                        f"Tipo: {item.tipo_documento}, Chave: {item.chave}"
+                    )
+                else:
+                    fields[item[0]] = item[1]
         except Exception as e:
             logger.error(f"❌ Erro ao fazer parse da resposta: {e}")
             logger.debug(f"XML completo: {response_xml}")
             raise
+        
+        if not fields:
+            logger.error(f"❌ Não encontrou retDistDFeInt no XML:\n{response_xml[:1000]}")
+            return {
+                'status': 0,
+                'motivo': 'Resposta inválida: retDistDFeInt não encontrado',
+                'max_nsu': '0',
+                'ult_nsu': '0',
+                'documentos': [],
+                'falhas': []
+            }
+        
+        status_text = fields.get("cStat", "0")
+        status = int(status_text) if status_text.isdigit() else 0
+        motivo = fields.get("xMotivo") or "Sem motivo"
+        max_nsu = fields.get("maxNSU") or "0"
+        ult_nsu = fields.get("ultNSU") or "0"
+        
+        # Log do resultado
+        logger.info(f"📨 SEFAZ Response - cStat: {status}, xMotivo: {motivo}")
+        logger.info(f"📊 NSUs - ultNSU: {ult_nsu}, maxNSU: {max_nsu}")
+        
+        if status == 137:
+            logger.info(f"✅ cStat 137: Nenhum documento novo localizado")
+        elif status == 138:
+            logger.info(f"✅ cStat 138: Documento(s) localizado(s)")
+        elif status == 243:
+            logger.error(f"❌ cStat 243: XML mal formado - verificar estrutura do request")
+        elif status not in [137, 138]:
+            logger.warning(f"⚠️ cStat {status}: {motivo}")
+        
+        logger.info(
+            f"✅ Resposta SEFAZ - Status: {status} ({motivo}), "
+            f"Docs: {len(documentos)}, maxNSU: {max_nsu}, ultNSU: {ult_nsu}"
+        )
+        
+        return {
+            'status': status,
+            'motivo': motivo,
+            'max_nsu': max_nsu,
+            'ult_nsu': ult_nsu,
+            'documentos': documentos,
+            'falhas': falhas
+        }
+
+
+# ==================== DECODIFICAÇÃO DA RESPOSTA ====================
+
+# Campos do retDistDFeInt lidos pelo cliente
+_RET_FIELDS = ("cStat", "xMotivo", "ultNSU", "maxNSU")
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def identify_document_type(schema: str) -> str:
+    """Identifica o tipo de documento baseado no schema"""
+    if 'resNFe' in schema:
+        return 'Resumo NF-e'
+    elif 'procNFe' in schema:
+        return 'NF-e Completa'
+    elif 'resEvento' in schema or 'procEvento' in schema:
+        return 'Evento'
+    elif 'procCancNFe' in schema:
+        return 'Cancelamento'
+    else:
+        return 'Desconhecido'
+
+
+def _decode_doc_zip(elem: ET.Element) -> Union[DFeDocument, DFeDecodeFailure]:
+    """
+    docZip (base64 + gzip) -> DFeDocument (ou DFeDecodeFailure)
+
+    O documento já é parseado aqui, na thread de decodificação: a chave sai do
+    resultado e o parse fica no cache de nfe_xml_parser para a gravação.
+    """
+    nsu = elem.get('NSU', '')
+    schema = elem.get('schema', '')
+    if not elem.text:
+        return DFeDecodeFailure(nsu=nsu, schema=schema, error="docZip vazio")
+    try:
+        xml_data = gzip.decompress(base64.b64decode(elem.text.strip()))
+        xml_content = xml_data.decode('utf-8')
+    except Exception as e:
+        logger.error(f"❌ Erro ao decodificar documento NSU {nsu}: {e}")
+        return DFeDecodeFailure(nsu=nsu, schema=schema, error=str(e))
+    try:
+        chave = nfe_xml_parser.parse(xml_data).chave or ""
+    except ValueError:
+        chave = ""
+    return DFeDocument(
+        nsu=nsu,
+        schema=schema,
+        chave=chave,
+        tipo_documento=identify_document_type(schema),
+        xml_content=xml_content
+    )
+
+
+def iter_dist_response(
+    response_xml: Union[str, bytes]
+) -> Iterator[Union[Tuple[str, str], DFeDocument, DFeDecodeFailure]]:
+    """
+    Percorre a resposta do NFeDistribuicaoDFe uma única vez (iterparse)
     
-    def _extract_chave_from_xml(self, xml_content: str) -> str:
-        """Extrai a chave de acesso do XML"""
-        try:
-            root = ET.fromstring(xml_content)
-            # Procura por chave em diferentes lugares possíveis
-            
-            # Busca com namespace
-            chave_elem = root.find('.//{http://www.portalfiscal.inf.br/nfe}chNFe')
-            if chave_elem is not None and chave_elem.text:
-                return chave_elem.text
-            
-            # Busca sem namespace
-            chave_elem = root.find('.//chNFe')
-            if chave_elem is not None and chave_elem.text:
-                return chave_elem.text
-            
-            # Tenta em infNFe@Id
-            for elem in root.iter():
-                if 'infNFe' in elem.tag:
-                    id_attr = elem.get('Id', '')
-                    if id_attr.startswith('NFe'):
-                        return id_attr[3:]
-            
-            return ""
-        except:
-            return ""
-    
-    def _identify_document_type(self, schema: str, xml_content: str) -> str:
-        """Identifica o tipo de documento baseado no schema"""
-        if 'resNFe' in schema:
-            return 'Resumo NF-e'
-        elif 'procNFe' in schema:
-            return 'NF-e Completa'
-        elif 'resEvento' in schema or 'procEvento' in schema:
-            return 'Evento'
-        elif 'procCancNFe' in schema:
-            return 'Cancelamento'
-        else:
-            return 'Desconhecido'
+    Gera (campo, valor) para cStat, xMotivo, ultNSU e maxNSU do retDistDFeInt e
+    um DFeDocument (ou DFeDecodeFailure) por docZip, assim que cada um termina
+    de ser lido. Cada docZip é descartado depois de decodificado.
+    """
+    data = response_xml.encode('utf-8') if isinstance(response_xml, str) else response_xml
+    in_ret = False
+    for event, elem in ET.iterparse(io.BytesIO(data), events=("start", "end")):
+        name = _local_name(elem.tag)
+        if event == "start":
+            if name == "retDistDFeInt":
+                in_ret = True
+            continue
+        if not in_ret:
+            continue
+        if name in _RET_FIELDS:
+            yield name, (elem.text or "").strip()
+        elif name == "docZip":
+            document = _decode_doc_zip(elem)
+            elem.clear()
+            yield document
+        elif name == "retDistDFeInt":
+            return
@@ -0,0 +1,255 @@
+"""
+Saúde dos endpoints SEFAZ, circuit breaker, retry e hedge
+
+Cada URL de webservice tem um registro de saúde compartilhado pelo processo
+(todas as empresas e certificados): latência média (EWMA), taxa de erro numa
+janela das últimas chamadas e falhas consecutivas. Um endpoint que falha
+demais tem o circuito aberto e deixa de ser chamado por
+SEFAZ_CIRCUIT_COOLDOWN_SECONDS; depois disso uma única chamada de teste
+(meio-aberto) decide se ele volta.
+
+`call()` envia pela melhor opção disponível, repete falhas transitórias
+(rede, timeout, HTTP 5xx) com backoff exponencial com jitter e, se
+SEFAZ_HEDGE_AFTER_SECONDS > 0 e houver outro endpoint disponível, dispara
+uma segunda requisição nele quando a primeira demora. Com todos os circuitos abertos a chamada falha na hora com
+SefazUnavailable, em vez de esperar o timeout de cada empresa.
+"""
+from collections import deque
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Sequence, TypeVar
+
+import httpx
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Chamadas consideradas na taxa de erro de cada endpoint
+WINDOW = 20
+# Mínimo de chamadas na janela antes de abrir o circuito pela taxa de erro
+MIN_SAMPLES = 10
+# Peso da última medição na latência média
+EWMA_ALPHA = 0.2
+
+
+class SefazHttpError(Exception):
+    """Resposta HTTP diferente de 200 do webservice"""
+
+    def __init__(self, status_code: int, text: str):
+        super().__init__(f"HTTP {status_code}: {text[:500]}")
+        self.status_code = status_code
+
+
+class SefazUnavailable(Exception):
+    """Todos os endpoints do serviço estão com o circuito aberto"""
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Falhas transitórias: rede, timeout ou erro do servidor (5xx)"""
+    if isinstance(error, (httpx.TransportError, asyncio.TimeoutError)):
+        return True
+    return isinstance(error, SefazHttpError) and error.status_code >= 500
+
+
+class EndpointHealth:
+    """Estatísticas e estado do circuito de um endpoint"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.latency_ewma: Optional[float] = None
+        self.outcomes: Deque[bool] = deque(maxlen=WINDOW)
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+    def available(self) -> bool:
+        if self.state == "open" and time.monotonic() - self.opened_at >= settings.SEFAZ_CIRCUIT_COOLDOWN_SECONDS:
+            self.state = "half_open"
+            self.probe_in_flight = False
+        if self.state == "half_open":
+            return not self.probe_in_flight
+        return self.state == "closed"
+
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return sum(1 for ok in self.outcomes if not ok) / len(self.outcomes)
+
+    def record_success(self, seconds: float) -> None:
+        self.requests += 1
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+        self.latency_ewma = seconds if self.latency_ewma is None else (
+            EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * self.latency_ewma
+        )
+        if self.state != "closed":
+            logger.info(f"Circuito SEFAZ fechado: {self.url}")
+        self.state = "closed"
+
+    def record_failure(self, seconds: float, error: BaseException) -> None:
+        self.requests += 1
+        self.failures += 1
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        self.last_error = str(error)[:200] or type(error).__name__
+        # Timeouts também pesam na latência: o endpoint lento cai na ordenação
+        self.latency_ewma = seconds if self.latency_ewma is None else (
+            EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * self.latency_ewma
+        )
+
+        should_open = (
+            self.state == "half_open"
+            or self.consecutive_failures >= settings.SEFAZ_CIRCUIT_FAILURE_THRESHOLD
+            or (len(self.outcomes) >= MIN_SAMPLES and self.error_rate() >= settings.SEFAZ_CIRCUIT_ERROR_RATE)
+        )
+        if should_open:
+            if self.state != "open":
+                logger.warning(
+                    f"Circuito SEFAZ aberto: {self.url} "
+                    f"({self.consecutive_failures} falhas seguidas, erro {self.error_rate():.0%}): {self.last_error}"
+                )
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "state": self.state,
+            "latency_ms": round(self.latency_ewma * 1000) if self.latency_ewma is not None else None,
+            "error_rate": round(self.error_rate(), 3),
+            "consecutive_failures": self.consecutive_failures,
+            "requests": self.requests,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+_health: Dict[str, EndpointHealth] = {}
+
+
+def health(url: str) -> EndpointHealth:
+    entry = _health.get(url)
+    if entry is None:
+        entry = EndpointHealth(url)
+        _health[url] = entry
+    return entry
+
+
+def snapshot() -> List[Dict[str, Any]]:
+    """Estado de todos os endpoints já chamados neste processo"""
+    return [entry.snapshot() for entry in _health.values()]
+
+
+def backoff_delay(attempt: int) -> float:
+    """Backoff exponencial com jitter completo (attempt começa em 0)"""
+    ceiling = min(settings.SEFAZ_RETRY_MAX_SECONDS, settings.SEFAZ_RETRY_BASE_SECONDS * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+
+def _candidates(endpoints: Sequence[str]) -> List[EndpointHealth]:
+    """Endpoints disponíveis, do mais saudável para o menos"""
+    available = [health(url) for url in endpoints if health(url).available()]
+    return sorted(
+        available,
+        key=lambda h: (h.state != "closed", h.consecutive_failures, h.latency_ewma or 0.0),
+    )
+
+
+async def _send(entry: EndpointHealth, send: Callable[[str], Awaitable[T]]) -> T:
+    if entry.state == "half_open":
+        entry.probe_in_flight = True
+    started = time.perf_counter()
+    try:
+        result = await send(entry.url)
+    except asyncio.CancelledError:
+        # Perdedor de um hedge: não conta como falha
+        raise
+    except Exception as e:
+        if is_retryable(e):
+            entry.record_failure(time.perf_counter() - started, e)
+        else:
+            # 4xx e afins: o endpoint respondeu
+            entry.record_success(time.perf_counter() - started)
+        raise
+    else:
+        entry.record_success(time.perf_counter() - started)
+        return result
+    finally:
+        entry.probe_in_flight = False
+
+
+async def _hedged(candidates: List[EndpointHealth], send: Callable[[str], Awaitable[T]], hedge_after: float) -> T:
+    """Primeira resposta bem-sucedida entre o primário e um hedge em outro endpoint após hedge_after"""
+    primary = asyncio.ensure_future(_send(candidates[0], send))
+    done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+    if done:
+        return primary.result()
+
+    backup = candidates[1]
+    logger.info(f"Hedge SEFAZ: {candidates[0].url} sem resposta em {hedge_after}s, disparando em {backup.url}")
+    pending = {primary, asyncio.ensure_future(_send(backup, send))}
+    last_error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                last_error = task.exception()
+        raise last_error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def call(
+    endpoints: Sequence[str],
+    send: Callable[[str], Awaitable[T]],
+    hedge: bool = True
+) -> T:
+    """
+    Executa `send(url)` no melhor endpoint, com circuit breaker, retry e hedge
+
+    Args:
+        endpoints: URLs do serviço (ordem de preferência quando não há histórico)
+        send: Corrotina que faz a requisição para a URL recebida
+        hedge: Permite hedge (desligar para operações que não devem ser duplicadas)
+
+    Raises:
+        SefazUnavailable: Todos os circuitos abertos
+        Exception: Último erro, esgotadas as tentativas (ou erro não transitório)
+    """
+    attempts = max(1, settings.SEFAZ_RETRY_ATTEMPTS)
+    hedge_after = settings.SEFAZ_HEDGE_AFTER_SECONDS if hedge else 0
+    last_error: Optional[BaseException] = None
+
+    for attempt in range(attempts):
+        candidates = _candidates(endpoints)
+        if not candidates:
+            if last_error is not None:
+                raise last_error
+            raise SefazUnavailable(f"SEFAZ indisponível: circuito aberto para {', '.join(endpoints)}")
+        try:
+            # Hedge no mesmo endpoint só duplicaria a carga (e o consumo) nele
+            if hedge_after > 0 and len(candidates) > 1:
+                return await _hedged(candidates, send, hedge_after)
+            return await _send(candidates[0], send)
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+            last_error = e
+            logger.warning(f"Falha transitória na SEFAZ (tentativa {attempt + 1}/{attempts}): {e}")
+
+        if attempt < attempts - 1:
+            await asyncio.sleep(backoff_delay(attempt))
+
+    raise last_error
@@ -2,18 +2,21 @@
 Cliente SOAP para recepção de eventos (Manifestação do Destinatário)
 """
 import logging
-import os
-import tempfile
+import time
 from datetime import datetime, timezone, timedelta
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 
-import httpx
-import certifi
 from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.serialization import pkcs12, Encoding, PrivateFormat, NoEncryption
+from cryptography.hazmat.primitives.serialization import pkcs12
 from cryptography import x509
 from lxml import etree
-from signxml import XMLSigner, methods
+
+from app.sefaz_http import get_client, certificate_fingerprint
+from app import xml_signer
+from app import sefaz_endpoints
+from app.sefaz_endpoints import SefazHttpError
+from app.certificate_cache import CertificateMaterial
+from app.config import settings
 
 logger = logging.getLogger(__name__)
 
@@ -86,7 +89,18 @@ class SefazEventoClient:
     SOAP_ACTION = "http://www.portalfiscal.inf.br/nfe/wsdl/NFeRecepcaoEvento4/nfeRecepcaoEvento4"
     NS_NFE = "http://www.portalfiscal.inf.br/nfe"
 
-    def __init__(self, cnpj: str, cert_pfx_data: bytes, cert_password: str, producao: bool = True, uf: Optional[str] = None):
+    # Máximo de eventos por envEvento aceito pela RecepcaoEvento
+    MAX_EVENTOS_LOTE = 20
+
+    def __init__(
+        self,
+        cnpj: str,
+        cert_pfx_data: Optional[bytes] = None,
+        cert_password: Optional[str] = None,
+        producao: bool = True,
+        uf: Optional[str] = None,
+        material: Optional[CertificateMaterial] = None
+    ):
         self.cnpj = cnpj.replace('.', '').replace('/', '').replace('-', '')
         self.producao = producao
         self.uf = uf or "GO"  # Default para Goiás
@@ -108,9 +122,19 @@ class SefazEventoClient:
             logger.warning(f"Endpoint não encontrado para UF {self.uf}, usando SVRS")
             endpoint = "https://nfe.svrs.rs.gov.br/ws/recepcaoevento/recepcaoevento4.asmx"
         
-        self.endpoints = [endpoint]
+        self.endpoints = [settings.SEFAZ_EVENTO_URL or endpoint]
+
+        if material is not None:
+            # Material já carregado (cache por thumbprint): sem novo parse do PKCS#12
+            self.private_key = material.private_key
+            self.certificate = material.certificate
+            thumbprint = material.thumbprint
+        else:
+            self._load_certificate(cert_pfx_data, cert_password)
+            thumbprint = certificate_fingerprint(self.certificate)
 
-        self._load_certificate(cert_pfx_data, cert_password)
+        # Signer com chave e certificado já carregados, compartilhado entre instâncias
+        self.signer = xml_signer.get_signer(thumbprint, self.private_key, self.certificate)
 
     def _load_certificate(self, cert_pfx_data: bytes, password: str):
         self.private_key, self.certificate, _ = pkcs12.load_key_and_certificates(
@@ -123,64 +147,64 @@ class SefazEventoClient:
             if attr.oid._name in ['stateOrProvinceName', 'ST']:
                 uf_name = str(attr.value).upper()
                 break
-        self.private_key_pem = self.private_key.private_bytes(
-            encoding=Encoding.PEM,
-            format=PrivateFormat.TraditionalOpenSSL,
-            encryption_algorithm=NoEncryption(),
-        )
-        self.cert_pem = self.certificate.public_bytes(Encoding.PEM)
 
     def _build_event_xml(self, chave: str, tp_evento: str = "210210", n_seq_evento: int = 1, x_just: Optional[str] = None) -> bytes:
+        return self._build_lote_xml([chave], tp_evento=tp_evento, n_seq_evento=n_seq_evento, x_just=x_just, id_lote=str(n_seq_evento))
+
+    def _build_lote_xml(
+        self,
+        chaves: List[str],
+        tp_evento: str = "210210",
+        n_seq_evento: int = 1,
+        x_just: Optional[str] = None,
+        id_lote: Optional[str] = None
+    ) -> bytes:
+        """envEvento com um evento assinado por chave (até MAX_EVENTOS_LOTE)"""
+        if not chaves or len(chaves) > self.MAX_EVENTOS_LOTE:
+            raise ValueError(f"Lote de eventos deve ter entre 1 e {self.MAX_EVENTOS_LOTE} chaves")
+
         ns = self.NS_NFE
         env = etree.Element("{%s}envEvento" % ns, nsmap={None: ns}, versao="1.00")
-        etree.SubElement(env, "idLote").text = str(n_seq_evento)  # Simplificado, sem zeros à esquerda
-
-        evento = etree.SubElement(env, "evento", versao="1.00")
-        inf = etree.SubElement(evento, "infEvento", Id=f"ID{tp_evento}{chave}{str(n_seq_evento).zfill(2)}")
-        etree.SubElement(inf, "cOrgao").text = self.uf_code
-        etree.SubElement(inf, "tpAmb").text = "1" if self.producao else "2"
-        etree.SubElement(inf, "CNPJ").text = self.cnpj
-        etree.SubElement(inf, "chNFe").text = chave
-        # dhEvento no horário de Brasília (UTC - 3 horas)
+        etree.SubElement(env, "idLote").text = id_lote or str(int(time.time() * 1000) % 10**15)
+
+        # dhEvento no horário de Brasília (UTC - 3 horas), mesmo instante para o lote
         brasilia_tz = timezone(timedelta(hours=-3))
         dh_brasilia = datetime.now(brasilia_tz)
-        # Formato: AAAA-MM-DDTHH:MM:SS-03:00
-        etree.SubElement(inf, "dhEvento").text = dh_brasilia.strftime("%Y-%m-%dT%H:%M:%S-03:00")
-        etree.SubElement(inf, "tpEvento").text = tp_evento
-        etree.SubElement(inf, "nSeqEvento").text = str(n_seq_evento)
-        etree.SubElement(inf, "verEvento").text = "1.00"
-
-        # detEvento para manifestação - precisa ter estrutura específica
-        det = etree.SubElement(inf, "detEvento", versao="1.00")
-        
-        # Para eventos de manifestação, descEvento vai direto (sem namespace adicional)
-        desc_map = {
-            "210210": "Ciencia da Operacao",
-            "210200": "Confirmacao da Operacao", 
-            "210220": "Desconhecimento da Operacao",
-            "210240": "Operacao nao Realizada",
-        }
-        etree.SubElement(det, "descEvento").text = desc_map.get(tp_evento, "Ciencia da Operacao")
-        
-        # xJust é obrigatório para eventos 210220 e 210240
-        if tp_evento in ["210220", "210240"] and x_just:
-            etree.SubElement(det, "xJust").text = x_just
-
-        signer = XMLSigner(
-            method=methods.enveloped,
-            digest_algorithm="sha256",
-            signature_algorithm="rsa-sha256",
-            c14n_algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315",
-        )
-        signed = signer.sign(
-            inf,
-            key=self.private_key_pem,
-            cert=self.cert_pem,
-            reference_uri=f"#{inf.get('Id')}",
-        )
-        # Replace unsigned inf with signed version
-        evento.remove(inf)
-        evento.append(signed)
+
+        for chave in chaves:
+            evento = etree.SubElement(env, "evento", versao="1.00")
+            inf = etree.SubElement(evento, "infEvento", Id=f"ID{tp_evento}{chave}{str(n_seq_evento).zfill(2)}")
+            etree.SubElement(inf, "cOrgao").text = self.uf_code
+            etree.SubElement(inf, "tpAmb").text = "1" if self.producao else "2"
+            etree.SubElement(inf, "CNPJ").text = self.cnpj
+            etree.SubElement(inf, "chNFe").text = chave
+            # Formato: AAAA-MM-DDTHH:MM:SS-03:00
+            etree.SubElement(inf, "dhEvento").text = dh_brasilia.strftime("%Y-%m-%dT%H:%M:%S-03:00")
+            etree.SubElement(inf, "tpEvento").text = tp_evento
+            etree.SubElement(inf, "nSeqEvento").text = str(n_seq_evento)
+            etree.SubElement(inf, "verEvento").text = "1.00"
+
+            # detEvento para manifestação - precisa ter estrutura específica
+            det = etree.SubElement(inf, "detEvento", versao="1.00")
+            
+            # Para eventos de manifestação, descEvento vai direto (sem namespace adicional)
+            desc_map = {
+                "210210": "Ciencia da Operacao",
+                "210200": "Confirmacao da Operacao", 
+                "210220": "Desconhecimento da Operacao",
+                "210240": "Operacao nao Realizada",
+            }
+            etree.SubElement(det, "descEvento").text = desc_map.get(tp_evento, "Ciencia da Operacao")
+            
+            # xJust é obrigatório para eventos 210220 e 210240
+            if tp_evento in ["210220", "210240"] and x_just:
+                etree.SubElement(det, "xJust").text = x_just
+
+            # Cada infEvento tem sua própria assinatura
+            signed = self.signer.sign(inf)
+            # Replace unsigned inf with signed version
+            evento.remove(inf)
+            evento.append(signed)
 
         return etree.tostring(env, encoding="utf-8", xml_declaration=False)
 
@@ -204,35 +228,16 @@ class SefazEventoClient:
         )
 
     async def _send(self, soap_envelope: str, endpoint_url: str, timeout: int = 60) -> str:
-        cert_path = key_path = None
-        try:
-            cert_fd, cert_path = tempfile.mkstemp(suffix='.pem', prefix='sefaz_evt_cert_')
-            os.write(cert_fd, self.cert_pem)
-            os.close(cert_fd)
-
-            key_fd, key_path = tempfile.mkstemp(suffix='.pem', prefix='sefaz_evt_key_')
-            os.write(key_fd, self.private_key_pem)
-            os.close(key_fd)
-
-            headers = {
-                "Content-Type": "application/soap+xml; charset=utf-8; action=\"http://www.portalfiscal.inf.br/nfe/wsdl/NFeRecepcaoEvento4/nfeRecepcaoEvento\"",
-            }
+        headers = {
+            "Content-Type": "application/soap+xml; charset=utf-8; action=\"http://www.portalfiscal.inf.br/nfe/wsdl/NFeRecepcaoEvento4/nfeRecepcaoEvento\"",
+        }
 
-            async with httpx.AsyncClient(
-                cert=(cert_path, key_path),
-                verify=False,  # Desabilita verificação SSL (temporário para teste)
-                timeout=timeout,
-                follow_redirects=True,
-            ) as client:
-                response = await client.post(endpoint_url, content=soap_envelope.encode('utf-8'), headers=headers)
-                if response.status_code != 200:
-                    raise Exception(f"HTTP {response.status_code}: {response.text[:500]}")
-                return response.text
-        finally:
-            if cert_path and os.path.exists(cert_path):
-                os.unlink(cert_path)
-            if key_path and os.path.exists(key_path):
-                os.unlink(key_path)
+        # Pool mTLS do certificado; verificação do servidor desabilitada (temporário para teste)
+        client = get_client(self.certificate, self.private_key, verify=False)
+        response = await client.post(endpoint_url, content=soap_envelope.encode('utf-8'), headers=headers, timeout=timeout)
+        if response.status_code != 200:
+            raise SefazHttpError(response.status_code, response.text)
+        return response.text
 
     def _parse_response(self, response_xml: str) -> Dict[str, Any]:
         NS = {
@@ -258,31 +263,27 @@ class SefazEventoClient:
                     return e.text
             return ""
 
-        cstat = find_text(ret_env, "cStat")
-        motivo = find_text(ret_env, "xMotivo")
-        ret_evento = None
-        for e in ret_env.iter():
-            if e.tag.endswith('retEvento'):
-                ret_evento = e
-                break
-        evento_info = {}
-        if ret_evento is not None:
-            inf = None
-            for e in ret_evento.iter():
-                if e.tag.endswith('infEvento'):
-                    inf = e
+        # cStat/xMotivo do lote: filhos diretos de retEnvEvento (os de cada evento ficam em retEvento)
+        cstat = ret_env.findtext("nfe:cStat", default="", namespaces=NS) or find_text(ret_env, "cStat")
+        motivo = ret_env.findtext("nfe:xMotivo", default="", namespaces=NS) or find_text(ret_env, "xMotivo")
+        eventos = []
+        for ret_evento in ret_env.iter():
+            if not ret_evento.tag.endswith('retEvento'):
+                continue
+            for inf in ret_evento.iter():
+                if inf.tag.endswith('infEvento'):
+                    eventos.append({
+                        "chNFe": find_text(inf, "chNFe"),
+                        "cStat": find_text(inf, "cStat"),
+                        "xMotivo": find_text(inf, "xMotivo"),
+                        "nProt": find_text(inf, "nProt"),
+                    })
                     break
-            if inf is not None:
-                evento_info = {
-                    "chNFe": find_text(inf, "chNFe"),
-                    "cStat": find_text(inf, "cStat"),
-                    "xMotivo": find_text(inf, "xMotivo"),
-                    "nProt": find_text(inf, "nProt"),
-                }
         return {
             "status": int(cstat) if cstat.isdigit() else 0,
             "motivo": motivo,
-            "evento": evento_info,
+            "evento": eventos[0] if eventos else {},
+            "eventos": eventos,
         }
 
     async def manifestar(self, chave: str, tp_evento: str = "210210", n_seq_evento: int = 1, x_just: Optional[str] = None) -> Dict[str, Any]:
@@ -294,20 +295,52 @@ class SefazEventoClient:
         print(f"📤 [SOAP] Envelope:")
         print(soap_envelope[:2000])
 
-        last_error = None
-        for endpoint in self.endpoints:
-            try:
-                response_xml = await self._send(soap_envelope, endpoint)
-                print(f"📥 [RESPOSTA SEFAZ COMPLETA]:")
-                print(response_xml)
-                parsed = self._parse_response(response_xml)
-                logger.info(
-                    "manifestacao_response",
-                    extra={"chave": chave, "tp_evento": tp_evento, "status": parsed.get("status"), "motivo": parsed.get("motivo"), "evento": parsed.get("evento")},
-                )
-                return parsed
-            except Exception as e:
-                last_error = e
-                logger.warning(f"Manifestacao falhou no endpoint {endpoint}: {e}")
-                continue
-        raise last_error if last_error else Exception("Falha na manifestação")
+        async def send(endpoint_url: str) -> str:
+            return await self._send(soap_envelope, endpoint_url, timeout=settings.SEFAZ_REQUEST_TIMEOUT_SECONDS)
+
+        try:
+            # Sem hedge: um evento duplicado seria rejeitado (573) ou registrado duas vezes
+            response_xml = await sefaz_endpoints.call(self.endpoints, send, hedge=False)
+        except Exception as e:
+            logger.warning(f"Manifestacao falhou: {e}")
+            raise
+        print(f"📥 [RESPOSTA SEFAZ COMPLETA]:")
+        print(response_xml)
+        parsed = self._parse_response(response_xml)
+        logger.info(
+            "manifestacao_response",
+            extra={"chave": chave, "tp_evento": tp_evento, "status": parsed.get("status"), "motivo": parsed.get("motivo"), "evento": parsed.get("evento")},
+        )
+        return parsed
+
+    async def manifestar_lote(
+        self,
+        chaves: List[str],
+        tp_evento: str = "210210",
+        n_seq_evento: int = 1,
+        x_just: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Manifesta até MAX_EVENTOS_LOTE chaves numa única requisição envEvento
+
+        Returns:
+            Dict com status/motivo do lote e "eventos": {chave: retEvento}
+        """
+        xml_payload = self._build_lote_xml(chaves, tp_evento=tp_evento, n_seq_evento=n_seq_evento, x_just=x_just)
+        soap_envelope = self._build_soap_envelope(xml_payload)
+
+        async def send(endpoint_url: str) -> str:
+            return await self._send(soap_envelope, endpoint_url, timeout=settings.SEFAZ_REQUEST_TIMEOUT_SECONDS)
+
+        # Sem hedge: um evento duplicado seria rejeitado (573) ou registrado duas vezes
+        response_xml = await sefaz_endpoints.call(self.endpoints, send, hedge=False)
+        parsed = self._parse_response(response_xml)
+        logger.info(
+            "manifestacao_lote_response",
+            extra={"chaves": len(chaves), "tp_evento": tp_evento, "status": parsed.get("status"), "motivo": parsed.get("motivo")},
+        )
+        return {
+            "status": parsed["status"],
+            "motivo": parsed["motivo"],
+            "eventos": {evento["chNFe"]: evento for evento in parsed.get("eventos", []) if evento.get("chNFe")},
+        }
@@ -0,0 +1,139 @@
+"""
+Pool de conexões mTLS com a SEFAZ por certificado
+
+Mantém um httpx.AsyncClient de longa duração por certificado, com o
+ssl.SSLContext (certificado + chave) carregado uma única vez. As conexões
+keep-alive com cada endpoint são reaproveitadas entre chamadas e entre
+sincronizações, evitando um handshake TLS completo e a escrita de arquivos
+PEM temporários a cada requisição.
+
+O registro é do processo. Deve ser invalidado quando o certificado da empresa
+é substituído ou desativado, e fechado no desligamento da aplicação.
+
+Com SEFAZ_CASSETTE_MODE o transporte grava (record) ou reproduz (replay) o
+tráfego em um cassete (app.sefaz_cassette); em replay nada sai para a rede.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import ssl
+import tempfile
+from typing import Dict, Optional, Tuple
+
+import certifi
+import httpx
+from cryptography import x509
+from cryptography.hazmat.primitives.serialization import Encoding, PrivateFormat, NoEncryption
+
+from app import sefaz_cassette
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+# Conexões ociosas por host são mantidas abertas por até KEEPALIVE_EXPIRY segundos
+KEEPALIVE_EXPIRY = 120
+MAX_CONNECTIONS = 20
+
+_clients: Dict[Tuple[str, bool], httpx.AsyncClient] = {}
+
+
+def certificate_fingerprint(certificate: x509.Certificate) -> str:
+    """SHA-256 do DER do certificado (mesmo valor de CompanyCertificate.cert_thumbprint)"""
+    return hashlib.sha256(certificate.public_bytes(Encoding.DER)).hexdigest()
+
+
+def build_ssl_context(certificate: x509.Certificate, private_key, verify: bool = True) -> ssl.SSLContext:
+    """
+    SSLContext com o certificado de cliente carregado
+
+    load_cert_chain só aceita caminhos de arquivo: os PEM são gravados em
+    arquivos temporários, carregados e removidos em seguida. Depois disso o
+    contexto guarda o material em memória.
+    """
+    if verify:
+        context = ssl.create_default_context(cafile=certifi.where())
+    else:
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+
+    cert_path = key_path = None
+    try:
+        cert_fd, cert_path = tempfile.mkstemp(suffix='.pem', prefix='sefaz_cert_')
+        os.write(cert_fd, certificate.public_bytes(Encoding.PEM))
+        os.close(cert_fd)
+
+        key_fd, key_path = tempfile.mkstemp(suffix='.pem', prefix='sefaz_key_')
+        os.write(key_fd, private_key.private_bytes(
+            encoding=Encoding.PEM,
+            format=PrivateFormat.TraditionalOpenSSL,
+            encryption_algorithm=NoEncryption()
+        ))
+        os.close(key_fd)
+
+        context.load_cert_chain(certfile=cert_path, keyfile=key_path)
+    finally:
+        if cert_path and os.path.exists(cert_path):
+            os.unlink(cert_path)
+        if key_path and os.path.exists(key_path):
+            os.unlink(key_path)
+
+    return context
+
+
+def get_client(certificate: x509.Certificate, private_key, verify: bool = True) -> httpx.AsyncClient:
+    """
+    Cliente HTTP compartilhado do certificado
+
+    Args:
+        certificate: Certificado de cliente (mTLS)
+        private_key: Chave privada do certificado
+        verify: Verifica o certificado do servidor (cadeia do certifi)
+    """
+    key = (certificate_fingerprint(certificate), verify)
+    client = _clients.get(key)
+    if client is None or client.is_closed:
+        cassette_mode = sefaz_cassette.mode()
+        if cassette_mode == "replay":
+            client = httpx.AsyncClient(transport=sefaz_cassette.ReplayTransport(
+                sefaz_cassette.get_cassette(), timing=settings.SEFAZ_CASSETTE_TIMING
+            ))
+            _clients[key] = client
+            logger.info(f"Replay do cassete {settings.SEFAZ_CASSETTE_PATH} para certificado {key[0][:16]}...")
+            return client
+        limits = httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        )
+        ssl_context = build_ssl_context(certificate, private_key, verify)
+        if cassette_mode == "record":
+            transport = sefaz_cassette.RecordingTransport(
+                httpx.AsyncHTTPTransport(verify=ssl_context, limits=limits),
+                sefaz_cassette.get_cassette(),
+            )
+            client = httpx.AsyncClient(transport=transport, follow_redirects=True)
+        else:
+            client = httpx.AsyncClient(verify=ssl_context, follow_redirects=True, limits=limits)
+        _clients[key] = client
+        logger.info(f"Pool mTLS criado para certificado {key[0][:16]}...")
+    return client
+
+
+async def invalidate(fingerprint: Optional[str]) -> None:
+    """Fecha os clientes do certificado (substituído ou desativado)"""
+    if not fingerprint:
+        return
+    for key in [key for key in _clients if key[0] == fingerprint]:
+        client = _clients.pop(key)
+        await client.aclose()
+        logger.info(f"Pool mTLS do certificado {fingerprint[:16]}... descartado")
+
+
+async def close_all() -> None:
+    """Fecha todos os clientes (desligamento da aplicação)"""
+    clients = list(_clients.values())
+    _clients.clear()
+    await asyncio.gather(*(client.aclose() for client in clients), return_exceptions=True)
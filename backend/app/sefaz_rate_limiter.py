@@ -0,0 +1,67 @@
+"""
+Governador de taxa para chamadas à SEFAZ
+
+Token bucket por certificado (CNPJ), compartilhado por todas as requisições do
+processo, para manter o ritmo de consultas abaixo do limite que dispara
+cStat 656 (consumo indevido).
+"""
+import asyncio
+import time
+from typing import Dict, Tuple
+
+from app.config import settings
+
+
+class TokenBucket:
+    """Token bucket assíncrono: `rate_per_minute` fichas/minuto, rajada até `burst`"""
+
+    def __init__(self, rate_per_minute: float, burst: int):
+        self.rate = max(rate_per_minute, 0.001) / 60.0
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        """Aguarda até haver uma ficha disponível (ordem FIFO entre os chamadores)"""
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+_buckets: Dict[Tuple[str, str], TokenBucket] = {}
+
+
+def _bucket(kind: str, cnpj: str, rate_per_minute: float, burst: int) -> TokenBucket:
+    key = (kind, cnpj)
+    bucket = _buckets.get(key)
+    if bucket is None:
+        bucket = TokenBucket(rate_per_minute=rate_per_minute, burst=burst)
+        _buckets[key] = bucket
+    return bucket
+
+
+def consulta_chave_limiter(cnpj: str) -> TokenBucket:
+    """Bucket de consChNFe (consulta por chave) do certificado informado"""
+    return _bucket(
+        "consChNFe", cnpj,
+        rate_per_minute=settings.NFE_CONSULTA_CHAVE_PER_MINUTE,
+        burst=settings.NFE_CONSULTA_CHAVE_BURST,
+    )
+
+
+def backfill_limiter(cnpj: str) -> TokenBucket:
+    """Bucket de distDFe do backfill histórico do certificado informado"""
+    return _bucket(
+        "backfill", cnpj,
+        rate_per_minute=settings.NFE_BACKFILL_REQUESTS_PER_MINUTE,
+        burst=settings.NFE_BACKFILL_BURST,
+    )
@@ -0,0 +1,366 @@
+"""
+Simulador local da SEFAZ para testes de carga e latência
+
+Aplicação ASGI que responde como NFeDistribuicaoDFe (distNSU, consNSU,
+consChNFe) e NFeRecepcaoEvento4, gerando lotes sintéticos de docZip
+(gzip + base64) a partir do NSU. Volume, sequência de cStat (137/138/656),
+latência e taxa de falhas são configuráveis por variáveis de ambiente
+(prefixo SEFAZ_SIM_) ou em tempo de execução via PUT /_config.
+
+Uso:
+    uvicorn app.sefaz_simulator:app --port 8085
+
+    # na API (ou no script de benchmark)
+    SEFAZ_DIST_DFE_URL=http://localhost:8085/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx
+    SEFAZ_EVENTO_URL=http://localhost:8085/ws/recepcaoevento4.asmx
+
+Os documentos são determinísticos: o mesmo NSU sempre gera a mesma chave e o
+mesmo XML, e a chave carrega o NSU (nNF), de modo que consChNFe encontra o
+documento de volta.
+"""
+from datetime import datetime, timedelta, timezone
+import asyncio
+import base64
+import gzip
+import random
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Set, Tuple
+
+from fastapi import FastAPI, Request, Response
+from pydantic import BaseModel
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+NS_NFE = "http://www.portalfiscal.inf.br/nfe"
+NS_DIST = "http://www.portalfiscal.inf.br/nfe/wsdl/NFeDistribuicaoDFe"
+NS_EVENTO = "http://www.portalfiscal.inf.br/nfe/wsdl/NFeRecepcaoEvento4"
+
+SCHEMA_PROC = "procNFe_v4.00.xsd"
+SCHEMA_RES = "resNFe_v1.01.xsd"
+SCHEMA_EVENTO = "resEvento_v1.01.xsd"
+
+BRT = timezone(timedelta(hours=-3))
+
+
+class SimulatorConfig(BaseSettings):
+    """Parâmetros do simulador (env SEFAZ_SIM_*)"""
+    model_config = SettingsConfigDict(env_prefix="SEFAZ_SIM_")
+
+    total_docs: int = 5000  # maxNSU
+    page_size: int = 50  # documentos por resposta distNSU
+    full_ratio: float = 0.4  # fração de procNFe (o resto é resNFe/resEvento)
+    event_ratio: float = 0.1  # fração de resEvento (cancelamentos)
+    items_per_doc: int = 3  # itens (det) por procNFe
+    latency_ms: int = 150  # latência base por requisição
+    latency_jitter_ms: int = 100  # variação aleatória somada à latência
+    slow_rate: float = 0.0  # fração de requisições muito lentas (nó degradado)
+    slow_ms: int = 30000
+    failure_rate: float = 0.0  # fração de respostas HTTP 500
+    cstat_sequence: List[int] = []  # consumidos um por distDFe (137, 138, 656); vazio = natural
+    evento_cstat: str = "135"  # cStat de cada retEvento
+
+
+class ConfigUpdate(BaseModel):
+    total_docs: Optional[int] = None
+    page_size: Optional[int] = None
+    full_ratio: Optional[float] = None
+    event_ratio: Optional[float] = None
+    items_per_doc: Optional[int] = None
+    latency_ms: Optional[int] = None
+    latency_jitter_ms: Optional[int] = None
+    slow_rate: Optional[float] = None
+    slow_ms: Optional[int] = None
+    failure_rate: Optional[float] = None
+    cstat_sequence: Optional[List[int]] = None
+    evento_cstat: Optional[str] = None
+
+
+class SimulatorState:
+    def __init__(self, config: SimulatorConfig):
+        self.config = config
+        self.cstat_queue: List[int] = list(config.cstat_sequence)
+        self.manifested: Set[str] = set()
+        self.requests: Dict[str, int] = {}
+
+    def count(self, kind: str) -> None:
+        self.requests[kind] = self.requests.get(kind, 0) + 1
+
+
+# ==================== DOCUMENTOS SINTÉTICOS ====================
+
+def _dv_mod11(digits: str) -> str:
+    weights = [2, 3, 4, 5, 6, 7, 8, 9]
+    total = sum(int(d) * weights[i % 8] for i, d in enumerate(reversed(digits)))
+    rest = total % 11
+    return "0" if rest < 2 else str(11 - rest)
+
+
+def _emitter(nsu: int) -> Tuple[str, str]:
+    index = nsu % 40
+    return f"{11222333 + index:08d}000181", f"FORNECEDOR SIMULADO {index:02d} LTDA"
+
+
+def chave_for(nsu: int) -> str:
+    cnpj_emit, _ = _emitter(nsu)
+    base = f"52{datetime.now(BRT):%y%m}{cnpj_emit}55001{nsu:09d}1{(nsu * 7919) % 10**8:08d}"
+    return base + _dv_mod11(base)
+
+
+def nsu_from_chave(chave: str) -> Optional[int]:
+    if len(chave) != 44 or not chave.isdigit():
+        return None
+    return int(chave[25:34])
+
+
+def doc_kind(nsu: int, config: SimulatorConfig) -> str:
+    roll = random.Random(nsu).random()
+    if roll < config.event_ratio:
+        return "evento"
+    if roll < config.event_ratio + config.full_ratio:
+        return "full"
+    return "summary"
+
+
+def _dh(nsu: int) -> str:
+    return (datetime.now(BRT) - timedelta(minutes=nsu)).strftime("%Y-%m-%dT%H:%M:%S-03:00")
+
+
+def _valor(nsu: int) -> str:
+    return f"{100 + (nsu * 37) % 9900}.{nsu % 100:02d}"
+
+
+def build_proc_nfe(nsu: int, dest_cnpj: str, items: int) -> str:
+    chave = chave_for(nsu)
+    cnpj_emit, nome_emit = _emitter(nsu)
+    valor = float(_valor(nsu))
+    item_value = round(valor / max(items, 1), 2)
+    dets = "".join(
+        f'<det nItem="{i}"><prod><cProd>P{(nsu + i) % 500:04d}</cProd><cEAN>SEM GTIN</cEAN>'
+        f'<xProd>PRODUTO SIMULADO {(nsu + i) % 500:04d}</xProd><NCM>{84713012 + (nsu + i) % 7}</NCM>'
+        f'<CFOP>{"5102" if i % 2 else "6102"}</CFOP><uCom>UN</uCom><qCom>1.0000</qCom>'
+        f'<vUnCom>{item_value:.2f}</vUnCom><vProd>{item_value:.2f}</vProd></prod></det>'
+        for i in range(1, items + 1)
+    )
+    return (
+        f'<nfeProc xmlns="{NS_NFE}" versao="4.00"><NFe><infNFe Id="NFe{chave}" versao="4.00">'
+        f'<ide><cUF>52</cUF><natOp>VENDA DE MERCADORIA</natOp><mod>55</mod><serie>1</serie>'
+        f'<nNF>{nsu}</nNF><dhEmi>{_dh(nsu)}</dhEmi><tpNF>1</tpNF></ide>'
+        f'<emit><CNPJ>{cnpj_emit}</CNPJ><xNome>{nome_emit}</xNome><enderEmit><xLgr>RUA SIMULADA</xLgr>'
+        f'<nro>{nsu % 999}</nro><xBairro>CENTRO</xBairro><xMun>GOIANIA</xMun><UF>GO</UF><CEP>74000000</CEP></enderEmit>'
+        f'<IE>1234567{nsu % 100:02d}</IE></emit>'
+        f'<dest><CNPJ>{dest_cnpj}</CNPJ><xNome>EMPRESA DESTINATARIA</xNome></dest>'
+        f'{dets}'
+        f'<total><ICMSTot><vProd>{valor:.2f}</vProd><vNF>{valor:.2f}</vNF></ICMSTot></total>'
+        f'<transp><modFrete>9</modFrete></transp></infNFe></NFe>'
+        f'<protNFe versao="4.00"><infProt><tpAmb>2</tpAmb><chNFe>{chave}</chNFe><dhRecbto>{_dh(nsu)}</dhRecbto>'
+        f'<nProt>152{nsu:012d}</nProt><cStat>100</cStat><xMotivo>Autorizado o uso da NF-e</xMotivo></infProt></protNFe>'
+        f'</nfeProc>'
+    )
+
+
+def build_res_nfe(nsu: int) -> str:
+    cnpj_emit, nome_emit = _emitter(nsu)
+    return (
+        f'<resNFe xmlns="{NS_NFE}" versao="1.01"><chNFe>{chave_for(nsu)}</chNFe>'
+        f'<CNPJ>{cnpj_emit}</CNPJ><xNome>{nome_emit}</xNome><IE>1234567{nsu % 100:02d}</IE>'
+        f'<dhEmi>{_dh(nsu)}</dhEmi><tpNF>1</tpNF><vNF>{_valor(nsu)}</vNF>'
+        f'<digVal>c2ltdWxhZG8=</digVal><dhRecbto>{_dh(nsu)}</dhRecbto>'
+        f'<nProt>152{nsu:012d}</nProt><cSitNFe>1</cSitNFe></resNFe>'
+    )
+
+
+def build_res_evento(nsu: int) -> str:
+    cnpj_emit, _ = _emitter(nsu)
+    # Cancela a NF-e de um NSU anterior
+    target = max(1, nsu - 1)
+    return (
+        f'<resEvento xmlns="{NS_NFE}" versao="1.01"><cOrgao>52</cOrgao><CNPJ>{cnpj_emit}</CNPJ>'
+        f'<chNFe>{chave_for(target)}</chNFe><dhEvento>{_dh(nsu)}</dhEvento><tpEvento>110111</tpEvento>'
+        f'<nSeqEvento>1</nSeqEvento><xEvento>Cancelamento</xEvento><dhRecbto>{_dh(nsu)}</dhRecbto>'
+        f'<nProt>152{nsu:012d}</nProt></resEvento>'
+    )
+
+
+def build_doc(nsu: int, dest_cnpj: str, config: SimulatorConfig) -> Tuple[str, str]:
+    """(schema, xml) do documento do NSU"""
+    kind = doc_kind(nsu, config)
+    if kind == "full":
+        return SCHEMA_PROC, build_proc_nfe(nsu, dest_cnpj, config.items_per_doc)
+    if kind == "evento":
+        return SCHEMA_EVENTO, build_res_evento(nsu)
+    return SCHEMA_RES, build_res_nfe(nsu)
+
+
+def _doc_zip(nsu: int, schema: str, xml: str) -> str:
+    payload = base64.b64encode(gzip.compress(xml.encode("utf-8"))).decode("ascii")
+    return f'<docZip NSU="{nsu:015d}" schema="{schema}">{payload}</docZip>'
+
+
+# ==================== RESPOSTAS SOAP ====================
+
+def dist_response(cstat: int, motivo: str, ult_nsu: int, max_nsu: int, doc_zips: List[str]) -> str:
+    lote = f"<loteDistDFeInt>{''.join(doc_zips)}</loteDistDFeInt>" if doc_zips else ""
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope"><soap:Body>'
+        f'<nfeDistDFeInteresseResponse xmlns="{NS_DIST}"><nfeDistDFeInteresseResult>'
+        f'<retDistDFeInt xmlns="{NS_NFE}" versao="1.01"><tpAmb>2</tpAmb><verAplic>SIMULADOR</verAplic>'
+        f'<cStat>{cstat}</cStat><xMotivo>{motivo}</xMotivo><dhResp>{datetime.now(BRT).isoformat()}</dhResp>'
+        f'<ultNSU>{ult_nsu:015d}</ultNSU><maxNSU>{max_nsu:015d}</maxNSU>{lote}'
+        '</retDistDFeInt></nfeDistDFeInteresseResult></nfeDistDFeInteresseResponse>'
+        '</soap:Body></soap:Envelope>'
+    )
+
+
+def evento_response(eventos: List[Dict[str, str]], evento_cstat: str) -> str:
+    rets = "".join(
+        f'<retEvento versao="1.00"><infEvento><tpAmb>2</tpAmb><verAplic>SIMULADOR</verAplic>'
+        f'<cOrgao>91</cOrgao><cStat>{evento_cstat}</cStat><xMotivo>Evento registrado e vinculado a NF-e</xMotivo>'
+        f'<chNFe>{e["chNFe"]}</chNFe><tpEvento>{e["tpEvento"]}</tpEvento><nSeqEvento>{e["nSeqEvento"]}</nSeqEvento>'
+        f'<dhRegEvento>{datetime.now(BRT).isoformat()}</dhRegEvento><nProt>891{i:012d}</nProt></infEvento></retEvento>'
+        for i, e in enumerate(eventos, 1)
+    )
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<soap12:Envelope xmlns:soap12="http://www.w3.org/2003/05/soap-envelope"><soap12:Body>'
+        f'<nfeResultMsg xmlns="{NS_EVENTO}"><retEnvEvento xmlns="{NS_NFE}" versao="1.00">'
+        '<idLote>1</idLote><tpAmb>2</tpAmb><verAplic>SIMULADOR</verAplic><cOrgao>91</cOrgao>'
+        f'<cStat>128</cStat><xMotivo>Lote de Evento Processado</xMotivo>{rets}</retEnvEvento></nfeResultMsg>'
+        '</soap12:Body></soap12:Envelope>'
+    )
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _find(root: ET.Element, name: str) -> Optional[str]:
+    for elem in root.iter():
+        if _local(elem.tag) == name:
+            return (elem.text or "").strip()
+    return None
+
+
+# ==================== APLICAÇÃO ====================
+
+app = FastAPI(title="SEFAZ Simulator")
+app.state.sim = SimulatorState(SimulatorConfig())
+
+
+async def _simulate_network(state: SimulatorState) -> Optional[Response]:
+    """Aplica latência e, conforme as taxas configuradas, lentidão extrema ou HTTP 500"""
+    config = state.config
+    delay = config.latency_ms + random.uniform(0, config.latency_jitter_ms)
+    if random.random() < config.slow_rate:
+        delay = config.slow_ms
+    await asyncio.sleep(delay / 1000)
+    if random.random() < config.failure_rate:
+        state.count("failure")
+        return Response("Falha simulada", status_code=500)
+    return None
+
+
+@app.post("/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx")
+async def nfe_dist_dfe(request: Request):
+    state: SimulatorState = app.state.sim
+    config = state.config
+    failure = await _simulate_network(state)
+    if failure is not None:
+        return failure
+
+    root = ET.fromstring(await request.body())
+    dest_cnpj = _find(root, "CNPJ") or "00000000000000"
+    max_nsu = config.total_docs
+
+    ch_nfe = _find(root, "chNFe")
+    if ch_nfe:
+        state.count("consChNFe")
+        nsu = nsu_from_chave(ch_nfe)
+        if nsu is None or not 1 <= nsu <= max_nsu:
+            return _xml(dist_response(137, "Nenhum documento localizado", 0, max_nsu, []))
+        # procNFe só para documentos completos ou já manifestados
+        if doc_kind(nsu, config) == "full" or ch_nfe in state.manifested:
+            schema, xml = SCHEMA_PROC, build_proc_nfe(nsu, dest_cnpj, config.items_per_doc)
+        else:
+            schema, xml = SCHEMA_RES, build_res_nfe(nsu)
+        return _xml(dist_response(138, "Documento localizado", nsu, max_nsu, [_doc_zip(nsu, schema, xml)]))
+
+    forced = state.cstat_queue.pop(0) if state.cstat_queue else None
+    if forced == 656:
+        state.count("656")
+        return _xml(dist_response(656, "Rejeicao: Consumo Indevido", 0, max_nsu, []))
+
+    ult_nsu_text = _find(root, "ultNSU")
+    if ult_nsu_text is None:
+        state.count("consNSU")
+        nsu = int(_find(root, "NSU") or 0)
+        if forced == 137 or not 1 <= nsu <= max_nsu:
+            return _xml(dist_response(137, "Nenhum documento localizado", nsu, max_nsu, []))
+        schema, xml = build_doc(nsu, dest_cnpj, config)
+        return _xml(dist_response(138, "Documento localizado", nsu, max_nsu, [_doc_zip(nsu, schema, xml)]))
+
+    state.count("distNSU")
+    ult_nsu = min(int(ult_nsu_text or 0), max_nsu)
+    last = min(ult_nsu + config.page_size, max_nsu)
+    if forced == 137 or last <= ult_nsu:
+        return _xml(dist_response(137, "Nenhum documento localizado", ult_nsu, max_nsu, []))
+
+    doc_zips = [_doc_zip(nsu, *build_doc(nsu, dest_cnpj, config)) for nsu in range(ult_nsu + 1, last + 1)]
+    return _xml(dist_response(138, "Documento(s) localizado(s)", last, max_nsu, doc_zips))
+
+
+@app.post("/ws/recepcaoevento4.asmx")
+async def nfe_recepcao_evento(request: Request):
+    state: SimulatorState = app.state.sim
+    failure = await _simulate_network(state)
+    if failure is not None:
+        return failure
+
+    state.count("evento")
+    root = ET.fromstring(await request.body())
+    eventos = []
+    for inf in root.iter():
+        if _local(inf.tag) != "infEvento":
+            continue
+        evento = {
+            "chNFe": _find(inf, "chNFe") or "",
+            "tpEvento": _find(inf, "tpEvento") or "210210",
+            "nSeqEvento": _find(inf, "nSeqEvento") or "1",
+        }
+        if state.config.evento_cstat in ("135", "136", "573"):
+            state.manifested.add(evento["chNFe"])
+        eventos.append(evento)
+    return Response(
+        evento_response(eventos, state.config.evento_cstat),
+        media_type="application/soap+xml; charset=utf-8"
+    )
+
+
+@app.get("/_config")
+async def get_config():
+    return app.state.sim.config
+
+
+@app.put("/_config")
+async def update_config(data: ConfigUpdate):
+    state: SimulatorState = app.state.sim
+    state.config = state.config.model_copy(update=data.model_dump(exclude_none=True))
+    if data.cstat_sequence is not None:
+        state.cstat_queue = list(data.cstat_sequence)
+    return state.config
+
+
+@app.get("/_stats")
+async def get_stats():
+    state: SimulatorState = app.state.sim
+    return {"requests": state.requests, "manifested": len(state.manifested), "pending_cstat": state.cstat_queue}
+
+
+@app.post("/_reset")
+async def reset():
+    app.state.sim = SimulatorState(SimulatorConfig())
+    return {"status": "ok"}
+
+
+def _xml(body: str) -> Response:
+    return Response(body, media_type="application/soap+xml; charset=utf-8")
@@ -4,7 +4,6 @@ Serviço para geração de PDF de NF-e (DANFE)
 from io import BytesIO
 from datetime import datetime
 from typing import Optional
-import xml.etree.ElementTree as ET
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
@@ -15,6 +14,9 @@ from reportlab.pdfgen import canvas
 import barcode
 from barcode.writer import ImageWriter
 
+from app import nfe_xml_parser
+from app.nfe_xml_parser import NfeXml
+
 
 class NFePDFGenerator:
     """Gerador de DANFE (Documento Auxiliar da Nota Fiscal Eletrônica)"""
@@ -54,132 +56,75 @@ class NFePDFGenerator:
     def parse_xml(self, xml_content: str) -> dict:
         """Extrai dados do XML da NF-e"""
         try:
-            root = ET.fromstring(xml_content)
-            
-            # Namespace da NF-e
-            ns = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
-            
-            # Busca elementos principais
-            inf_nfe = root.find('.//nfe:infNFe', ns)
-            ide = root.find('.//nfe:ide', ns)
-            emit = root.find('.//nfe:emit', ns)
-            dest = root.find('.//nfe:dest', ns)
-            total = root.find('.//nfe:total/nfe:ICMSTot', ns)
-            transp = root.find('.//nfe:transp', ns)
-            items = root.findall('.//nfe:det', ns)
-            
-            # Extrai chave de acesso
-            chave = inf_nfe.get('Id', '').replace('NFe', '') if inf_nfe is not None else ''
-            
-            # Dados da nota
-            data = {
-                'chave': chave,
-                'numero': self._get_text(ide, 'nfe:nNF', ns),
-                'serie': self._get_text(ide, 'nfe:serie', ns),
-                'data_emissao': self._get_text(ide, 'nfe:dhEmi', ns),
-                'data_saida': self._get_text(ide, 'nfe:dhSaiEnt', ns),
-                'natureza': self._get_text(ide, 'nfe:natOp', ns),
-                'tipo_nf': 'ENTRADA' if self._get_text(ide, 'nfe:tpNF', ns) == '0' else 'SAÍDA',
-                'modelo': self._get_text(ide, 'nfe:mod', ns),
-                
-                # Emitente
-                'emit_cnpj': self._get_text(emit, 'nfe:CNPJ', ns),
-                'emit_nome': self._get_text(emit, 'nfe:xNome', ns),
-                'emit_fantasia': self._get_text(emit, 'nfe:xFant', ns),
-                'emit_endereco': self._format_endereco(emit, ns),
-                'emit_ie': self._get_text(emit, 'nfe:IE', ns),
-                
-                # Destinatário
-                'dest_cnpj': self._get_text(dest, 'nfe:CNPJ', ns) or self._get_text(dest, 'nfe:CPF', ns),
-                'dest_nome': self._get_text(dest, 'nfe:xNome', ns),
-                'dest_endereco': self._format_endereco(dest, ns),
-                'dest_ie': self._get_text(dest, 'nfe:IE', ns),
-                
-                # Totais
-                'bc_icms': self._get_text(total, 'nfe:vBC', ns),
-                'valor_icms': self._get_text(total, 'nfe:vICMS', ns),
-                'valor_produtos': self._get_text(total, 'nfe:vProd', ns),
-                'valor_frete': self._get_text(total, 'nfe:vFrete', ns),
-                'valor_seguro': self._get_text(total, 'nfe:vSeg', ns),
-                'valor_desconto': self._get_text(total, 'nfe:vDesc', ns),
-                'valor_total': self._get_text(total, 'nfe:vNF', ns),
-                
-                # Transporte
-                'transp_modalidade': self._get_modalidade_frete(transp, ns),
-                
-                # Itens
-                'items': self._parse_items(items, ns)
-            }
-            
-            return data
-        except Exception as e:
+            nfe = nfe_xml_parser.parse(xml_content)
+        except ValueError as e:
             raise ValueError(f"Erro ao parsear XML: {str(e)}")
+
+        emit = nfe.emitente
+        dest = nfe.destinatario
+        return {
+            'chave': nfe.chave or '',
+            'numero': nfe.numero or '',
+            'serie': nfe.serie or '',
+            'data_emissao': nfe.dh_emi or '',
+            'data_saida': nfe.dh_sai_ent or '',
+            'natureza': nfe.natureza or '',
+            'tipo_nf': 'ENTRADA' if nfe.tp_nf == '0' else 'SAÍDA',
+            'modelo': nfe.modelo or '',
+
+            # Emitente
+            'emit_cnpj': emit.cnpj or '',
+            'emit_nome': emit.nome or '',
+            'emit_fantasia': emit.fantasia or '',
+            'emit_endereco': emit.endereco,
+            'emit_ie': emit.ie or '',
+
+            # Destinatário
+            'dest_cnpj': dest.documento or '',
+            'dest_nome': dest.nome or '',
+            'dest_endereco': dest.endereco,
+            'dest_ie': dest.ie or '',
+
+            # Totais
+            'bc_icms': nfe.v_bc or '',
+            'valor_icms': nfe.v_icms or '',
+            'valor_produtos': nfe.v_prod or '',
+            'valor_frete': nfe.v_frete or '',
+            'valor_seguro': nfe.v_seg or '',
+            'valor_desconto': nfe.v_desc or '',
+            'valor_total': nfe.v_nf or '',
+
+            # Transporte
+            'transp_modalidade': self._get_modalidade_frete(nfe),
+
+            # Itens
+            'items': [
+                {
+                    'codigo': item.codigo or '',
+                    'descricao': item.descricao or '',
+                    'ncm': item.ncm or '',
+                    'cfop': item.cfop or '',
+                    'unidade': item.unidade or '',
+                    'quantidade': item.quantidade or '',
+                    'valor_unitario': item.valor_unitario or '',
+                    'valor_total': item.valor_total or '',
+                }
+                for item in nfe.items
+            ]
+        }
     
-    def _get_text(self, element, tag: str, ns: dict) -> str:
-        """Extrai texto de um elemento XML"""
-        if element is None:
-            return ''
-        found = element.find(tag, ns)
-        return found.text if found is not None and found.text else ''
-    
-    def _format_endereco(self, element, ns: dict) -> str:
-        """Formata endereço completo"""
-        if element is None:
-            return ''
-        
-        ender = element.find('nfe:enderEmit', ns) or element.find('nfe:enderDest', ns)
-        if ender is None:
-            return ''
-        
-        logradouro = self._get_text(ender, 'nfe:xLgr', ns)
-        numero = self._get_text(ender, 'nfe:nro', ns)
-        complemento = self._get_text(ender, 'nfe:xCpl', ns)
-        bairro = self._get_text(ender, 'nfe:xBairro', ns)
-        municipio = self._get_text(ender, 'nfe:xMun', ns)
-        uf = self._get_text(ender, 'nfe:UF', ns)
-        cep = self._get_text(ender, 'nfe:CEP', ns)
-        
-        endereco = f"{logradouro}, {numero}"
-        if complemento:
-            endereco += f", {complemento}"
-        endereco += f" - {bairro}, {municipio}/{uf} - CEP: {cep}"
-        
-        return endereco
-    
-    def _get_modalidade_frete(self, transp, ns: dict) -> str:
+    def _get_modalidade_frete(self, nfe: NfeXml) -> str:
         """Retorna modalidade de frete"""
-        if transp is None:
+        if not nfe.has_transp:
             return 'SEM FRETE'
         
-        mod = self._get_text(transp, 'nfe:modFrete', ns)
         modalidades = {
             '0': 'POR CONTA DO EMITENTE',
             '1': 'POR CONTA DO DESTINATÁRIO',
             '2': 'POR CONTA DE TERCEIROS',
             '9': 'SEM FRETE'
         }
-        return modalidades.get(mod, 'NÃO INFORMADO')
-    
-    def _parse_items(self, items, ns: dict) -> list:
-        """Extrai itens da nota"""
-        result = []
-        for item in items:
-            prod = item.find('nfe:prod', ns)
-            if prod is None:
-                continue
-            
-            result.append({
-                'codigo': self._get_text(prod, 'nfe:cProd', ns),
-                'descricao': self._get_text(prod, 'nfe:xProd', ns),
-                'ncm': self._get_text(prod, 'nfe:NCM', ns),
-                'cfop': self._get_text(prod, 'nfe:CFOP', ns),
-                'unidade': self._get_text(prod, 'nfe:uCom', ns),
-                'quantidade': self._get_text(prod, 'nfe:qCom', ns),
-                'valor_unitario': self._get_text(prod, 'nfe:vUnCom', ns),
-                'valor_total': self._get_text(prod, 'nfe:vProd', ns),
-            })
-        
-        return result
+        return modalidades.get(nfe.mod_frete, 'NÃO INFORMADO')
     
     def generate_pdf(self, xml_content: str) -> BytesIO:
         """Gera PDF (DANFE) a partir do XML da NF-e"""
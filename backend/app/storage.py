@@ -64,6 +64,16 @@ class MinIOService:
             "version_id": result.version_id
         }
 
+    def object_exists(self, object_key: str) -> bool:
+        """Verifica se o objeto existe no bucket (HEAD)"""
+        try:
+            self.client.stat_object(settings.MINIO_BUCKET, object_key)
+            return True
+        except S3Error as e:
+            if e.code in ("NoSuchKey", "NoSuchObject", "ResourceNotFound"):
+                return False
+            raise
+
     def get_object(self, object_key: str) -> bytes:
         """Download de objeto como bytes"""
         response = None
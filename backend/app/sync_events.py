@@ -0,0 +1,74 @@
+"""
+Eventos de progresso da sincronização NF-e
+
+Barramento publish/subscribe em memória: NfeSyncService e NfeIngestService
+publicam eventos por página e por documento (página recebida, cStat, documento
+processado, documento gravado) e o endpoint SSE repassa aos clientes
+inscritos. Sem inscritos, publicar não custa nada além de um lookup.
+
+Os eventos ficam no processo que executa a sincronização: com vários workers
+do uvicorn, o stream mostra as sincronizações rodando no worker que atendeu a
+conexão SSE.
+"""
+from contextlib import contextmanager
+from datetime import datetime
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Iterator, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class SyncEventBus:
+    """Distribui eventos de sincronização para filas de inscritos"""
+
+    def __init__(self, queue_size: int = 1000):
+        self.queue_size = queue_size
+        # None = inscritos em todas as empresas
+        self._subscribers: Dict[Optional[int], Set[asyncio.Queue]] = {}
+
+    def has_subscribers(self, company_id: int) -> bool:
+        return bool(self._subscribers.get(company_id) or self._subscribers.get(None))
+
+    def publish(self, company_id: int, event: str, **data: Any) -> None:
+        """Entrega o evento sem bloquear; inscrito lento perde os eventos mais antigos"""
+        if not self.has_subscribers(company_id):
+            return
+
+        payload = {
+            "event": event,
+            "company_id": company_id,
+            "ts": datetime.utcnow().isoformat(),
+            **data,
+        }
+        queues = self._subscribers.get(company_id, set()) | self._subscribers.get(None, set())
+        for queue in queues:
+            if queue.full():
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    pass
+            queue.put_nowait(payload)
+
+    @contextmanager
+    def subscribe(self, company_id: Optional[int] = None) -> Iterator[asyncio.Queue]:
+        """Inscreve uma fila nos eventos da empresa (ou de todas, se None)"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(company_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            subscribers = self._subscribers.get(company_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[company_id]
+
+
+def format_sse(payload: Dict[str, Any]) -> str:
+    """Serializa um evento no formato text/event-stream"""
+    return f"event: {payload['event']}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+
+sync_events = SyncEventBus()
@@ -0,0 +1,72 @@
+"""
+Lease por empresa entre processos (PostgreSQL advisory locks)
+
+Cada worker do uvicorn sobe seu próprio scheduler e os usuários também podem
+disparar sincronizações manualmente. O lease garante que apenas um processo
+execute a sincronização (ou a manifestação) de uma empresa por vez.
+
+O lock é de sessão (pg_try_advisory_lock) e fica preso a uma conexão dedicada,
+separada da AsyncSession do serviço: a sessão devolve a conexão ao pool a cada
+commit, o que soltaria o lock no meio da execução. Se o processo morrer, o
+PostgreSQL libera o lock junto com a conexão.
+
+A conexão do lease fica em AUTOCOMMIT: segura só o advisory lock, sem uma
+transação aberta ("idle in transaction") durante toda a sincronização. Ainda
+assim ocupa uma conexão do pool por execução (ver app.database).
+"""
+from contextlib import asynccontextmanager
+import logging
+from typing import AsyncIterator
+
+from sqlalchemy import text
+
+from app.database import engine
+
+logger = logging.getLogger(__name__)
+
+
+# Primeiro inteiro do advisory lock (classid); o segundo é o company_id
+LEASE_SCOPES = {
+    "nfe_sync": 1001,
+    "nfe_manifest": 1002,
+}
+
+
+class LeaseUnavailable(Exception):
+    """Outro processo já detém o lease desta empresa"""
+
+    def __init__(self, scope: str, company_id: int):
+        self.scope = scope
+        self.company_id = company_id
+        super().__init__(f"Lease {scope} da empresa {company_id} já está em uso")
+
+
+@asynccontextmanager
+async def company_lease(company_id: int, scope: str = "nfe_sync") -> AsyncIterator[None]:
+    """
+    Adquire o lease da empresa ou falha imediatamente
+
+    Raises:
+        LeaseUnavailable: se outra execução estiver em andamento
+    """
+    classid = LEASE_SCOPES[scope]
+    params = {"classid": classid, "company_id": company_id}
+
+    async with engine.connect() as conn:
+        # Sem autobegin: o lock é de sessão e não depende de transação
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        acquired = (
+            await conn.execute(text("SELECT pg_try_advisory_lock(:classid, :company_id)"), params)
+        ).scalar()
+        if not acquired:
+            raise LeaseUnavailable(scope, company_id)
+
+        try:
+            yield
+        finally:
+            try:
+                await conn.execute(text("SELECT pg_advisory_unlock(:classid, :company_id)"), params)
+            except Exception as e:
+                # Não devolve ao pool uma conexão que ainda segura o lock
+                logger.error(f"Falha ao liberar lease {scope} da empresa {company_id}: {e}")
+                await conn.invalidate()
@@ -0,0 +1,66 @@
+"""
+Tempo por estágio da sincronização NF-e
+
+StageTimer acumula o tempo de parede e o número de ocorrências de cada
+estágio de uma execução (SOAP, decodificação, parse, upload, refetch de
+procNFe, banco). O resultado vai para NfeSyncLog.stage_timings e alimenta o
+endpoint de percentis por empresa.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+import math
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+
+# Estágios instrumentados, na ordem em que acontecem numa página
+STAGES = ("soap", "decode", "refetch", "parse", "upload", "db")
+
+
+class StageTimer:
+    """Acumulador de tempos e contadores por estágio"""
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = defaultdict(float)
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.counters: Dict[str, int] = defaultdict(int)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - started
+            self.calls[name] += 1
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] += value
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "stages": {
+                name: {"seconds": round(self.seconds[name], 4), "calls": self.calls[name]}
+                for name in self.seconds
+            },
+            "counters": dict(self.counters),
+        }
+
+
+@contextmanager
+def timed(timer: Optional[StageTimer], name: str) -> Iterator[None]:
+    """stage() que não faz nada quando não há timer"""
+    if timer is None:
+        yield
+    else:
+        with timer.stage(name):
+            yield
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Percentil por posição mais próxima (q entre 0 e 100)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
@@ -0,0 +1,71 @@
+"""
+Assinatura XML (XMLDSig) de eventos com signer reaproveitado por certificado
+
+signxml aceita a chave e o certificado em PEM, mas nesse caso desserializa a
+chave privada (com a validação RSA completa) e separa os blocos PEM a cada
+assinatura. CachedSigner guarda a chave já carregada, o certificado já
+preparado para o KeyInfo e a configuração do XMLSigner. Na manifestação em
+lote, cada infEvento custa apenas a canonicalização e a operação RSA.
+
+O cache é por thumbprint do certificado e é descartado junto com o material
+do certificado (CertificateService.invalidate_cache).
+"""
+from typing import Any, Dict, Iterable, List, Optional
+
+from cryptography import x509
+from cryptography.hazmat.primitives.serialization import Encoding
+from lxml import etree
+from signxml import XMLSigner, methods
+
+
+# Parâmetros exigidos pela SEFAZ para assinatura de eventos
+C14N_ALGORITHM = "http://www.w3.org/TR/2001/REC-xml-c14n-20010315"
+DIGEST_ALGORITHM = "sha256"
+SIGNATURE_ALGORITHM = "rsa-sha256"
+
+
+def build_signer() -> XMLSigner:
+    return XMLSigner(
+        method=methods.enveloped,
+        digest_algorithm=DIGEST_ALGORITHM,
+        signature_algorithm=SIGNATURE_ALGORITHM,
+        c14n_algorithm=C14N_ALGORITHM,
+    )
+
+
+class CachedSigner:
+    """Chave, certificado e XMLSigner prontos para assinar vários elementos"""
+
+    def __init__(self, private_key: Any, certificate: x509.Certificate):
+        self.private_key = private_key
+        # Lista de PEM: signxml não refaz o split da cadeia a cada assinatura
+        self.cert_chain: List[str] = [certificate.public_bytes(Encoding.PEM).decode("ascii")]
+        self.signer = build_signer()
+
+    def sign(self, element: etree._Element) -> etree._Element:
+        """Assina o elemento (referência ao próprio Id) e devolve a cópia assinada"""
+        return self.signer.sign(
+            element,
+            key=self.private_key,
+            cert=self.cert_chain,
+            reference_uri=f"#{element.get('Id')}",
+        )
+
+    def sign_many(self, elements: Iterable[etree._Element]) -> List[etree._Element]:
+        return [self.sign(element) for element in elements]
+
+
+_signers: Dict[str, CachedSigner] = {}
+
+
+def get_signer(thumbprint: str, private_key: Any, certificate: x509.Certificate) -> CachedSigner:
+    signer = _signers.get(thumbprint)
+    if signer is None:
+        signer = CachedSigner(private_key, certificate)
+        _signers[thumbprint] = signer
+    return signer
+
+
+def invalidate(thumbprint: Optional[str]) -> None:
+    if thumbprint:
+        _signers.pop(thumbprint, None)
@@ -0,0 +1,98 @@
+"""
+Benchmark do parse de procNFe: ElementTree por consumidor x nfe_xml_parser
+
+"ElementTree" reproduz o caminho antigo: o mesmo XML era aberto com
+ET.fromstring três vezes (chave no decode do docZip, campos da listagem no
+NfeParserService e itens no DANFE), cada campo com uma busca './/tag'.
+"nfe_xml_parser" faz um iterparse por documento; as outras duas leituras são
+acertos do cache por SHA-256.
+
+Uso (a partir de backend/):
+    python -m benchmarks.nfe_xml_parser --docs 500 --items 30
+"""
+import argparse
+import time
+import xml.etree.ElementTree as ET
+
+from app import nfe_xml_parser
+
+NS_NFE = "http://www.portalfiscal.inf.br/nfe"
+NS = f"{{{NS_NFE}}}"
+
+
+def build_proc_nfe(index: int, items: int) -> str:
+    chave = f"5226101122233300018155001{index:09d}1{index:08d}0"
+    dets = "".join(
+        f'<det nItem="{n}"><prod><cProd>P{n:04d}</cProd><cEAN>SEM GTIN</cEAN>'
+        f'<xProd>PRODUTO {n}</xProd><NCM>84713012</NCM><CFOP>5102</CFOP><uCom>UN</uCom>'
+        f'<qCom>1.0000</qCom><vUnCom>10.00</vUnCom><vProd>10.00</vProd></prod>'
+        f'<imposto><ICMS><ICMS00><orig>0</orig><CST>00</CST><vBC>10.00</vBC><pICMS>18.00</pICMS>'
+        f'<vICMS>1.80</vICMS></ICMS00></ICMS></imposto></det>'
+        for n in range(1, items + 1)
+    )
+    return (
+        f'<nfeProc xmlns="{NS_NFE}" versao="4.00"><NFe><infNFe Id="NFe{chave}" versao="4.00">'
+        f'<ide><mod>55</mod><serie>1</serie><nNF>{index}</nNF><natOp>VENDA</natOp><tpNF>1</tpNF>'
+        f'<dhEmi>2026-01-01T10:00:00-03:00</dhEmi></ide>'
+        f'<emit><CNPJ>11222333000181</CNPJ><xNome>EMITENTE</xNome><enderEmit><xLgr>RUA A</xLgr>'
+        f'<nro>1</nro><xBairro>CENTRO</xBairro><xMun>GOIANIA</xMun><UF>GO</UF><CEP>74000000</CEP>'
+        f'</enderEmit><IE>123</IE></emit>'
+        f'<dest><CNPJ>12345678000195</CNPJ><xNome>DESTINATARIO</xNome></dest>{dets}'
+        f'<total><ICMSTot><vBC>{items * 10}.00</vBC><vICMS>{items * 1.8:.2f}</vICMS>'
+        f'<vProd>{items * 10}.00</vProd><vNF>{items * 10}.00</vNF></ICMSTot></total>'
+        f'<transp><modFrete>9</modFrete></transp></infNFe></NFe>'
+        f'<protNFe versao="4.00"><infProt><chNFe>{chave}</chNFe><cStat>100</cStat>'
+        f'<nProt>152260000000001</nProt></infProt></protNFe></nfeProc>'
+    )
+
+
+def legacy(xml: str) -> int:
+    # chave (decode do docZip)
+    root = ET.fromstring(xml)
+    root.find(f'.//{NS}infNFe').get('Id')
+    # campos da listagem
+    root = ET.fromstring(xml)
+    ide = root.find(f'.//{NS}ide')
+    root.find(f'.//{NS}emit')
+    root.find(f'.//{NS}dest')
+    root.find(f'.//{NS}total/{NS}ICMSTot')
+    for tag in ('nNF', 'serie', 'dhEmi'):
+        ide.find(f'{NS}{tag}')
+    # itens do DANFE
+    root = ET.fromstring(xml)
+    return len(root.findall(f'.//{NS}det'))
+
+
+def current(xml: str) -> int:
+    sha256 = nfe_xml_parser.xml_sha256(xml)
+    nfe_xml_parser.parse(xml, sha256=sha256).chave
+    nfe_xml_parser.parse(xml, sha256=sha256).emitente
+    return len(nfe_xml_parser.parse(xml, sha256=sha256).items)
+
+
+def run(docs: int, items: int) -> None:
+    xmls = [build_proc_nfe(i, items) for i in range(docs)]
+    nfe_xml_parser.clear_cache()
+
+    started = time.perf_counter()
+    for xml in xmls:
+        assert legacy(xml) == items
+    elementtree = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for xml in xmls:
+        assert current(xml) == items
+    parser = time.perf_counter() - started
+
+    print(f"Documentos: {docs} ({items} itens cada)")
+    print(f"ElementTree:    {elementtree:.3f}s ({elementtree / docs * 1000:.2f} ms/doc)")
+    print(f"nfe_xml_parser: {parser:.3f}s ({parser / docs * 1000:.2f} ms/doc)")
+    print(f"ganho:          {elementtree / parser:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=500)
+    parser.add_argument("--items", type=int, default=30)
+    args = parser.parse_args()
+    run(args.docs, args.items)
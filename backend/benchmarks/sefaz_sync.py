@@ -0,0 +1,121 @@
+"""
+Benchmark do cliente NFeDistribuicaoDFe contra o simulador local
+
+Percorre todos os NSUs do simulador com SefazDFeClient (mesmo caminho da
+sincronização: pool mTLS, SOAP, decodificação dos docZip) e, opcionalmente,
+resolve os resumos por consChNFe (sujeito ao token bucket de
+NFE_CONSULTA_CHAVE_PER_MINUTE). Não usa banco nem MinIO.
+
+Uso (a partir de backend/, com as variáveis de ambiente da API):
+    uvicorn app.sefaz_simulator:app --port 8085 &
+    python -m benchmarks.sefaz_sync --url http://localhost:8085 --resolve
+
+Com um cassete gravado em produção (SEFAZ_CASSETTE_MODE=record), o mesmo
+percurso roda sem rede, com os payloads e tempos reais:
+    python -m benchmarks.sefaz_sync --replay cassettes/sefaz.jsonl.gz --resolve
+"""
+from datetime import datetime, timedelta
+import argparse
+import asyncio
+import time
+from typing import Optional
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+from app.config import settings
+from app.certificate_cache import CertificateMaterial
+from app.sefaz_http import certificate_fingerprint, close_all
+from app.sync_metrics import StageTimer
+
+
+def self_signed_material(cnpj: str) -> CertificateMaterial:
+    """Certificado A1 descartável (o simulador não valida o mTLS)"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([
+        x509.NameAttribute(NameOID.COMMON_NAME, f"EMPRESA BENCHMARK:{cnpj}"),
+        x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, "GO"),
+    ])
+    now = datetime.utcnow()
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=30))
+        .sign(key, hashes.SHA256())
+    )
+    return CertificateMaterial(
+        thumbprint=certificate_fingerprint(certificate),
+        certificate=certificate,
+        private_key=key,
+    )
+
+
+async def run(url: str, cnpj: str, resolve: bool, concurrency: int, replay: Optional[str], timing: float) -> None:
+    if replay:
+        settings.SEFAZ_CASSETTE_MODE = "replay"
+        settings.SEFAZ_CASSETTE_PATH = replay
+        settings.SEFAZ_CASSETTE_TIMING = timing
+    settings.SEFAZ_DIST_DFE_URL = f"{url.rstrip('/')}/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx"
+
+    # Import tardio: o cliente lê o endpoint de settings na construção
+    from app.sefaz_client import SefazDFeClient
+
+    timer = StageTimer()
+    client = SefazDFeClient(cnpj=cnpj, material=self_signed_material(cnpj), producao=False, timer=timer)
+
+    started = time.perf_counter()
+    ult_nsu, max_nsu, pages = "0", None, 0
+    summaries = []
+    docs = 0
+    while True:
+        response = await client.consultar_distribuicao(ultimo_nsu=ult_nsu)
+        if response.get('status') != 138:
+            break
+        pages += 1
+        docs += len(response['documentos'])
+        summaries.extend(d.chave for d in response['documentos'] if d.schema.startswith('resNFe') and d.chave)
+        ult_nsu, max_nsu = str(response['ult_nsu']), response['max_nsu']
+        if int(ult_nsu) >= int(max_nsu):
+            break
+    dist_seconds = time.perf_counter() - started
+
+    resolve_seconds = 0.0
+    if resolve and summaries:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(chave: str) -> None:
+            async with semaphore:
+                await client.consultar_por_chave(chave)
+
+        resolve_started = time.perf_counter()
+        await asyncio.gather(*(fetch(chave) for chave in summaries))
+        resolve_seconds = time.perf_counter() - resolve_started
+
+    await close_all()
+
+    print("\n==== Benchmark distDFe ====")
+    print(f"Páginas: {pages}  Documentos: {docs}  maxNSU: {max_nsu}")
+    print(f"distNSU: {dist_seconds:.2f}s ({docs / dist_seconds if dist_seconds else 0:.1f} docs/s)")
+    if resolve:
+        rate = len(summaries) / resolve_seconds if resolve_seconds else 0
+        print(f"consChNFe: {len(summaries)} chaves em {resolve_seconds:.2f}s ({rate:.1f} docs/s)")
+    for name, stage in timer.as_dict()["stages"].items():
+        print(f"  {name:<8} {stage['seconds']:>8.3f}s  {stage['calls']} chamadas")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8085", help="URL base do simulador")
+    parser.add_argument("--cnpj", default="12345678000195")
+    parser.add_argument("--resolve", action="store_true", help="Resolve os resumos por consChNFe")
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--replay", help="Cassete .jsonl.gz a reproduzir no lugar do simulador")
+    parser.add_argument("--timing", type=float, default=1.0, help="Multiplicador dos tempos gravados (0 = sem espera)")
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.cnpj, args.resolve, args.concurrency, args.replay, args.timing))
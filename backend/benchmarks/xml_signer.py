@@ -0,0 +1,87 @@
+"""
+Benchmark da assinatura de eventos: signer por chamada x CachedSigner
+
+"por chamada" reproduz o caminho antigo do SefazEventoClient: um XMLSigner
+novo e chave/certificado em PEM a cada infEvento. "cached" usa
+app.xml_signer.CachedSigner (chave desserializada e cadeia preparada uma vez).
+
+Uso (a partir de backend/):
+    python -m benchmarks.xml_signer --events 200
+"""
+from datetime import datetime, timedelta
+import argparse
+import time
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import Encoding, PrivateFormat, NoEncryption
+from cryptography.x509.oid import NameOID
+from lxml import etree
+
+from app.xml_signer import CachedSigner, build_signer
+
+NS_NFE = "http://www.portalfiscal.inf.br/nfe"
+
+
+def self_signed(key_size: int = 2048):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=key_size)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "EMPRESA BENCHMARK:12345678000195")])
+    now = datetime.utcnow()
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=30))
+        .sign(key, hashes.SHA256())
+    )
+    return key, certificate
+
+
+def build_inf_evento(index: int) -> etree._Element:
+    chave = f"5226101122233300018155001{index:09d}1{index:08d}0"
+    env = etree.Element("{%s}envEvento" % NS_NFE, nsmap={None: NS_NFE}, versao="1.00")
+    evento = etree.SubElement(env, "evento", versao="1.00")
+    inf = etree.SubElement(evento, "infEvento", Id=f"ID210210{chave}01")
+    for tag, value in (
+        ("cOrgao", "91"), ("tpAmb", "2"), ("CNPJ", "12345678000195"), ("chNFe", chave),
+        ("dhEvento", "2026-01-01T10:00:00-03:00"), ("tpEvento", "210210"),
+        ("nSeqEvento", "1"), ("verEvento", "1.00"),
+    ):
+        etree.SubElement(inf, tag).text = value
+    det = etree.SubElement(inf, "detEvento", versao="1.00")
+    etree.SubElement(det, "descEvento").text = "Ciencia da Operacao"
+    return inf
+
+
+def run(events: int) -> None:
+    key, certificate = self_signed()
+    key_pem = key.private_bytes(Encoding.PEM, PrivateFormat.TraditionalOpenSSL, NoEncryption())
+    cert_pem = certificate.public_bytes(Encoding.PEM)
+    elements = [build_inf_evento(i) for i in range(events)]
+
+    started = time.perf_counter()
+    for inf in elements:
+        build_signer().sign(inf, key=key_pem, cert=cert_pem, reference_uri=f"#{inf.get('Id')}")
+    per_call = time.perf_counter() - started
+
+    started = time.perf_counter()
+    signer = CachedSigner(key, certificate)
+    cached_signed = signer.sign_many(elements)
+    cached = time.perf_counter() - started
+
+    assert len(cached_signed) == events
+    print(f"Eventos: {events}")
+    print(f"por chamada: {per_call:.3f}s ({per_call / events * 1000:.2f} ms/evento)")
+    print(f"cached:      {cached:.3f}s ({cached / events * 1000:.2f} ms/evento)")
+    print(f"ganho:       {per_call / cached:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=200)
+    args = parser.parse_args()
+    run(args.events)
@@ -0,0 +1,39 @@
+import pytest
+from sqlalchemy import Column, MetaData, Table
+from sqlalchemy.dialects.postgresql import JSONB, UUID
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.ext.compiler import compiles
+
+from app.database import Base
+
+
+@compiles(UUID, "sqlite")
+def _uuid_sqlite(type_, compiler, **kw):
+    return "CHAR(32)"
+
+
+@compiles(JSONB, "sqlite")
+def _jsonb_sqlite(type_, compiler, **kw):
+    return "JSON"
+
+
+def _sqlite_metadata() -> MetaData:
+    """Cópia das tabelas só com as colunas (sem defaults/FKs do PostgreSQL)"""
+    metadata = MetaData()
+    for table in Base.metadata.sorted_tables:
+        Table(
+            table.name, metadata,
+            *(Column(column.name, column.type, primary_key=column.primary_key) for column in table.columns)
+        )
+    return metadata
+
+
+@pytest.fixture
+async def sqlite_db():
+    """AsyncSession em SQLite em memória para testar consultas dos serviços"""
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(_sqlite_metadata().create_all)
+    async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+        yield session
+    await engine.dispose()
@@ -0,0 +1,68 @@
+"""XMLs de exemplo (procNFe, resNFe e eventos) usados pelos testes de parse"""
+
+NS_NFE = "http://www.portalfiscal.inf.br/nfe"
+
+CHAVE = "52260144555666000172550010000012341000012345"
+CNPJ_EMITENTE = "44555666000172"
+CNPJ_EMPRESA = "12345678000195"
+
+PROC_NFE = (
+    f'<nfeProc xmlns="{NS_NFE}" versao="4.00"><NFe><infNFe Id="NFe{CHAVE}" versao="4.00">'
+    '<ide><cUF>52</cUF><natOp>VENDA DE MERCADORIA</natOp><mod>55</mod><serie>1</serie>'
+    '<nNF>1234</nNF><dhEmi>2026-01-15T10:30:00-03:00</dhEmi><dhSaiEnt>2026-01-15T14:00:00-03:00</dhSaiEnt>'
+    '<tpNF>1</tpNF></ide>'
+    f'<emit><CNPJ>{CNPJ_EMITENTE}</CNPJ><xNome>EMITENTE LTDA</xNome><xFant>EMITENTE</xFant>'
+    '<enderEmit><xLgr>RUA A</xLgr><nro>100</nro><xCpl>SALA 2</xCpl><xBairro>CENTRO</xBairro>'
+    '<xMun>GOIANIA</xMun><UF>GO</UF><CEP>74000000</CEP></enderEmit><IE>123456789</IE></emit>'
+    f'<dest><CNPJ>{CNPJ_EMPRESA}</CNPJ><xNome>EMPRESA DESTINATARIA</xNome>'
+    '<enderDest><xLgr>AV B</xLgr><nro>S/N</nro><xBairro>SETOR SUL</xBairro><xMun>ANAPOLIS</xMun>'
+    '<UF>GO</UF><CEP>75000000</CEP></enderDest><IE>987654321</IE></dest>'
+    '<det nItem="1"><prod><cProd>P0001</cProd><cEAN>SEM GTIN</cEAN><xProd>PARAFUSO 6MM</xProd>'
+    '<NCM>73181500</NCM><CFOP>6102</CFOP><uCom>CX</uCom><qCom>12.5000</qCom>'
+    '<vUnCom>3.1234567891</vUnCom><vProd>39.04</vProd></prod>'
+    '<imposto><ICMS><ICMS00><orig>0</orig><CST>00</CST><vBC>39.04</vBC><pICMS>12.00</pICMS>'
+    '<vICMS>4.68</vICMS></ICMS00></ICMS></imposto></det>'
+    '<det nItem="2"><prod><cProd>P0002</cProd><cEAN>7891234567895</cEAN><xProd>PORCA 6MM</xProd>'
+    '<NCM>73181600</NCM><CFOP>6102</CFOP><uCom>UN</uCom><qCom>3.0000</qCom>'
+    '<vUnCom>2.0000000000</vUnCom><vProd>6.00</vProd></prod></det>'
+    '<total><ICMSTot><vBC>39.04</vBC><vICMS>4.68</vICMS><vProd>45.04</vProd><vFrete>5.00</vFrete>'
+    '<vSeg>0.00</vSeg><vDesc>1.00</vDesc><vNF>49.04</vNF></ICMSTot></total>'
+    '<transp><modFrete>1</modFrete></transp></infNFe></NFe>'
+    f'<protNFe versao="4.00"><infProt><tpAmb>1</tpAmb><chNFe>{CHAVE}</chNFe>'
+    '<dhRecbto>2026-01-15T10:31:00-03:00</dhRecbto><nProt>152260000012345</nProt>'
+    '<cStat>100</cStat><xMotivo>Autorizado o uso da NF-e</xMotivo></infProt></protNFe></nfeProc>'
+)
+
+RES_NFE = (
+    f'<resNFe xmlns="{NS_NFE}" versao="1.01"><chNFe>{CHAVE}</chNFe>'
+    f'<CNPJ>{CNPJ_EMITENTE}</CNPJ><xNome>EMITENTE LTDA</xNome><IE>123456789</IE>'
+    '<dhEmi>2026-01-15T10:30:00-03:00</dhEmi><tpNF>1</tpNF><vNF>49.04</vNF>'
+    '<digVal>c2ltdWxhZG8=</digVal><dhRecbto>2026-01-15T10:31:00-03:00</dhRecbto>'
+    '<nProt>152260000012345</nProt><cSitNFe>1</cSitNFe></resNFe>'
+)
+
+
+def res_evento(tp_evento: str = "110111", x_evento: str = "Cancelamento") -> str:
+    return (
+        f'<resEvento xmlns="{NS_NFE}" versao="1.01"><cOrgao>52</cOrgao><CNPJ>{CNPJ_EMITENTE}</CNPJ>'
+        f'<chNFe>{CHAVE}</chNFe><dhEvento>2026-01-16T09:00:00-03:00</dhEvento>'
+        f'<tpEvento>{tp_evento}</tpEvento><nSeqEvento>1</nSeqEvento><xEvento>{x_evento}</xEvento>'
+        '<dhRecbto>2026-01-16T09:00:05-03:00</dhRecbto><nProt>152260000099999</nProt></resEvento>'
+    )
+
+
+def proc_evento(tp_evento: str = "110111", desc_evento: str = "Cancelamento") -> str:
+    return (
+        f'<procEventoNFe xmlns="{NS_NFE}" versao="1.00"><evento versao="1.00">'
+        f'<infEvento Id="ID{tp_evento}{CHAVE}01"><cOrgao>52</cOrgao><tpAmb>1</tpAmb>'
+        f'<CNPJ>{CNPJ_EMITENTE}</CNPJ><chNFe>{CHAVE}</chNFe><dhEvento>2026-01-16T09:00:00-03:00</dhEvento>'
+        f'<tpEvento>{tp_evento}</tpEvento><nSeqEvento>1</nSeqEvento><verEvento>1.00</verEvento>'
+        f'<detEvento versao="1.00"><descEvento>{desc_evento}</descEvento>'
+        '<nProt>152260000012345</nProt><xJust>Erro na emissao da nota fiscal</xJust></detEvento>'
+        '</infEvento></evento>'
+        '<retEvento versao="1.00"><infEvento><tpAmb>1</tpAmb><cOrgao>52</cOrgao><cStat>135</cStat>'
+        f'<xMotivo>Evento registrado e vinculado a NF-e</xMotivo><chNFe>{CHAVE}</chNFe>'
+        f'<tpEvento>{tp_evento}</tpEvento><nSeqEvento>1</nSeqEvento>'
+        '<dhRegEvento>2026-01-16T09:00:05-03:00</dhRegEvento><nProt>152260000099999</nProt>'
+        '</infEvento></retEvento></procEventoNFe>'
+    )
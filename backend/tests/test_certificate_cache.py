@@ -0,0 +1,120 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app import certificate_cache, sefaz_http, xml_signer
+from app.certificate_cache import CertificateMaterial
+from app.certificate_service import CertificateService
+from app.config import settings
+
+
+class Relogio:
+    def __init__(self):
+        self.agora = 1000.0
+
+    def __call__(self):
+        return self.agora
+
+
+@pytest.fixture(autouse=True)
+def cache_vazio(monkeypatch):
+    monkeypatch.setattr(certificate_cache, "_entries", {})
+    monkeypatch.setattr(certificate_cache, "_locks", {})
+    monkeypatch.setattr(settings, "CERT_MATERIAL_CACHE_TTL_SECONDS", 300)
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(certificate_cache.time, "monotonic", relogio)
+    return relogio
+
+
+def material(thumbprint="abc"):
+    return CertificateMaterial(thumbprint=thumbprint, certificate=object(), private_key=object())
+
+
+def test_get_respeita_o_ttl(relogio):
+    cached = material()
+    certificate_cache.put(cached)
+    relogio.agora += 299
+    assert certificate_cache.get("abc") is cached
+    relogio.agora += 1
+    assert certificate_cache.get("abc") is None
+    assert certificate_cache._entries == {}
+
+
+def test_get_sem_thumbprint():
+    certificate_cache.put(material())
+    assert certificate_cache.get(None) is None
+    assert certificate_cache.get("") is None
+    assert certificate_cache.get("outro") is None
+
+
+def test_lock_por_thumbprint():
+    assert certificate_cache.lock_for("abc") is certificate_cache.lock_for("abc")
+    assert certificate_cache.lock_for("abc") is not certificate_cache.lock_for("outro")
+
+
+def test_invalidate_remove_material_e_lock():
+    certificate_cache.put(material())
+    certificate_cache.put(material("outro"))
+    certificate_cache.lock_for("abc")
+    certificate_cache.invalidate("abc")
+    assert certificate_cache.get("abc") is None
+    assert "abc" not in certificate_cache._locks
+    assert certificate_cache.get("outro") is not None
+
+    certificate_cache.invalidate(None)
+    assert certificate_cache.get("outro") is not None
+
+
+async def test_invalidate_cache_descarta_material_signer_e_pool(monkeypatch):
+    certificate_cache.put(material())
+    monkeypatch.setattr(xml_signer, "_signers", {"abc": object(), "outro": object()})
+    pools = []
+
+    async def invalidate(fingerprint):
+        pools.append(fingerprint)
+
+    monkeypatch.setattr(sefaz_http, "invalidate", invalidate)
+    await CertificateService.invalidate_cache("abc")
+
+    assert certificate_cache.get("abc") is None
+    assert list(xml_signer._signers) == ["outro"]
+    assert pools == ["abc"]
+
+
+async def test_carga_concorrente_le_o_pfx_uma_vez(monkeypatch):
+    leituras = []
+
+    def get_object(key):
+        leituras.append(key)
+        return b"pfx"
+
+    service = CertificateService(
+        db=None,
+        storage=SimpleNamespace(get_object=get_object),
+        crypto=SimpleNamespace(decrypt=lambda value: "senha"),
+    )
+    monkeypatch.setattr(CertificateService, "_load_material", staticmethod(lambda pfx_data, password: material()))
+    cert = SimpleNamespace(cert_thumbprint="abc", cert_storage_key="certs/1.pfx", cert_password_enc="x", company_id=1)
+
+    resultados = await asyncio.gather(*(service.get_certificate_material(cert) for _ in range(5)))
+    assert leituras == ["certs/1.pfx"]
+    assert all(resultado is resultados[0] for resultado in resultados)
+    assert certificate_cache.get("abc") is resultados[0]
+
+
+async def test_thumbprint_divergente_nao_entra_no_cache(monkeypatch):
+    service = CertificateService(
+        db=None,
+        storage=SimpleNamespace(get_object=lambda key: b"pfx"),
+        crypto=SimpleNamespace(decrypt=lambda value: "senha"),
+    )
+    monkeypatch.setattr(CertificateService, "_load_material", staticmethod(lambda pfx_data, password: material("novo")))
+    cert = SimpleNamespace(cert_thumbprint="abc", cert_storage_key="certs/1.pfx", cert_password_enc="x", company_id=1)
+
+    assert (await service.get_certificate_material(cert)).thumbprint == "novo"
+    assert certificate_cache._entries == {}
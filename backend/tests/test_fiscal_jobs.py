@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+import uuid
+
+from sqlalchemy import select
+
+from app import fiscal_jobs
+from app.fiscal_jobs import JobProgress, _overall_status, fail_stale_jobs
+from app.models import FiscalJob
+
+
+async def test_fail_stale_jobs_so_ativos_sem_heartbeat_recente(sqlite_db):
+    now = datetime.utcnow()
+    jobs = {
+        "sem_sinal": ("running", now - timedelta(hours=1), now - timedelta(minutes=6)),
+        "vivo": ("running", now - timedelta(hours=1), now - timedelta(minutes=1)),
+        "fila_antiga": ("queued", now - timedelta(minutes=10), None),
+        "fila_nova": ("queued", now - timedelta(minutes=1), None),
+        "terminado": ("success", now - timedelta(hours=1), now - timedelta(hours=1)),
+    }
+    ids = {}
+    for name, (status, created_at, heartbeat_at) in jobs.items():
+        ids[name] = uuid.uuid4()
+        sqlite_db.add(FiscalJob(
+            id=ids[name], kind="nfe_sync", status=status, created_at=created_at, heartbeat_at=heartbeat_at,
+            docs_found=0, docs_imported=0,
+        ))
+    await sqlite_db.commit()
+
+    assert await fail_stale_jobs(sqlite_db) == 2
+
+    sqlite_db.expire_all()
+    rows = {row.id: row for row in (await sqlite_db.execute(select(FiscalJob))).scalars()}
+    status = {name: rows[job_id].status for name, job_id in ids.items()}
+    assert status == {
+        "sem_sinal": "error", "vivo": "running", "fila_antiga": "error", "fila_nova": "queued", "terminado": "success",
+    }
+    assert rows[ids["sem_sinal"]].error_message == "Job interrompido (processo reiniciado)"
+    assert rows[ids["sem_sinal"]].finished_at is not None
+
+
+def test_overall_status():
+    assert _overall_status(["success", "success"]) == "success"
+    assert _overall_status(["success", "error"]) == "partial"
+    assert _overall_status(["partial"]) == "partial"
+    # Empresa com sincronização já em andamento não conta como concluída
+    assert _overall_status(["running", "error"]) == "error"
+    assert _overall_status([]) == "error"
+
+
+async def test_job_progress_grava_o_estado_inteiro(monkeypatch):
+    updates = []
+
+    async def update_job(job_id, **values):
+        updates.append(values)
+
+    monkeypatch.setattr(fiscal_jobs, "_update_job", update_job)
+    progress = JobProgress(uuid.uuid4())
+    await progress.start([1, 2])
+    await progress.record(1, {"status": "success", "docs_found": 5, "docs_imported": 3})
+    await progress.record(2, {"status": "partial", "docs_found": 2, "docs_imported": None})
+
+    assert updates[0]["progress"] == {"1": {"status": "pending"}, "2": {"status": "pending"}}
+    last = updates[-1]
+    assert last["progress"]["1"]["status"] == "success"
+    assert (last["docs_found"], last["docs_imported"]) == (7, 3)
+    assert all("heartbeat_at" in values for values in updates)
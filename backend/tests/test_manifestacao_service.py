@@ -0,0 +1,110 @@
+from types import SimpleNamespace
+
+from app import manifestacao_service, sefaz_evento_client
+from app.manifestacao_service import ManifestacaoService, lote_outcomes
+from app.sefaz_evento_client import SefazEventoClient
+
+NS_NFE = "http://www.portalfiscal.inf.br/nfe"
+CHAVES = [f"5226011122233300018155001000000{n:03d}1000000{n:03d}0" for n in range(1, 5)]
+
+
+def ret_evento(chave, cstat, motivo, protocolo=""):
+    return (
+        f'<retEvento versao="1.00"><infEvento><tpAmb>1</tpAmb><cOrgao>91</cOrgao><cStat>{cstat}</cStat>'
+        f'<xMotivo>{motivo}</xMotivo><chNFe>{chave}</chNFe><tpEvento>210210</tpEvento>'
+        f'<nProt>{protocolo}</nProt></infEvento></retEvento>'
+    )
+
+
+# Lote misto: registrado, duplicado, rejeitado e uma chave sem retEvento
+RET_ENV_EVENTO = (
+    '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body>'
+    f'<nfeResultMsg><retEnvEvento xmlns="{NS_NFE}" versao="1.00"><idLote>1</idLote><tpAmb>1</tpAmb>'
+    '<cOrgao>91</cOrgao><cStat>128</cStat><xMotivo>Lote de evento processado</xMotivo>'
+    + ret_evento(CHAVES[1], "573", "Rejeicao: Duplicidade de evento")
+    + ret_evento(CHAVES[0], "135", "Evento registrado e vinculado a NF-e", "891260000000001")
+    + ret_evento(CHAVES[2], "650", "Rejeicao: Evento de Ciencia da Operacao para NF-e Cancelada")
+    + '</retEnvEvento></nfeResultMsg></soap:Body></soap:Envelope>'
+)
+
+
+async def manifestar(monkeypatch, chaves, response_xml):
+    client = SefazEventoClient.__new__(SefazEventoClient)
+    client.endpoints = None
+    client._build_lote_xml = lambda *args, **kwargs: ""
+    client._build_soap_envelope = lambda payload: ""
+
+    async def call(endpoints, send, hedge=True):
+        return response_xml
+
+    monkeypatch.setattr(sefaz_evento_client.sefaz_endpoints, "call", call)
+    return await client.manifestar_lote(chaves)
+
+
+async def test_lote_misto_mapeia_cada_chave(monkeypatch):
+    response = await manifestar(monkeypatch, CHAVES, RET_ENV_EVENTO)
+    assert lote_outcomes(CHAVES, response) == {
+        CHAVES[0]: ("accepted", "891260000000001", None),
+        CHAVES[1]: ("accepted", "", None),
+        CHAVES[2]: ("sent", "", "650 - Rejeicao: Evento de Ciencia da Operacao para NF-e Cancelada"),
+        CHAVES[3]: ("error", None, "Sem retEvento para a chave"),
+    }
+
+
+def test_lote_rejeitado_marca_todas_as_chaves():
+    response = {"status": 489, "motivo": "Rejeicao: CNPJ invalido", "eventos": {}}
+    assert lote_outcomes(CHAVES[:2], response) == {
+        chave: ("error", None, "Lote rejeitado: 489 - Rejeicao: CNPJ invalido") for chave in CHAVES[:2]
+    }
+
+
+async def _async(value):
+    return value
+
+
+class FakeDb:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def execute(self, stmt):
+        return SimpleNamespace(scalars=lambda: SimpleNamespace(all=lambda: self.docs))
+
+    async def commit(self):
+        pass
+
+
+async def test_resolve_company_reconsulta_chaves_duplicadas(monkeypatch):
+    service = ManifestacaoService.__new__(ManifestacaoService)
+    service.db = FakeDb([SimpleNamespace(chave=chave) for chave in CHAVES])
+    response = await manifestar(monkeypatch, CHAVES, RET_ENV_EVENTO)
+    evento_client = SimpleNamespace(manifestar_lote=lambda lote, tp_evento: _async(response))
+    fetches = []
+
+    async def get_company_and_cert(company_id):
+        return SimpleNamespace(), SimpleNamespace(cnpj="12345678000195")
+
+    async def build_clients(company, cert):
+        return SimpleNamespace(), evento_client
+
+    async def ensure_manifest_record(company_id, chave, tp_evento):
+        return SimpleNamespace(chave=chave)
+
+    async def try_fetch_full(company_id, cnpj, sefaz_client, chave, refresh=False):
+        fetches.append((chave, refresh))
+        return SimpleNamespace() if refresh else None
+
+    async def no_sleep(seconds):
+        pass
+
+    service._get_company_and_cert = get_company_and_cert
+    service._build_clients = build_clients
+    service._ensure_manifest_record = ensure_manifest_record
+    service._try_fetch_full = try_fetch_full
+    monkeypatch.setattr(manifestacao_service.asyncio, "sleep", no_sleep)
+
+    result = await service._resolve_company(1)
+
+    refreshed = [chave for chave, refresh in fetches if refresh]
+    assert refreshed == [CHAVES[0], CHAVES[1]]
+    assert result["resolved"] == 2
+    assert result["still_summary"] == 2
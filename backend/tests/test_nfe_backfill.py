@@ -0,0 +1,85 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.nfe_backfill import (
+    BackfillConflict,
+    check_requested_bounds,
+    contiguous_cursor,
+    split_nsu_range,
+    uncovered_ranges,
+)
+
+
+def faixa(nsu_start, nsu_end, status='done'):
+    return SimpleNamespace(nsu_start=nsu_start, nsu_end=nsu_end, status=status)
+
+
+def test_split_nsu_range_blocos_contiguos():
+    assert split_nsu_range(1, 2500, 1000) == [(1, 1000), (1001, 2000), (2001, 2500)]
+
+
+def test_split_nsu_range_bloco_unico_e_exato():
+    assert split_nsu_range(5, 5, 1000) == [(5, 5)]
+    assert split_nsu_range(1, 2000, 1000) == [(1, 1000), (1001, 2000)]
+
+
+def test_split_nsu_range_vazio_e_chunk_invalido():
+    assert split_nsu_range(10, 9, 1000) == []
+    assert split_nsu_range(1, 3, 0) == [(1, 1), (2, 2), (3, 3)]
+
+
+def test_contiguous_cursor_avanca_sobre_faixas_concluidas():
+    ranges = [faixa(1001, 2000), faixa(101, 1000)]
+    assert contiguous_cursor(100, ranges) == 2000
+
+
+def test_contiguous_cursor_para_no_buraco():
+    # nsu_start explícito além do cursor: 101-499 nunca foram consultados
+    ranges = [faixa(500, 1000), faixa(1001, 2000)]
+    assert contiguous_cursor(100, ranges) == 100
+
+
+def test_contiguous_cursor_para_na_faixa_pendente():
+    ranges = [faixa(101, 1000), faixa(1001, 2000, 'error'), faixa(2001, 3000)]
+    assert contiguous_cursor(100, ranges) == 1000
+
+
+def test_contiguous_cursor_ignora_faixas_antes_do_cursor():
+    ranges = [faixa(1, 50, 'error'), faixa(101, 200)]
+    assert contiguous_cursor(100, ranges) == 200
+    assert contiguous_cursor(500, ranges) == 500
+
+
+def test_uncovered_ranges_pula_faixas_gravadas():
+    ranges = [faixa(101, 200), faixa(301, 400)]
+    assert uncovered_ranges(1, 500, ranges) == [(1, 100), (201, 300), (401, 500)]
+    assert uncovered_ranges(101, 200, ranges) == []
+    assert uncovered_ranges(150, 350, ranges) == [(201, 300)]
+
+
+def test_check_requested_bounds_sem_limites_explicitos():
+    check_requested_bounds([faixa(1, 100, 'pending')], 0, None, None)
+
+
+def test_check_requested_bounds_inicio_maior_que_fim():
+    with pytest.raises(ValueError):
+        check_requested_bounds([], 0, 200, 100)
+
+
+def test_check_requested_bounds_com_faixas_pendentes():
+    with pytest.raises(BackfillConflict):
+        check_requested_bounds([faixa(1, 100, 'pending')], 0, 500, 600)
+
+
+def test_check_requested_bounds_sobreposicao():
+    ranges = [faixa(101, 200)]
+    with pytest.raises(BackfillConflict):
+        check_requested_bounds(ranges, 0, 101, 150)
+    with pytest.raises(BackfillConflict):
+        check_requested_bounds(ranges, 0, 50, None)
+    # nsu_start padrão é last_nsu + 1
+    with pytest.raises(BackfillConflict):
+        check_requested_bounds(ranges, 0, None, 120)
+    check_requested_bounds(ranges, 0, 201, 300)
+    check_requested_bounds(ranges, 200, None, 300)
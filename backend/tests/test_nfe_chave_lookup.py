@@ -0,0 +1,123 @@
+from types import SimpleNamespace
+import uuid
+
+import pytest
+
+from app import nfe_chave_lookup
+from app.config import settings
+from app.models import NfeDocument
+from app.nfe_chave_lookup import ChaveLookup
+from app.sefaz_client import DFeDocument
+from tests.nfe_samples import CHAVE, CNPJ_EMPRESA, PROC_NFE, RES_NFE
+
+OUTRO_CNPJ = "11222333000181"
+
+
+class Relogio:
+    def __init__(self):
+        self.agora = 500.0
+
+    def __call__(self):
+        return self.agora
+
+
+class FakeSefaz:
+    """consultar_por_chave que devolve sempre o mesmo documento"""
+
+    def __init__(self, cnpj=CNPJ_EMPRESA, schema='resNFe_v1.01.xsd', xml=RES_NFE):
+        self.cnpj = cnpj
+        self.schema = schema
+        self.xml = xml
+        self.chamadas = 0
+
+    async def consultar_por_chave(self, chave):
+        self.chamadas += 1
+        doc = DFeDocument(nsu="0", schema=self.schema, chave=chave, tipo_documento="NF-e", xml_content=self.xml)
+        return {'status': 138, 'motivo': 'Documento localizado', 'documentos': [doc], 'falhas': []}
+
+
+@pytest.fixture(autouse=True)
+def cache_settings(monkeypatch):
+    monkeypatch.setattr(settings, "NFE_CHAVE_NEGATIVE_TTL_SECONDS", 60)
+    monkeypatch.setattr(settings, "NFE_CHAVE_CACHE_MAX_ENTRIES", 3)
+    monkeypatch.setattr(nfe_chave_lookup, "_negative", nfe_chave_lookup.OrderedDict())
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(nfe_chave_lookup.time, "monotonic", relogio)
+    return relogio
+
+
+async def consultar(sefaz, chave=CHAVE, refresh=False):
+    return await ChaveLookup(None, None).consultar(sefaz, 1, chave, refresh=refresh, check_stored=False)
+
+
+async def test_resumo_fica_em_cache_ate_o_ttl(relogio):
+    sefaz = FakeSefaz()
+    assert 'cached' not in await consultar(sefaz)
+    relogio.agora += 59
+    assert (await consultar(sefaz))['cached'] == 'negative'
+    assert sefaz.chamadas == 1
+    relogio.agora += 1
+    assert 'cached' not in await consultar(sefaz)
+    assert sefaz.chamadas == 2
+
+
+async def test_refresh_ignora_o_cache_negativo(relogio):
+    sefaz = FakeSefaz()
+    await consultar(sefaz)
+    await consultar(sefaz, refresh=True)
+    assert sefaz.chamadas == 2
+
+
+async def test_cache_negativo_por_certificado(relogio):
+    await consultar(FakeSefaz())
+    outro = FakeSefaz(cnpj=OUTRO_CNPJ)
+    assert 'cached' not in await consultar(outro)
+    assert outro.chamadas == 1
+
+
+async def test_completo_nao_entra_no_cache_e_invalida(relogio):
+    await consultar(FakeSefaz())
+    completo = FakeSefaz(schema='procNFe_v4.00.xsd', xml=PROC_NFE)
+    await consultar(completo, refresh=True)
+    assert nfe_chave_lookup.get_negative(CNPJ_EMPRESA, CHAVE) is None
+    await consultar(completo)
+    assert completo.chamadas == 2
+
+
+async def test_invalidate_todas_as_empresas(relogio):
+    await consultar(FakeSefaz())
+    await consultar(FakeSefaz(cnpj=OUTRO_CNPJ))
+    nfe_chave_lookup.invalidate(CHAVE)
+    assert nfe_chave_lookup.get_negative(CNPJ_EMPRESA, CHAVE) is None
+    assert nfe_chave_lookup.get_negative(OUTRO_CNPJ, CHAVE) is None
+
+
+def test_limite_de_entradas_descarta_as_mais_antigas(relogio):
+    for n in range(3):
+        nfe_chave_lookup.put_negative(CNPJ_EMPRESA, f"chave{n}", {'n': n})
+    # Regravar move a chave para o fim da fila
+    nfe_chave_lookup.put_negative(CNPJ_EMPRESA, "chave0", {'n': 0})
+    nfe_chave_lookup.put_negative(CNPJ_EMPRESA, "chave3", {'n': 3})
+    assert len(nfe_chave_lookup._negative) == 3
+    assert nfe_chave_lookup.get_negative(CNPJ_EMPRESA, "chave1") is None
+    assert nfe_chave_lookup.get_negative(CNPJ_EMPRESA, "chave0") == {'n': 0}
+    assert nfe_chave_lookup.get_negative(CNPJ_EMPRESA, "chave3") == {'n': 3}
+
+
+async def test_xml_gravado_dispensa_a_sefaz(sqlite_db):
+    sqlite_db.add(NfeDocument(
+        id=uuid.uuid4(), company_id=1, chave=CHAVE, nsu="000000000000042", tipo="recebida",
+        situacao="autorizada", xml_kind="full", xml_storage_key="nfe/xml/abc",
+    ))
+    await sqlite_db.commit()
+    storage = SimpleNamespace(get_object=lambda key: PROC_NFE.encode('utf-8'))
+    sefaz = FakeSefaz()
+
+    response = await ChaveLookup(sqlite_db, storage).consultar(sefaz, 1, CHAVE, refresh=True)
+    assert response['cached'] == 'stored'
+    assert response['documentos'][0].xml_content == PROC_NFE
+    assert sefaz.chamadas == 0
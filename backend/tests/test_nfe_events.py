@@ -0,0 +1,117 @@
+from datetime import datetime
+import uuid
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from app import nfe_xml_parser
+from app.models import NfeDocument, NfeEvent
+from app.nfe_events import SITUACAO_POR_EVENTO, apply_situacao, is_event_schema, parse_event
+from app.nfe_ingest import NfeIngestService
+from app.sefaz_client import DFeDocument
+from tests.nfe_samples import CHAVE, proc_evento, res_evento
+
+OUTRA_CHAVE = CHAVE[:-1] + "9"
+
+
+@pytest.fixture(autouse=True)
+def cache_limpo():
+    nfe_xml_parser.clear_cache()
+    yield
+    nfe_xml_parser.clear_cache()
+
+
+def dfe(xml, schema, nsu="000000000000101"):
+    return DFeDocument(nsu=nsu, schema=schema, chave="", tipo_documento="Evento", xml_content=xml)
+
+
+def test_cancelamentos_mudam_a_situacao():
+    assert SITUACAO_POR_EVENTO['110111'] == 'cancelada'
+    assert SITUACAO_POR_EVENTO['110112'] == 'cancelada'
+    # CC-e e ciência da operação só ficam registrados
+    assert '110110' not in SITUACAO_POR_EVENTO
+    assert '210210' not in SITUACAO_POR_EVENTO
+
+
+def test_schemas_de_evento():
+    assert is_event_schema('resEvento_v1.01.xsd')
+    assert is_event_schema('procEventoNFe_v1.00.xsd')
+    assert not is_event_schema('resNFe_v1.01.xsd')
+    assert not is_event_schema(None)
+
+
+def test_parse_res_evento():
+    info = parse_event(dfe(res_evento(), 'resEvento_v1.01.xsd'))
+    assert info.chave == CHAVE
+    assert info.tp_evento == '110111'
+    assert info.n_seq_evento == 1
+    # dhEvento com fuso -03:00 gravado em UTC
+    assert info.dh_evento == datetime(2026, 1, 16, 12, 0)
+    assert info.descricao == 'Cancelamento'
+    assert info.protocolo == '152260000099999'
+    assert (info.nsu, info.schema) == ("000000000000101", 'resEvento_v1.01.xsd')
+
+
+def test_parse_proc_evento_substituicao():
+    info = parse_event(dfe(proc_evento('110112', 'Cancelamento por substituicao'), 'procEventoNFe_v1.00.xsd'))
+    assert info.chave == CHAVE
+    assert info.tp_evento == '110112'
+    assert info.descricao == 'Cancelamento por substituicao'
+    # nProt do retEvento, não o da nota que vem no detEvento
+    assert info.protocolo == '152260000099999'
+    assert SITUACAO_POR_EVENTO[info.tp_evento] == 'cancelada'
+
+
+def test_parse_evento_sem_tipo():
+    xml = res_evento().replace('<tpEvento>110111</tpEvento>', '')
+    with pytest.raises(ValueError):
+        parse_event(dfe(xml, 'resEvento_v1.01.xsd'))
+
+
+def test_upsert_nao_desfaz_situacao_final():
+    # Promoção resumo -> completo: o protNFe diz "autorizado" mesmo depois do cancelamento
+    stmt = NfeIngestService._upsert_statement([{'chave': CHAVE, 'situacao': 'autorizada'}])
+    situacao = dict(stmt._post_values_clause.update_values_to_set)['situacao']
+    assert str(situacao.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})) == (
+        "CASE WHEN (nfe_documents.situacao IN ('cancelada', 'denegada')) "
+        "THEN nfe_documents.situacao ELSE coalesce(excluded.situacao, nfe_documents.situacao) END"
+    )
+
+
+def add_document(db, chave, situacao, company_id=1):
+    db.add(NfeDocument(id=uuid.uuid4(), company_id=company_id, chave=chave, nsu="1", tipo="recebida", situacao=situacao))
+
+
+def add_event(db, chave, tp_evento, company_id=1):
+    db.add(NfeEvent(id=uuid.uuid4(), company_id=company_id, chave=chave, tp_evento=tp_evento, n_seq_evento=1))
+
+
+async def situacoes(db):
+    rows = await db.execute(select(NfeDocument.company_id, NfeDocument.chave, NfeDocument.situacao))
+    return {(row.company_id, row.chave): row.situacao for row in rows}
+
+
+async def test_apply_situacao_cancela_so_notas_com_evento(sqlite_db):
+    add_document(sqlite_db, CHAVE, 'autorizada')
+    add_document(sqlite_db, OUTRA_CHAVE, 'autorizada')
+    add_document(sqlite_db, CHAVE, 'autorizada', company_id=2)
+    add_event(sqlite_db, CHAVE, '110111')
+    add_event(sqlite_db, OUTRA_CHAVE, '110110')
+    await sqlite_db.commit()
+
+    assert await apply_situacao(sqlite_db, 1, [CHAVE, OUTRA_CHAVE]) == 1
+    assert await situacoes(sqlite_db) == {
+        (1, CHAVE): 'cancelada',
+        (1, OUTRA_CHAVE): 'autorizada',
+        (2, CHAVE): 'autorizada',
+    }
+
+
+async def test_apply_situacao_nao_regrava_nota_ja_cancelada(sqlite_db):
+    add_document(sqlite_db, CHAVE, 'cancelada')
+    add_event(sqlite_db, CHAVE, '110112')
+    await sqlite_db.commit()
+
+    assert await apply_situacao(sqlite_db, 1, [CHAVE, CHAVE]) == 0
+    assert await apply_situacao(sqlite_db, 1, []) == 0
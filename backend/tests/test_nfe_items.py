@@ -0,0 +1,57 @@
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from app import nfe_xml_parser
+from app.nfe_items import item_rows
+from tests.nfe_samples import CHAVE, PROC_NFE
+
+AGORA = datetime(2026, 1, 15, 12, 0)
+
+
+@pytest.fixture(autouse=True)
+def cache_limpo():
+    nfe_xml_parser.clear_cache()
+    yield
+    nfe_xml_parser.clear_cache()
+
+
+def test_item_rows_do_proc_nfe():
+    rows = item_rows(1, CHAVE, nfe_xml_parser.parse(PROC_NFE), now=AGORA)
+    assert rows == [
+        {
+            'company_id': 1, 'chave': CHAVE, 'n_item': 1,
+            'codigo_produto': 'P0001', 'ean': 'SEM GTIN', 'descricao': 'PARAFUSO 6MM',
+            'ncm': '73181500', 'cfop': '6102', 'unidade': 'CX',
+            'quantidade': Decimal('12.5000'), 'valor_unitario': Decimal('3.1234567891'),
+            'valor_total': Decimal('39.04'), 'created_at': AGORA,
+        },
+        {
+            'company_id': 1, 'chave': CHAVE, 'n_item': 2,
+            'codigo_produto': 'P0002', 'ean': '7891234567895', 'descricao': 'PORCA 6MM',
+            'ncm': '73181600', 'cfop': '6102', 'unidade': 'UN',
+            'quantidade': Decimal('3.0000'), 'valor_unitario': Decimal('2.0000000000'),
+            'valor_total': Decimal('6.00'), 'created_at': AGORA,
+        },
+    ]
+
+
+def test_item_rows_preserva_casas_decimais():
+    [item, _] = item_rows(1, CHAVE, nfe_xml_parser.parse(PROC_NFE), now=AGORA)
+    # qCom com 4 casas e vUnCom com 10, sem passar por float
+    assert item['quantidade'].as_tuple().exponent == -4
+    assert item['valor_unitario'].as_tuple().exponent == -10
+    assert str(item['valor_unitario']) == '3.1234567891'
+
+
+def test_item_rows_sem_nitem_usa_a_posicao():
+    xml = PROC_NFE.replace('<det nItem="1">', '<det>').replace('<det nItem="2">', '<det nItem="x">')
+    rows = item_rows(1, CHAVE, nfe_xml_parser.parse(xml), now=AGORA)
+    assert [row['n_item'] for row in rows] == [1, 2]
+
+
+def test_item_rows_valor_invalido_vira_nulo():
+    xml = PROC_NFE.replace('<qCom>12.5000</qCom>', '<qCom>12,5</qCom>')
+    [item, _] = item_rows(1, CHAVE, nfe_xml_parser.parse(xml), now=AGORA)
+    assert item['quantidade'] is None
@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import uuid
+
+import pytest
+
+from app.config import settings
+from app.models import NfeNsuFailure
+from app.nfe_nsu_failures import due_failures, failures_from_response, schedule_retry
+from app.sefaz_client import DFeDecodeFailure
+
+
+@pytest.fixture(autouse=True)
+def retry_settings(monkeypatch):
+    monkeypatch.setattr(settings, "NFE_NSU_RETRY_MAX_ATTEMPTS", 8)
+    monkeypatch.setattr(settings, "NFE_NSU_RETRY_BASE_MINUTES", 15)
+
+
+def falha(attempts=0):
+    return SimpleNamespace(attempts=attempts, status='pending', last_error=None, next_attempt_at=None, updated_at=None)
+
+
+def atraso(failure):
+    """Intervalo agendado, medido a partir de updated_at (mesmo instante)"""
+    return failure.next_attempt_at - failure.updated_at
+
+
+def test_schedule_retry_dobra_o_intervalo():
+    failure = falha()
+    atrasos = []
+    for _ in range(4):
+        schedule_retry(failure, "timeout")
+        atrasos.append(atraso(failure))
+    assert atrasos == [timedelta(minutes=15), timedelta(minutes=30), timedelta(minutes=60), timedelta(minutes=120)]
+    assert failure.attempts == 4
+    assert failure.status == 'pending'
+
+
+def test_schedule_retry_limita_a_24h(monkeypatch):
+    monkeypatch.setattr(settings, "NFE_NSU_RETRY_MAX_ATTEMPTS", 20)
+    failure = falha(attempts=10)
+    schedule_retry(failure, "timeout")
+    assert atraso(failure) == timedelta(hours=24)
+
+
+def test_schedule_retry_desiste_no_maximo_de_tentativas():
+    failure = falha(attempts=7)
+    schedule_retry(failure, "x" * 2000)
+    assert failure.attempts == 8
+    assert failure.status == 'abandoned'
+    assert failure.next_attempt_at is None
+    assert len(failure.last_error) == 1000
+
+
+def test_schedule_retry_sem_tentativas_anteriores():
+    failure = falha(attempts=None)
+    schedule_retry(failure, "erro")
+    assert failure.attempts == 1
+
+
+def test_failures_from_response():
+    response = {'falhas': [DFeDecodeFailure(nsu="000000000000007", schema="procNFe_v4.00.xsd", error="gzip inválido")]}
+    [failure] = failures_from_response(response)
+    assert (failure.nsu, failure.stage, failure.error, failure.schema) == (
+        "000000000000007", 'decode', "gzip inválido", "procNFe_v4.00.xsd"
+    )
+    assert failures_from_response({}) == []
+
+
+async def test_due_failures_so_pendentes_vencidas_da_empresa(sqlite_db):
+    now = datetime.utcnow()
+
+    def add(nsu, status='pending', next_attempt_at=now - timedelta(minutes=1), company_id=1):
+        sqlite_db.add(NfeNsuFailure(
+            id=uuid.uuid4(), company_id=company_id, nsu=nsu, stage='decode', status=status,
+            attempts=0, last_error="erro", next_attempt_at=next_attempt_at, created_at=now, updated_at=now,
+        ))
+
+    add(30)
+    add(10)
+    add(20, next_attempt_at=now + timedelta(hours=1))
+    add(40, status='abandoned')
+    add(50, company_id=2)
+    add(60)
+    await sqlite_db.commit()
+
+    assert [failure.nsu for failure in await due_failures(sqlite_db, 1, limit=10)] == [10, 30, 60]
+    assert [failure.nsu for failure in await due_failures(sqlite_db, 1, limit=2)] == [10, 30]
@@ -0,0 +1,49 @@
+import asyncio
+
+from app.nfe_sync_engine import NfeSyncEngine
+
+
+async def test_sync_companies_respeita_o_limite_de_concorrencia(monkeypatch):
+    engine = NfeSyncEngine(max_concurrency=2)
+    ativas = 0
+    pico = 0
+
+    async def sync_one(company_id, sync_type):
+        nonlocal ativas, pico
+        ativas += 1
+        pico = max(pico, ativas)
+        await asyncio.sleep(0.01 * (6 - company_id))
+        ativas -= 1
+        return {'company_id': company_id, 'status': 'success', 'sync_type': sync_type}
+
+    monkeypatch.setattr(engine, "_sync_one", sync_one)
+    results = await engine.sync_companies([1, 2, 3, 4, 5], sync_type="manual")
+
+    assert pico == 2
+    # Resultados na ordem de entrada, não na de término
+    assert [result['company_id'] for result in results] == [1, 2, 3, 4, 5]
+    assert {result['sync_type'] for result in results} == {"manual"}
+
+
+async def test_falha_no_callback_nao_interrompe_as_demais(monkeypatch):
+    engine = NfeSyncEngine(max_concurrency=3)
+    publicados = []
+
+    async def sync_one(company_id, sync_type):
+        return {'company_id': company_id, 'status': 'success'}
+
+    async def on_result(result):
+        if result['company_id'] == 2:
+            raise RuntimeError("fila cheia")
+        publicados.append(result['company_id'])
+
+    monkeypatch.setattr(engine, "_sync_one", sync_one)
+    results = await engine.sync_companies([1, 2, 3], on_result=on_result)
+
+    assert [result['company_id'] for result in results] == [1, 2, 3]
+    assert sorted(publicados) == [1, 3]
+
+
+def test_concorrencia_minima():
+    assert NfeSyncEngine(max_concurrency=0).max_concurrency >= 1
+    assert NfeSyncEngine(max_concurrency=-3).max_concurrency == 1
@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+import uuid
+
+import pytest
+
+from app.config import settings
+from app.models import NfeSyncLog, SefazDfeState
+from app.nfe_sync_policy import compute_sync_delay, count_error_streak, plan_next_sync, sync_log_status
+
+
+@pytest.fixture(autouse=True)
+def policy_settings(monkeypatch):
+    monkeypatch.setattr(settings, "NFE_SYNC_INTERVAL_HOURS", 4)
+    monkeypatch.setattr(settings, "NFE_SYNC_MIN_INTERVAL_MINUTES", 60)
+    monkeypatch.setattr(settings, "NFE_SYNC_MAX_INTERVAL_HOURS", 12)
+    monkeypatch.setattr(settings, "NFE_SYNC_BACKLOG_DELAY_MINUTES", 5)
+    monkeypatch.setattr(settings, "NFE_SYNC_BUSY_DOCS_PER_DAY", 20)
+
+
+def test_consumo_indevido_adia_com_backoff():
+    assert compute_sync_delay('656', 0, 0) == timedelta(hours=4)
+    assert compute_sync_delay('656', 0, 1) == timedelta(hours=4)
+    assert compute_sync_delay('656', 0, 2) == timedelta(hours=8)
+    assert compute_sync_delay('656', 50, 5) == timedelta(hours=12)
+
+
+def test_sequencia_de_erros_dobra_a_partir_do_minimo():
+    assert compute_sync_delay('138', 0, 1) == timedelta(minutes=60)
+    assert compute_sync_delay('138', 0, 3) == timedelta(minutes=240)
+    assert compute_sync_delay('138', 0, 10) == timedelta(hours=12)
+
+
+def test_backlog_volta_logo():
+    assert compute_sync_delay('138', 0, 0, backlog=True) == timedelta(minutes=5)
+    # 137 não tem NSUs pendentes, mesmo com backlog informado
+    assert compute_sync_delay('137', 0, 0, backlog=True) == timedelta(hours=8)
+
+
+def test_empresa_movimentada_usa_o_minimo():
+    assert compute_sync_delay('138', 20, 0) == timedelta(minutes=60)
+
+
+def test_empresa_com_algum_movimento_usa_metade_da_base():
+    assert compute_sync_delay('138', 3, 0) == timedelta(hours=2)
+
+
+def test_empresa_parada_recua():
+    assert compute_sync_delay('137', 0, 0) == timedelta(hours=8)
+    assert compute_sync_delay(None, 0, 0) == timedelta(hours=8)
+
+
+def test_error_streak_conta_so_status_error():
+    assert count_error_streak(['error', 'error', 'success', 'error']) == 2
+    assert count_error_streak([]) == 0
+    # Pulo por cStat=137 recente grava 'partial' com mensagem: não é erro
+    assert count_error_streak(['partial', 'error']) == 0
+
+
+def test_pulo_por_137_recua_como_empresa_parada():
+    streak = count_error_streak(['partial', 'success'])
+    assert compute_sync_delay('137', 0, streak) == timedelta(hours=8)
+
+
+def test_sync_log_status():
+    assert sync_log_status(138, True) == 'success'
+    assert sync_log_status(137, True) == 'success'
+    assert sync_log_status(138, False) == 'partial'
+    assert sync_log_status(656, False) == 'error'
+    assert sync_log_status(589, True) == 'error'
+
+
+async def add_runs(db, last_cstat, runs):
+    """Grava o estado e os logs como _sync_company grava (mais recente por último)"""
+    now = datetime.utcnow()
+    db.add(SefazDfeState(id=uuid.uuid4(), company_id=1, last_nsu="0", last_status="ok", last_cstat=last_cstat))
+    for index, (status, error_message) in enumerate(runs):
+        db.add(NfeSyncLog(
+            id=uuid.uuid4(), company_id=1, sync_type="auto", status=status, error_message=error_message,
+            started_at=now - timedelta(hours=len(runs) - index), finished_at=now,
+            docs_found=0, docs_imported=0, docs_upgraded=0, docs_skipped=0,
+        ))
+    await db.commit()
+    return now
+
+
+async def test_plan_next_sync_656_seguidos_recuam_exponencialmente(sqlite_db):
+    rejeicao = (sync_log_status(656, False), "Rejeicao: Consumo Indevido")
+    now = await add_runs(sqlite_db, "656", [('success', None), rejeicao, rejeicao])
+    assert await plan_next_sync(sqlite_db, 1, now=now) == now + timedelta(hours=8)
+
+
+async def test_plan_next_sync_outra_recusa_usa_backoff_de_erro(sqlite_db):
+    now = await add_runs(sqlite_db, "589", [(sync_log_status(589, False), "Rejeicao: NSU maior que o permitido")])
+    assert await plan_next_sync(sqlite_db, 1, now=now) == now + timedelta(minutes=60)
+
+
+async def test_plan_next_sync_pulo_por_137_nao_conta_como_erro(sqlite_db):
+    now = await add_runs(sqlite_db, "137", [
+        (sync_log_status(137, True), None),
+        ('partial', 'Último cStat=137 há menos de 1h'),
+    ])
+    assert await plan_next_sync(sqlite_db, 1, now=now) == now + timedelta(hours=8)
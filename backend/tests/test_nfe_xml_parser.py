@@ -0,0 +1,170 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app import nfe_xml_parser
+from app.nfe_ingest import document_fields
+from app.services.nfe_pdf_generator import NFePDFGenerator
+from tests.nfe_samples import CHAVE, CNPJ_EMITENTE, CNPJ_EMPRESA, PROC_NFE, RES_NFE, proc_evento, res_evento
+
+DH_EMI = datetime(2026, 1, 15, 10, 30, tzinfo=timezone(timedelta(hours=-3)))
+
+# Saída do NfeParserService.parse_nfe_xml (ElementTree) antes do nfe_xml_parser
+LEGADO_PROC_NFE = {
+    'chave': CHAVE,
+    'numero': '1234',
+    'serie': '1',
+    'data_emissao': DH_EMI,
+    'cnpj_emitente': CNPJ_EMITENTE,
+    'emitente_nome': 'EMITENTE LTDA',
+    'cnpj_destinatario': CNPJ_EMPRESA,
+    'destinatario_nome': 'EMPRESA DESTINATARIA',
+    'valor_total': 49.04,
+    'tipo': 'recebida',
+    'situacao': 'autorizada',
+}
+LEGADO_RES_NFE = {
+    'chave': '',
+    'numero': None,
+    'serie': None,
+    'data_emissao': None,
+    'cnpj_emitente': None,
+    'emitente_nome': None,
+    'cnpj_destinatario': None,
+    'destinatario_nome': None,
+    'valor_total': None,
+    'tipo': 'desconhecida',
+    'situacao': 'autorizada',
+}
+
+# Saída do NFePDFGenerator.parse_xml (ElementTree) antes do nfe_xml_parser
+LEGADO_DANFE = {
+    'chave': CHAVE,
+    'numero': '1234',
+    'serie': '1',
+    'data_emissao': '2026-01-15T10:30:00-03:00',
+    'data_saida': '2026-01-15T14:00:00-03:00',
+    'natureza': 'VENDA DE MERCADORIA',
+    'tipo_nf': 'SAÍDA',
+    'modelo': '55',
+    'emit_cnpj': CNPJ_EMITENTE,
+    'emit_nome': 'EMITENTE LTDA',
+    'emit_fantasia': 'EMITENTE',
+    'emit_endereco': 'RUA A, 100, SALA 2 - CENTRO, GOIANIA/GO - CEP: 74000000',
+    'emit_ie': '123456789',
+    'dest_cnpj': CNPJ_EMPRESA,
+    'dest_nome': 'EMPRESA DESTINATARIA',
+    'dest_endereco': 'AV B, S/N - SETOR SUL, ANAPOLIS/GO - CEP: 75000000',
+    'dest_ie': '987654321',
+    'bc_icms': '39.04',
+    'valor_icms': '4.68',
+    'valor_produtos': '45.04',
+    'valor_frete': '5.00',
+    'valor_seguro': '0.00',
+    'valor_desconto': '1.00',
+    'valor_total': '49.04',
+    'transp_modalidade': 'POR CONTA DO DESTINATÁRIO',
+    'items': [
+        {
+            'codigo': 'P0001', 'descricao': 'PARAFUSO 6MM', 'ncm': '73181500', 'cfop': '6102',
+            'unidade': 'CX', 'quantidade': '12.5000', 'valor_unitario': '3.1234567891', 'valor_total': '39.04',
+        },
+        {
+            'codigo': 'P0002', 'descricao': 'PORCA 6MM', 'ncm': '73181600', 'cfop': '6102',
+            'unidade': 'UN', 'quantidade': '3.0000', 'valor_unitario': '2.0000000000', 'valor_total': '6.00',
+        },
+    ],
+}
+
+
+@pytest.fixture(autouse=True)
+def cache_limpo():
+    nfe_xml_parser.clear_cache()
+    yield
+    nfe_xml_parser.clear_cache()
+
+
+def danfe(xml):
+    # parse_xml não usa os estilos do reportlab montados no __init__
+    return NFePDFGenerator.__new__(NFePDFGenerator).parse_xml(xml)
+
+
+def test_proc_nfe_igual_ao_parser_antigo():
+    assert document_fields(nfe_xml_parser.parse(PROC_NFE), CNPJ_EMPRESA) == LEGADO_PROC_NFE
+
+
+def test_proc_nfe_tipo_em_relacao_a_empresa():
+    parsed = nfe_xml_parser.parse(PROC_NFE)
+    assert parsed.tipo_for(CNPJ_EMITENTE) == 'emitida'
+    assert parsed.tipo_for('12.345.678/0001-95') == 'recebida'
+    assert parsed.tipo_for('99999999000199') == 'desconhecida'
+
+
+def test_proc_nfe_sem_cnpj_do_destinatario_fica_desconhecida():
+    xml = PROC_NFE.replace(f'<CNPJ>{CNPJ_EMPRESA}</CNPJ>', '<CPF>12345678909</CPF>')
+    assert nfe_xml_parser.parse(xml).tipo_for(CNPJ_EMITENTE) == 'desconhecida'
+
+
+def test_res_nfe_preenche_campos_do_resumo():
+    # Diferença intencional: o parser antigo não lia o resumo (só infNFe/emit);
+    # tipo e situação continuam iguais
+    fields = document_fields(nfe_xml_parser.parse(RES_NFE), CNPJ_EMPRESA)
+    assert fields == {
+        **LEGADO_RES_NFE,
+        'chave': CHAVE,
+        'data_emissao': DH_EMI,
+        'cnpj_emitente': CNPJ_EMITENTE,
+        'emitente_nome': 'EMITENTE LTDA',
+        'valor_total': 49.04,
+    }
+
+
+def test_res_nfe_de_terceiro_fica_desconhecida():
+    parsed = nfe_xml_parser.parse(RES_NFE)
+    assert parsed.kind == 'summary'
+    assert parsed.tipo_for(CNPJ_EMPRESA) == 'desconhecida'
+
+
+def test_res_nfe_situacao_pelo_csitnfe():
+    assert nfe_xml_parser.parse(RES_NFE.replace('<cSitNFe>1<', '<cSitNFe>3<')).situacao == 'cancelada'
+    assert nfe_xml_parser.parse(RES_NFE.replace('<cSitNFe>1<', '<cSitNFe>2<')).situacao == 'denegada'
+
+
+def test_res_evento():
+    parsed = nfe_xml_parser.parse(res_evento())
+    assert parsed.kind == 'event'
+    assert parsed.chave == CHAVE
+    [event] = parsed.events
+    assert (event.tp_evento, event.n_seq_evento, event.descricao, event.protocolo) == (
+        '110111', '1', 'Cancelamento', '152260000099999'
+    )
+    assert document_fields(parsed, CNPJ_EMPRESA)['tipo'] == 'desconhecida'
+
+
+def test_proc_evento_usa_protocolo_do_retevento():
+    [event] = nfe_xml_parser.parse(proc_evento()).events
+    # nProt do detEvento é o protocolo da nota cancelada, não do evento
+    assert event.protocolo == '152260000099999'
+    assert event.c_stat == '135'
+    assert event.descricao == 'Cancelamento'
+
+
+def test_danfe_igual_ao_parser_antigo():
+    assert danfe(PROC_NFE) == LEGADO_DANFE
+
+
+def test_danfe_modalidade_de_frete():
+    assert danfe(PROC_NFE.replace('<modFrete>1<', '<modFrete>9<'))['transp_modalidade'] == 'SEM FRETE'
+    # transp sem modFrete não é o mesmo que nota sem transp
+    assert danfe(PROC_NFE.replace('<modFrete>1</modFrete>', ''))['transp_modalidade'] == 'NÃO INFORMADO'
+    sem_transp = PROC_NFE.replace('<transp><modFrete>1</modFrete></transp>', '')
+    assert danfe(sem_transp)['transp_modalidade'] == 'SEM FRETE'
+
+
+def test_xml_invalido():
+    with pytest.raises(ValueError):
+        nfe_xml_parser.parse('<nfeProc><NFe>')
+
+
+def test_parse_memorizado_pelo_sha256():
+    assert nfe_xml_parser.parse(PROC_NFE) is nfe_xml_parser.parse(PROC_NFE.encode('utf-8'))
@@ -0,0 +1,163 @@
+import base64
+import gzip
+import re
+
+import httpx
+import pytest
+
+from app.sefaz_cassette import (
+    CNPJ_PLACEHOLDER,
+    Cassette,
+    CassetteMiss,
+    RecordingTransport,
+    ReplayTransport,
+    replace_cnpj,
+    request_key,
+)
+from tests.nfe_samples import CHAVE, CNPJ_EMITENTE, CNPJ_EMPRESA, NS_NFE, PROC_NFE
+
+URL = "https://nfe.sefaz.example/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx"
+PATH = "/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx"
+OUTRA_EMPRESA = "98765432000198"
+
+
+def dist_nsu(cnpj, ult_nsu="000000000000100"):
+    return (
+        '<soap12:Envelope xmlns:soap12="http://www.w3.org/2003/05/soap-envelope"><soap12:Body>'
+        f'<nfeDistDFeInteresse><nfeDadosMsg><distDFeInt xmlns="{NS_NFE}" versao="1.01">'
+        f'<tpAmb>1</tpAmb><cUFAutor>52</cUFAutor><CNPJ>{cnpj}</CNPJ>'
+        f'<distNSU><ultNSU>{ult_nsu}</ultNSU></distNSU></distDFeInt></nfeDadosMsg></nfeDistDFeInteresse>'
+        '</soap12:Body></soap12:Envelope>'
+    ).encode()
+
+
+def doc_zip(xml):
+    return base64.b64encode(gzip.compress(xml.encode())).decode()
+
+
+def ret_dist(cnpj):
+    xml = PROC_NFE.replace(CNPJ_EMPRESA, cnpj)
+    return (
+        '<soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope"><soap:Body>'
+        f'<retDistDFeInt xmlns="{NS_NFE}" versao="1.01"><tpAmb>1</tpAmb><cStat>138</cStat>'
+        '<xMotivo>Documento localizado</xMotivo><ultNSU>000000000000101</ultNSU><maxNSU>000000000000101</maxNSU>'
+        f'<loteDistDFeInt><docZip NSU="000000000000101" schema="procNFe_v4.00.xsd">{doc_zip(xml)}</docZip>'
+        '</loteDistDFeInt></retDistDFeInt></soap:Body></soap:Envelope>'
+    ).encode()
+
+
+def doc_zips(body):
+    return [
+        gzip.decompress(base64.b64decode(data))
+        for data in re.findall(rb"<docZip[^>]*>([^<]+)</docZip>", body)
+    ]
+
+
+def sem_doczip(body):
+    # O docZip é recomprimido na troca do CNPJ: o gzip muda, o XML não
+    return re.sub(rb"(<docZip[^>]*>)[^<]+", rb"\1", body)
+
+
+async def post(transport, body):
+    async with httpx.AsyncClient(transport=transport) as client:
+        return await client.post(URL, content=body)
+
+
+def test_replace_cnpj_dentro_do_doczip():
+    body = replace_cnpj(ret_dist(CNPJ_EMPRESA), CNPJ_EMPRESA.encode(), CNPJ_PLACEHOLDER)
+    assert CNPJ_EMPRESA.encode() not in body
+    [xml] = doc_zips(body)
+    assert CNPJ_EMPRESA.encode() not in xml
+    assert b"<dest><CNPJ>" + CNPJ_PLACEHOLDER + b"</CNPJ>" in xml
+    # O emitente não é o certificado: fica como está
+    assert b"<emit><CNPJ>" + CNPJ_EMITENTE.encode() + b"</CNPJ>" in xml
+
+
+def test_request_key_consultas():
+    assert request_key(PATH, dist_nsu(CNPJ_EMPRESA)) == f"{PATH} distNSU 000000000000100"
+    assert request_key(PATH, b"<consChNFe><chNFe>" + CHAVE.encode() + b"</chNFe></consChNFe>") == (
+        f"{PATH} consChNFe {CHAVE}"
+    )
+    # CNPJ e demais campos não entram na chave de consultas
+    assert request_key(PATH, dist_nsu(CNPJ_EMPRESA)) == request_key(PATH, dist_nsu(OUTRA_EMPRESA))
+    assert request_key(PATH, dist_nsu(CNPJ_EMPRESA)) != request_key(PATH, dist_nsu(CNPJ_EMPRESA, "000000000000101"))
+
+
+def test_request_key_eventos_ignora_data_e_ordem_das_chaves():
+    outra_chave = CHAVE[:-1] + "9"
+
+    def lote(chaves, dh_evento):
+        return "".join(
+            f"<evento><infEvento><chNFe>{chave}</chNFe><dhEvento>{dh_evento}</dhEvento>"
+            "<tpEvento>210210</tpEvento></infEvento><Signature>abc</Signature></evento>"
+            for chave in chaves
+        ).encode()
+
+    key = request_key(PATH, lote([CHAVE, outra_chave], "2026-01-01T10:00:00-03:00"))
+    assert key == request_key(PATH, lote([outra_chave, CHAVE], "2026-02-01T08:00:00-03:00"))
+    assert key == f"{PATH} evento 210210 {','.join(sorted([CHAVE, outra_chave]))}"
+    assert request_key(PATH, b"<outra/>").startswith(f"{PATH} ")
+
+
+async def test_grava_e_reproduz_com_outro_cnpj(tmp_path):
+    path = tmp_path / "sefaz.jsonl.gz"
+    recebidas = []
+
+    def sefaz(request):
+        recebidas.append(request.content)
+        return httpx.Response(200, headers={"content-type": "application/soap+xml"}, content=ret_dist(CNPJ_EMPRESA))
+
+    gravada = await post(RecordingTransport(httpx.MockTransport(sefaz), Cassette(str(path))), dist_nsu(CNPJ_EMPRESA))
+    # Durante a gravação o cliente recebe a resposta real
+    assert recebidas == [dist_nsu(CNPJ_EMPRESA)]
+    assert gravada.content == ret_dist(CNPJ_EMPRESA)
+
+    arquivo = gzip.decompress(path.read_bytes())
+    assert CNPJ_EMPRESA.encode() not in arquivo
+    assert CNPJ_PLACEHOLDER in arquivo
+    [interacao] = Cassette(str(path))._load()[f"{PATH} distNSU 000000000000100"]
+    assert interacao["status_code"] == 200
+    for xml in doc_zips(interacao["response_body"].encode()):
+        assert CNPJ_EMPRESA.encode() not in xml
+        assert CNPJ_PLACEHOLDER in xml
+
+    replay = ReplayTransport(Cassette(str(path)), timing=0)
+    reproduzida = await post(replay, dist_nsu(OUTRA_EMPRESA))
+    assert reproduzida.status_code == 200
+    assert reproduzida.headers["content-type"] == "application/soap+xml"
+    assert sem_doczip(reproduzida.content) == sem_doczip(ret_dist(OUTRA_EMPRESA))
+    [xml] = doc_zips(reproduzida.content)
+    assert xml == PROC_NFE.replace(CNPJ_EMPRESA, OUTRA_EMPRESA).encode()
+
+
+async def test_replay_sem_gravacao(tmp_path):
+    path = tmp_path / "sefaz.jsonl.gz"
+    cassette = Cassette(str(path))
+    cassette.append({"key": f"{PATH} distNSU 000000000000100", "status_code": 200, "elapsed": 0, "response_body": ""})
+    with pytest.raises(CassetteMiss):
+        await post(ReplayTransport(Cassette(str(path)), timing=0), dist_nsu(CNPJ_EMPRESA, "000000000000555"))
+
+
+async def test_replay_consome_na_ordem_e_repete_a_ultima(tmp_path):
+    path = tmp_path / "sefaz.jsonl.gz"
+    cassette = Cassette(str(path))
+    for n in range(2):
+        cassette.append({
+            "key": f"{PATH} distNSU 000000000000100", "status_code": 200, "elapsed": 0,
+            "content_type": "text/xml", "response_body": f"<r>{n}</r>",
+        })
+    replay = ReplayTransport(Cassette(str(path)), timing=0)
+    corpos = [(await post(replay, dist_nsu(CNPJ_EMPRESA))).text for _ in range(3)]
+    assert corpos == ["<r>0</r>", "<r>1</r>", "<r>1</r>"]
+
+
+async def test_falha_de_rede_gravada_e_reproduzida(tmp_path):
+    path = tmp_path / "sefaz.jsonl.gz"
+
+    def sefaz(request):
+        raise httpx.ConnectTimeout("timeout", request=request)
+
+    with pytest.raises(httpx.ConnectTimeout):
+        await post(RecordingTransport(httpx.MockTransport(sefaz), Cassette(str(path))), dist_nsu(CNPJ_EMPRESA))
+    with pytest.raises(httpx.ConnectTimeout):
+        await post(ReplayTransport(Cassette(str(path)), timing=0), dist_nsu(OUTRA_EMPRESA))
@@ -0,0 +1,204 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app import sefaz_endpoints
+from app.config import settings
+from app.sefaz_endpoints import EndpointHealth, SefazHttpError, SefazUnavailable
+
+URL_A = "https://a.sefaz.example/ws"
+URL_B = "https://b.sefaz.example/ws"
+
+
+class Relogio:
+    def __init__(self):
+        self.agora = 1000.0
+
+    def __call__(self):
+        return self.agora
+
+
+@pytest.fixture(autouse=True)
+def endpoints_settings(monkeypatch):
+    monkeypatch.setattr(settings, "SEFAZ_CIRCUIT_FAILURE_THRESHOLD", 3)
+    monkeypatch.setattr(settings, "SEFAZ_CIRCUIT_ERROR_RATE", 0.5)
+    monkeypatch.setattr(settings, "SEFAZ_CIRCUIT_COOLDOWN_SECONDS", 30)
+    monkeypatch.setattr(settings, "SEFAZ_RETRY_ATTEMPTS", 3)
+    monkeypatch.setattr(settings, "SEFAZ_RETRY_BASE_SECONDS", 0.5)
+    monkeypatch.setattr(settings, "SEFAZ_RETRY_MAX_SECONDS", 4)
+    monkeypatch.setattr(settings, "SEFAZ_HEDGE_AFTER_SECONDS", 0)
+    monkeypatch.setattr(sefaz_endpoints, "_health", {})
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(sefaz_endpoints.time, "monotonic", relogio)
+    return relogio
+
+
+@pytest.fixture
+def sem_espera(monkeypatch):
+    esperas = []
+
+    async def sleep(seconds):
+        esperas.append(seconds)
+
+    monkeypatch.setattr(sefaz_endpoints.asyncio, "sleep", sleep)
+    return esperas
+
+
+def test_circuito_abre_com_falhas_seguidas(relogio):
+    entry = EndpointHealth(URL_A)
+    for _ in range(2):
+        entry.record_failure(1.0, httpx.ConnectError("recusada"))
+    assert entry.state == "closed" and entry.available()
+    entry.record_failure(1.0, httpx.ConnectError("recusada"))
+    assert entry.state == "open"
+    assert not entry.available()
+
+
+def test_circuito_meio_aberto_depois_do_cooldown(relogio):
+    entry = EndpointHealth(URL_A)
+    for _ in range(3):
+        entry.record_failure(1.0, httpx.ConnectError("recusada"))
+    relogio.agora += 29
+    assert not entry.available()
+    relogio.agora += 1
+    assert entry.available()
+    assert entry.state == "half_open"
+    # Uma única chamada de teste por vez
+    entry.probe_in_flight = True
+    assert not entry.available()
+
+
+def test_meio_aberto_fecha_com_sucesso(relogio):
+    entry = EndpointHealth(URL_A)
+    for _ in range(3):
+        entry.record_failure(1.0, httpx.ConnectError("recusada"))
+    relogio.agora += 30
+    assert entry.available()
+    entry.record_success(0.2)
+    assert entry.state == "closed"
+    assert entry.consecutive_failures == 0
+
+
+def test_meio_aberto_reabre_na_primeira_falha(relogio):
+    entry = EndpointHealth(URL_A)
+    for _ in range(3):
+        entry.record_failure(1.0, httpx.ConnectError("recusada"))
+    relogio.agora += 30
+    assert entry.available()
+    entry.record_failure(1.0, httpx.ConnectError("recusada"))
+    assert entry.state == "open"
+    assert entry.opened_at == relogio.agora
+
+
+def test_taxa_de_erro_so_abre_com_amostras_minimas(relogio, monkeypatch):
+    monkeypatch.setattr(settings, "SEFAZ_CIRCUIT_FAILURE_THRESHOLD", 100)
+    entry = EndpointHealth(URL_A)
+    # Falhas e sucessos alternados: sem falhas seguidas, 50% de erro
+    for _ in range(4):
+        entry.record_failure(1.0, httpx.ReadTimeout("timeout"))
+        entry.record_success(0.1)
+    entry.record_failure(1.0, httpx.ReadTimeout("timeout"))
+    assert len(entry.outcomes) == sefaz_endpoints.MIN_SAMPLES - 1
+    assert entry.state == "closed"
+    entry.record_success(0.1)
+    entry.record_failure(1.0, httpx.ReadTimeout("timeout"))
+    assert entry.error_rate() >= 0.5
+    assert entry.state == "open"
+
+
+def test_latencia_media_ewma():
+    entry = EndpointHealth(URL_A)
+    entry.record_success(1.0)
+    assert entry.latency_ewma == 1.0
+    entry.record_success(2.0)
+    assert entry.latency_ewma == pytest.approx(0.2 * 2.0 + 0.8 * 1.0)
+    entry.record_failure(6.0, httpx.ReadTimeout("timeout"))
+    assert entry.latency_ewma == pytest.approx(0.2 * 6.0 + 0.8 * 1.2)
+
+
+def test_backoff_exponencial_limitado(monkeypatch):
+    monkeypatch.setattr(sefaz_endpoints.random, "uniform", lambda low, high: high)
+    assert [sefaz_endpoints.backoff_delay(n) for n in range(5)] == [0.5, 1.0, 2.0, 4, 4]
+
+
+def test_erros_transitorios():
+    assert sefaz_endpoints.is_retryable(httpx.ConnectError("recusada"))
+    assert sefaz_endpoints.is_retryable(asyncio.TimeoutError())
+    assert sefaz_endpoints.is_retryable(SefazHttpError(503, "indisponivel"))
+    assert not sefaz_endpoints.is_retryable(SefazHttpError(403, "proibido"))
+    assert not sefaz_endpoints.is_retryable(ValueError("xml"))
+
+
+async def test_call_repete_falha_transitoria(sem_espera):
+    chamadas = []
+
+    async def send(url):
+        chamadas.append(url)
+        if len(chamadas) < 3:
+            raise SefazHttpError(502, "bad gateway")
+        return "ok"
+
+    assert await sefaz_endpoints.call([URL_A], send) == "ok"
+    assert len(chamadas) == 3
+    assert len(sem_espera) == 2
+
+
+async def test_call_nao_repete_erro_do_cliente(sem_espera):
+    chamadas = []
+
+    async def send(url):
+        chamadas.append(url)
+        raise SefazHttpError(400, "requisicao invalida")
+
+    with pytest.raises(SefazHttpError):
+        await sefaz_endpoints.call([URL_A], send)
+    assert len(chamadas) == 1
+    # 4xx: o endpoint respondeu
+    assert sefaz_endpoints.health(URL_A).consecutive_failures == 0
+
+
+async def test_call_troca_de_endpoint_com_circuito_aberto(sem_espera):
+    chamadas = []
+
+    async def send(url):
+        chamadas.append(url)
+        if url == URL_A:
+            raise httpx.ConnectError("recusada")
+        return url
+
+    for _ in range(3):
+        sefaz_endpoints.health(URL_A).record_failure(1.0, httpx.ConnectError("recusada"))
+    assert await sefaz_endpoints.call([URL_A, URL_B], send) == URL_B
+    assert chamadas == [URL_B]
+
+
+async def test_call_com_todos_os_circuitos_abertos(sem_espera):
+    async def send(url):
+        return url
+
+    for _ in range(3):
+        sefaz_endpoints.health(URL_A).record_failure(1.0, httpx.ConnectError("recusada"))
+    with pytest.raises(SefazUnavailable):
+        await sefaz_endpoints.call([URL_A], send)
+
+
+async def test_hedge_so_com_segundo_endpoint(monkeypatch):
+    monkeypatch.setattr(settings, "SEFAZ_HEDGE_AFTER_SECONDS", 0.01)
+    chamadas = []
+
+    async def send(url):
+        chamadas.append(url)
+        await asyncio.sleep(0.05)
+        return url
+
+    assert await sefaz_endpoints.call([URL_A], send) == URL_A
+    assert chamadas == [URL_A]
+
+    chamadas.clear()
+    assert await sefaz_endpoints.call([URL_A, URL_B], send) in (URL_A, URL_B)
+    assert sorted(chamadas) == [URL_A, URL_B]
@@ -0,0 +1,104 @@
+import pytest
+
+from app import sefaz_rate_limiter
+from app.config import settings
+from app.sefaz_rate_limiter import TokenBucket
+
+
+class Relogio:
+    """time.monotonic() falso; sleep() avança o relógio em vez de esperar"""
+
+    def __init__(self):
+        self.agora = 100.0
+        self.esperas = []
+
+    def __call__(self):
+        return self.agora
+
+    async def sleep(self, seconds):
+        self.esperas.append(seconds)
+        self.agora += seconds
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(sefaz_rate_limiter.time, "monotonic", relogio)
+    monkeypatch.setattr(sefaz_rate_limiter.asyncio, "sleep", relogio.sleep)
+    return relogio
+
+
+@pytest.fixture(autouse=True)
+def buckets_limpos(monkeypatch):
+    monkeypatch.setattr(sefaz_rate_limiter, "_buckets", {})
+
+
+async def test_rajada_inicial_sem_espera(relogio):
+    bucket = TokenBucket(rate_per_minute=60, burst=5)
+    for _ in range(5):
+        await bucket.acquire()
+    assert relogio.esperas == []
+
+
+async def test_sem_fichas_espera_a_reposicao(relogio):
+    bucket = TokenBucket(rate_per_minute=30, burst=2)
+    await bucket.acquire()
+    await bucket.acquire()
+    await bucket.acquire()
+    # 30/min = uma ficha a cada 2s
+    assert relogio.esperas == [pytest.approx(2.0)]
+    assert relogio.agora == pytest.approx(102.0)
+
+
+async def test_reposicao_proporcional_ao_tempo(relogio):
+    bucket = TokenBucket(rate_per_minute=60, burst=10)
+    for _ in range(10):
+        await bucket.acquire()
+    relogio.agora += 2.5
+    bucket._refill()
+    assert bucket._tokens == pytest.approx(2.5)
+    await bucket.acquire()
+    await bucket.acquire()
+    assert relogio.esperas == []
+    await bucket.acquire()
+    assert relogio.esperas == [pytest.approx(0.5)]
+
+
+async def test_reposicao_limitada_a_capacidade(relogio):
+    bucket = TokenBucket(rate_per_minute=60, burst=3)
+    await bucket.acquire()
+    relogio.agora += 3600
+    bucket._refill()
+    assert bucket._tokens == 3
+    for _ in range(3):
+        await bucket.acquire()
+    assert relogio.esperas == []
+    await bucket.acquire()
+    assert relogio.esperas == [pytest.approx(1.0)]
+
+
+def test_parametros_minimos():
+    bucket = TokenBucket(rate_per_minute=0, burst=0)
+    assert bucket.capacity == 1
+    assert bucket.rate > 0
+
+
+async def test_bucket_por_tipo_e_cnpj(relogio, monkeypatch):
+    monkeypatch.setattr(settings, "NFE_CONSULTA_CHAVE_PER_MINUTE", 60)
+    monkeypatch.setattr(settings, "NFE_CONSULTA_CHAVE_BURST", 1)
+    monkeypatch.setattr(settings, "NFE_BACKFILL_REQUESTS_PER_MINUTE", 60)
+    monkeypatch.setattr(settings, "NFE_BACKFILL_BURST", 1)
+
+    chave_a = sefaz_rate_limiter.consulta_chave_limiter("11222333000181")
+    assert sefaz_rate_limiter.consulta_chave_limiter("11222333000181") is chave_a
+    chave_b = sefaz_rate_limiter.consulta_chave_limiter("12345678000195")
+    backfill_a = sefaz_rate_limiter.backfill_limiter("11222333000181")
+    assert len({id(chave_a), id(chave_b), id(backfill_a)}) == 3
+
+    # Esgotar o bucket de um (tipo, CNPJ) não atrasa os outros
+    await chave_a.acquire()
+    await chave_b.acquire()
+    await backfill_a.acquire()
+    assert relogio.esperas == []
+    await chave_a.acquire()
+    assert relogio.esperas == [pytest.approx(1.0)]
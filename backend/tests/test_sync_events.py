@@ -0,0 +1,63 @@
+import json
+from datetime import datetime
+
+from app.sync_events import SyncEventBus, format_sse
+
+
+def drain(queue):
+    events = []
+    while not queue.empty():
+        events.append(queue.get_nowait())
+    return events
+
+
+def test_sem_inscritos_nao_publica():
+    bus = SyncEventBus()
+    assert not bus.has_subscribers(1)
+    bus.publish(1, "page_fetched", page=1)
+
+
+def test_fila_cheia_descarta_os_mais_antigos():
+    bus = SyncEventBus(queue_size=3)
+    with bus.subscribe(1) as queue:
+        for page in range(1, 6):
+            bus.publish(1, "page_fetched", page=page)
+        assert queue.qsize() == 3
+        assert [event["page"] for event in drain(queue)] == [3, 4, 5]
+
+
+def test_inscrito_lento_nao_afeta_os_outros():
+    bus = SyncEventBus(queue_size=2)
+    with bus.subscribe(1) as lento, bus.subscribe(None) as todas:
+        bus.publish(1, "page_fetched", page=1)
+        bus.publish(1, "page_fetched", page=2)
+        assert [event["page"] for event in drain(todas)] == [1, 2]
+        bus.publish(1, "page_fetched", page=3)
+        assert [event["page"] for event in drain(lento)] == [2, 3]
+        assert [event["page"] for event in drain(todas)] == [3]
+
+
+def test_filtra_por_empresa():
+    bus = SyncEventBus()
+    with bus.subscribe(1) as empresa_1, bus.subscribe(None) as todas:
+        bus.publish(2, "sync_started")
+        assert empresa_1.empty()
+        [event] = drain(todas)
+        assert event["company_id"] == 2
+        assert event["event"] == "sync_started"
+
+
+def test_sair_remove_o_inscrito():
+    bus = SyncEventBus()
+    with bus.subscribe(1):
+        assert bus.has_subscribers(1)
+    assert not bus.has_subscribers(1)
+    assert bus._subscribers == {}
+
+
+def test_format_sse():
+    payload = {"event": "doc_stored", "company_id": 1, "ts": datetime(2026, 1, 1, 12, 0)}
+    text = format_sse(payload)
+    assert text.startswith("event: doc_stored\ndata: ")
+    assert text.endswith("\n\n")
+    assert json.loads(text.split("data: ", 1)[1]) == {"event": "doc_stored", "company_id": 1, "ts": "2026-01-01 12:00:00"}
@@ -0,0 +1,100 @@
+import pytest
+
+from app import sync_lease
+from app.sync_lease import LEASE_SCOPES, LeaseUnavailable, company_lease
+
+
+class Result:
+    def __init__(self, value):
+        self.value = value
+
+    def scalar(self):
+        return self.value
+
+
+class FakeConnection:
+    """Conexão que registra os comandos; o lock fica em um dicionário compartilhado"""
+
+    def __init__(self, locks, fail_unlock=False):
+        self.locks = locks
+        self.fail_unlock = fail_unlock
+        self.isolation_level = None
+        self.invalidated = False
+
+    async def execution_options(self, isolation_level):
+        self.isolation_level = isolation_level
+        return self
+
+    async def execute(self, statement, params):
+        key = (params["classid"], params["company_id"])
+        if "pg_try_advisory_lock" in str(statement):
+            if key in self.locks:
+                return Result(False)
+            self.locks[key] = self
+            return Result(True)
+        if self.fail_unlock:
+            raise ConnectionError("conexão perdida")
+        self.locks.pop(key, None)
+        return Result(True)
+
+    async def invalidate(self):
+        self.invalidated = True
+
+
+class FakeEngine:
+    def __init__(self, fail_unlock=False):
+        self.locks = {}
+        self.fail_unlock = fail_unlock
+        self.connections = []
+
+    def connect(self):
+        engine = self
+
+        class Connect:
+            async def __aenter__(self):
+                conn = FakeConnection(engine.locks, engine.fail_unlock)
+                engine.connections.append(conn)
+                return conn
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return Connect()
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    engine = FakeEngine()
+    monkeypatch.setattr(sync_lease, "engine", engine)
+    return engine
+
+
+async def test_segundo_lease_da_mesma_empresa_falha(engine):
+    async with company_lease(1):
+        assert engine.locks == {(LEASE_SCOPES["nfe_sync"], 1): engine.connections[0]}
+        with pytest.raises(LeaseUnavailable) as exc:
+            async with company_lease(1):
+                pass
+        assert (exc.value.scope, exc.value.company_id) == ("nfe_sync", 1)
+        # Outra empresa e outro escopo da mesma empresa não concorrem
+        async with company_lease(2), company_lease(1, scope="nfe_manifest"):
+            pass
+    assert engine.locks == {}
+    assert all(conn.isolation_level == "AUTOCOMMIT" for conn in engine.connections)
+
+
+async def test_libera_o_lease_quando_o_corpo_falha(engine):
+    with pytest.raises(RuntimeError):
+        async with company_lease(1):
+            raise RuntimeError("erro na sincronização")
+    assert engine.locks == {}
+    async with company_lease(1):
+        pass
+
+
+async def test_falha_ao_liberar_invalida_a_conexao(monkeypatch):
+    engine = FakeEngine(fail_unlock=True)
+    monkeypatch.setattr(sync_lease, "engine", engine)
+    async with company_lease(1):
+        pass
+    assert engine.connections[0].invalidated
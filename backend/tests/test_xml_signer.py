@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import Encoding
+from cryptography.x509.oid import NameOID
+from lxml import etree
+import pytest
+from signxml import XMLVerifier
+
+from app import xml_signer
+from tests.nfe_samples import CHAVE, NS_NFE
+
+
+@pytest.fixture(autouse=True)
+def sem_signers(monkeypatch):
+    monkeypatch.setattr(xml_signer, "_signers", {})
+
+
+@pytest.fixture(scope="module")
+def certificado():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "EMPRESA TESTE:12345678000195")])
+    now = datetime.utcnow()
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=30))
+        .sign(key, hashes.SHA256())
+    )
+    return key, cert
+
+
+def inf_evento(seq):
+    return etree.fromstring(
+        f'<infEvento xmlns="{NS_NFE}" Id="ID210210{CHAVE}0{seq}"><chNFe>{CHAVE}</chNFe>'
+        f'<tpEvento>210210</tpEvento><nSeqEvento>{seq}</nSeqEvento></infEvento>'
+    )
+
+
+def test_get_signer_reaproveita_por_thumbprint(certificado):
+    key, cert = certificado
+    signer = xml_signer.get_signer("abc", key, cert)
+    assert xml_signer.get_signer("abc", key, cert) is signer
+    assert xml_signer.get_signer("outro", key, cert) is not signer
+
+    xml_signer.invalidate("abc")
+    assert xml_signer.get_signer("abc", key, cert) is not signer
+    xml_signer.invalidate(None)
+    assert set(xml_signer._signers) == {"abc", "outro"}
+
+
+def test_sign_many_assina_cada_evento(certificado):
+    key, cert = certificado
+    signer = xml_signer.get_signer("abc", key, cert)
+    assinados = signer.sign_many([inf_evento(1), inf_evento(2)])
+
+    pem = cert.public_bytes(Encoding.PEM)
+    for seq, assinado in enumerate(assinados, start=1):
+        signed_xml = XMLVerifier().verify(assinado, x509_cert=pem).signed_xml
+        assert signed_xml.get("Id") == f"ID210210{CHAVE}0{seq}"
+        reference = assinado.find(".//{http://www.w3.org/2000/09/xmldsig#}Reference")
+        assert reference.get("URI") == f"#ID210210{CHAVE}0{seq}"
@@ -147,17 +147,37 @@ function NotasFiscaisContent() {
     }
   };
 
+  const waitForJob = async (jobId: string) => {
+    // A sincronização roda em segundo plano (POST devolve 202 com o job)
+    for (;;) {
+      const { data } = await api.get(`/fiscal/jobs/${jobId}`);
+      if (data.status !== 'queued' && data.status !== 'running') {
+        return data;
+      }
+      await new Promise((resolve) => setTimeout(resolve, 2000));
+    }
+  };
+
   const handleSync = async () => {
     if (!selectedCompany) return;
 
     try {
       setSyncing(true);
-      const { data } = await api.post(`/fiscal/nfe/sync/${selectedCompany}`);
+      const { data: job } = await api.post('/fiscal/jobs/sync', {
+        company_id: parseInt(selectedCompany),
+      });
+      const finished = await waitForJob(job.id);
+      const data = finished.progress?.[selectedCompany] || {
+        status: finished.status,
+        docs_found: finished.docs_found,
+        docs_imported: finished.docs_imported,
+        error_message: finished.error_message,
+      };
       setLastSync(data);
       
       notifications.show({
         title: 'Sincronização Concluída',
-        message: `${data.docs_imported} documentos importados de ${data.docs_found} encontrados`,
+        message: `${data.docs_imported ?? 0} documentos importados de ${data.docs_found ?? 0} encontrados`,
         color: data.status === 'success' ? 'green' : data.status === 'partial' ? 'yellow' : 'orange',
       });
 
@@ -165,7 +185,7 @@ function NotasFiscaisContent() {
     } catch (error: any) {
       notifications.show({
         title: 'Erro na Sincronização',
-        message: error.response?.data?.error_message || 'Erro ao sincronizar',
+        message: error.response?.data?.detail || 'Erro ao sincronizar',
         color: 'red',
       });
     } finally {